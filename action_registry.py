@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+"""
+Action registry for the voice assistant.
+
+Actions are declared up front (built-ins below, plugin manifests, entry
+points with ASSISTANT_PLUGIN_ENTRY_POINTS=1) and their modules are imported
+only when the action first runs.
+
+A plugin is a .py file in a plugins directory with a literal ACTIONS dict:
+
+    ACTIONS = {
+        "open_notes": {
+            "function": "open_notes",
+            "params": [{"name": "title", "type": "str", "optional": True}],
+            "lane": "launch",
+            "description": "Открыть заметки",
+        },
+    }
+
+The manifest is read with ast, so discovering plugins never executes them.
+
+Actions are carried out by the registry's sink: LiveSink runs them in their
+lanes, DryRunSink only records what would have run.
+"""
+
+import ast
+import importlib
+import importlib.util
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Union
+
+ENTRY_POINT_GROUP = "loner_assistant.actions"
+PLUGIN_PACKAGE = "loner_assistant_plugins"
+LAUNCH_WORKERS = 4
+DRY_RUN_KEEP = 1000
+
+# Execution lanes
+LANE_INPUT = "input"    # serialized: mouse/keyboard, speech output, assistant state
+LANE_LAUNCH = "launch"  # parallel: opening apps and URLs, killing processes
+LANE_LONG = "long"      # own thread: commands that may run for a long time
+LANES = (LANE_INPUT, LANE_LAUNCH, LANE_LONG)
+
+PARAM_TYPES = {
+    "str": str,
+    "int": int,
+    "number": (int, float),
+    "bool": bool,
+    "any": object,
+}
+
+BUILTIN_ACTIONS = {
+    "open_app": ("assistant:open_app", [{"name": "app_name", "type": "str"}], LANE_LAUNCH,
+                 "Открыть приложение"),
+    "kill_process": ("assistant:kill_process", [{"name": "name", "type": "str"}], LANE_LAUNCH,
+                     "Закрыть процесс"),
+    "open_url": ("assistant:open_url", [{"name": "url", "type": "str"}], LANE_LAUNCH,
+                 "Открыть URL"),
+    "system_command": ("assistant:system_command", [{"name": "command", "type": "str", "variadic": True}],
+                       LANE_LAUNCH, "Выполнить системную команду (одна строка — через shell, несколько — как argv)"),
+    "list_jobs": ("assistant:list_jobs", [], LANE_INPUT, "Перечислить запущенные системные команды"),
+    "cancel_jobs": ("assistant:cancel_jobs", [], LANE_INPUT, "Отменить запущенные системные команды"),
+    "move_mouse": ("assistant:move_mouse", [], LANE_INPUT, "Двигать мышью"),
+    "click_mouse": ("assistant:click_mouse", [], LANE_INPUT, "Кликнуть мышью"),
+    "take_screenshot": ("assistant:take_screenshot", [], LANE_INPUT, "Сделать скриншот"),
+    "focus_mode": ("assistant:focus_mode", [], LANE_LAUNCH, "Режим фокуса"),
+    "say": ("assistant:say", [{"name": "text", "type": "str"}], LANE_INPUT, "Произнести текст"),
+    "profile_now": ("assistant:profile_now", [], LANE_INPUT, "Снять профиль работающего ассистента"),
+    "stop_profiling": ("assistant:stop_profiling", [], LANE_INPUT, "Выключить отслеживание памяти профилировщика"),
+    "disable_commands": ("assistant:disable_commands", [], LANE_INPUT, "Выключить команды"),
+    "enable_commands": ("assistant:enable_commands", [], LANE_INPUT, "Включить команды"),
+    "timer_5_minutes": ("assistant:timer_5_minutes", [], LANE_INPUT, "Таймер на 5 минут"),
+    "timer_10_minutes": ("assistant:timer_10_minutes", [], LANE_INPUT, "Таймер на 10 минут"),
+    "timer_30_minutes": ("assistant:timer_30_minutes", [], LANE_INPUT, "Таймер на 30 минут"),
+}
+
+# Built-in actions that only switch the assistant's own state: a dry run records them and still
+# applies them, so it matches the following utterances like a live run would
+STATE_ACTIONS = {"disable_commands", "enable_commands", "disable_commands_for"}
+
+def entry_points_enabled() -> bool:
+    """Entry points are scanned only with ASSISTANT_PLUGIN_ENTRY_POINTS=1: the scan reads every installed package"""
+    return os.environ.get("ASSISTANT_PLUGIN_ENTRY_POINTS", "") not in ("", "0")
+
+def default_plugin_dirs() -> List[str]:
+    """$ASSISTANT_PLUGINS (os.pathsep-separated) or plugins/ next to this file"""
+    env = os.environ.get("ASSISTANT_PLUGINS")
+    if env:
+        return [path for path in env.split(os.pathsep) if path]
+    return [os.path.join(os.path.dirname(os.path.abspath(__file__)), "plugins")]
+
+class ActionSpec(NamedTuple):
+    name: str
+    target: Union[str, Callable[..., Any]]  # "module:function", "path/to/file.py:function" or a callable
+    params: Optional[List[Dict[str, Any]]]  # None: not declared, anything goes
+    lane: str
+    description: str
+    source: str
+
+class LiveSink:
+    """Runs actions for real: input actions block and are serialized, the rest run in the background"""
+
+    dry_run = False
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.input_lock = threading.Lock()
+        self._launch_pool = None
+        self.launch_queued = 0  # submitted to the launch pool and not started yet
+
+    def _launch(self) -> ThreadPoolExecutor:
+        with self.lock:
+            if self._launch_pool is None:
+                self._launch_pool = ThreadPoolExecutor(max_workers=LAUNCH_WORKERS, thread_name_prefix="action")
+            return self._launch_pool
+
+    def execute(self, spec: ActionSpec, resolve: Callable[[], Callable[..., Any]], params: list,
+                context: Dict[str, Any]):
+        func = resolve()
+        if spec.lane == LANE_INPUT:
+            with self.input_lock:
+                return func(*params)
+        if spec.lane == LANE_LAUNCH:
+            pool = self._launch()
+            with self.lock:
+                self.launch_queued += 1
+            return pool.submit(self._started, spec.name, func, params)
+        thread = threading.Thread(target=self._guarded, args=(spec.name, func, params), daemon=True,
+                                  name=f"action-{spec.name}")
+        thread.start()
+        return thread
+
+    def _started(self, name: str, func: Callable[..., Any], params: list):
+        with self.lock:
+            self.launch_queued -= 1
+        self._guarded(name, func, params)
+
+    def queue_depths(self) -> Dict[str, int]:
+        return {"input_busy": int(self.input_lock.locked()),
+                "launch_queued": self.launch_queued,
+                "long_running": sum(1 for thread in threading.enumerate() if thread.name.startswith("action-"))}
+
+    @staticmethod
+    def _guarded(name: str, func: Callable[..., Any], params: list):
+        try:
+            func(*params)
+        except Exception as e:
+            print(f"Ошибка при выполнении действия {name}: {e}")
+            sys.stdout.flush()
+
+    def close(self):
+        pass
+
+def default_dry_run_log() -> str:
+    """Dry-run log used when it is switched on remotely: RPC clients do not get to pick the file"""
+    data_home = os.environ.get("XDG_DATA_HOME") or os.path.expanduser("~/.local/share")
+    return os.environ.get("ASSISTANT_DRY_RUN_LOG") or os.path.join(data_home, "loner_assistant", "dry_run.jsonl")
+
+class DryRunSink:
+    """Records actions instead of running them: the last DRY_RUN_KEEP in memory, all of them in an optional JSONL log"""
+
+    dry_run = True
+
+    def __init__(self, log_path: Optional[str] = None, on_record: Optional[Callable[[Dict[str, Any]], None]] = None,
+                 keep: int = DRY_RUN_KEEP):
+        self.log_path = log_path
+        self.on_record = on_record or (lambda record: None)
+        self.records = deque(maxlen=keep)
+        self.count = 0
+        self.lock = threading.Lock()
+        if log_path:
+            os.makedirs(os.path.dirname(os.path.abspath(log_path)), exist_ok=True)
+        self.file = open(log_path, 'a', encoding='utf-8') if log_path else None
+
+    def execute(self, spec: ActionSpec, resolve: Callable[[], Callable[..., Any]], params: list,
+                context: Dict[str, Any]):
+        # Plugin modules are not even imported: importing may have side effects too. State actions
+        # are applied; their feedback sounds go through this sink as well
+        record = {"ts": time.time(), "action": spec.name, "params": list(params), "lane": spec.lane, **context}
+        with self.lock:
+            self.records.append(record)
+            self.count += 1
+            if self.file:
+                self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.on_record(record)
+        if spec.name in STATE_ACTIONS and spec.source in ("builtin", "call"):
+            resolve()(*params)
+        return {"dry_run": True, "action": spec.name, "params": list(params)}
+
+    def queue_depths(self) -> Dict[str, int]:
+        return {"recorded": self.count}
+
+    def recent(self, limit: int = 50) -> List[Dict[str, Any]]:
+        with self.lock:
+            if self.file:
+                self.file.flush()
+            return list(self.records)[-limit:] if limit else list(self.records)
+
+    def close(self):
+        with self.lock:
+            if self.file:
+                self.file.close()
+                self.file = None
+
+class ActionRegistry:
+    """Action name -> spec, with lazy resolution; execution goes through a pluggable sink"""
+
+    def __init__(self):
+        self.specs: Dict[str, ActionSpec] = {}
+        self.modules: Dict[str, Any] = {}
+        self.resolved: Dict[str, Callable[..., Any]] = {}
+        self.lock = threading.Lock()
+        self.entry_points_lock = threading.Lock()
+        self.entry_points_pending = False
+        self.sink: Union[LiveSink, DryRunSink] = LiveSink()
+
+    def __contains__(self, name: str) -> bool:
+        return self.get(name) is not None
+
+    def __len__(self) -> int:
+        self._scan_entry_points()
+        return len(self.specs)
+
+    def names(self) -> List[str]:
+        self._scan_entry_points()
+        return list(self.specs)
+
+    def get(self, name: str) -> Optional[ActionSpec]:
+        spec = self.specs.get(name)
+        if spec is None and self.entry_points_pending:
+            self._scan_entry_points()
+            spec = self.specs.get(name)
+        return spec
+
+    def register(self, name: str, target: Union[str, Callable[..., Any]],
+                 params: Optional[List[Dict[str, Any]]] = None, lane: str = LANE_LAUNCH,
+                 description: str = "", source: str = "builtin"):
+        if lane not in LANES:
+            raise ValueError(f"Неизвестная очередь выполнения '{lane}' у действия {name}")
+        for param in params or []:
+            if param.get("type", "any") not in PARAM_TYPES:
+                raise ValueError(f"Неизвестный тип параметра '{param.get('type')}' у действия {name}")
+        with self.lock:
+            self.specs[name] = ActionSpec(name, target, params, lane, description, source)
+            self.resolved.pop(name, None)
+
+    def provide_module(self, name: str, module: Any):
+        """Use an already imported module for targets in it (e.g. assistant.py running as __main__)"""
+        self.modules[name] = module
+
+    def load_builtins(self):
+        for name, (target, params, lane, description) in BUILTIN_ACTIONS.items():
+            self.register(name, target, params, lane, description)
+
+    def discover(self, plugin_dirs: Optional[List[str]] = None, entry_points: bool = True):
+        """Register actions from plugin manifests without importing them; entry points are
+        scanned once, when an action is not found among the others (or all names are listed)
+        """
+        for directory in plugin_dirs if plugin_dirs is not None else default_plugin_dirs():
+            if not os.path.isdir(directory):
+                continue
+            for filename in sorted(os.listdir(directory)):
+                if filename.endswith(".py") and not filename.startswith("_"):
+                    self._load_manifest(os.path.join(directory, filename))
+        if entry_points:
+            self.entry_points_pending = True
+
+    def _load_manifest(self, path: str):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                tree = ast.parse(f.read(), filename=path)
+            manifest = None
+            for node in tree.body:
+                if (isinstance(node, ast.Assign) and len(node.targets) == 1
+                        and isinstance(node.targets[0], ast.Name) and node.targets[0].id == "ACTIONS"):
+                    manifest = ast.literal_eval(node.value)
+            if not isinstance(manifest, dict):
+                return
+            for name, data in manifest.items():
+                self.register(name, f"{path}:{data.get('function', name)}", data.get("params"),
+                              data.get("lane", LANE_LAUNCH), data.get("description", ""), source=path)
+        except (OSError, SyntaxError, ValueError, AttributeError) as e:
+            print(f"⚠️ Плагин {path} пропущен: {e}")
+            sys.stdout.flush()
+
+    def _scan_entry_points(self):
+        with self.entry_points_lock:
+            if self.entry_points_pending:
+                self._load_entry_points()
+                self.entry_points_pending = False
+
+    def _load_entry_points(self):
+        try:
+            from importlib.metadata import entry_points
+        except ImportError:
+            return
+        found = entry_points()
+        group = found.select(group=ENTRY_POINT_GROUP) if hasattr(found, "select") else found.get(ENTRY_POINT_GROUP, [])
+        for entry_point in group:
+            if entry_point.name not in self.specs:
+                self.register(entry_point.name, entry_point.value, source=f"entry point {entry_point.value}")
+
+    def _import(self, module_ref: str) -> Any:
+        module = self.modules.get(module_ref)
+        if module is not None:
+            return module
+        if module_ref.endswith(".py"):
+            module_name = f"{PLUGIN_PACKAGE}.{os.path.splitext(os.path.basename(module_ref))[0]}"
+            spec = importlib.util.spec_from_file_location(module_name, module_ref)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+        else:
+            module = importlib.import_module(module_ref)
+        self.modules[module_ref] = module
+        return module
+
+    def resolve(self, name: str) -> Callable[..., Any]:
+        """Callable for an action; imports its module on first use"""
+        func = self.resolved.get(name)
+        if func is not None:
+            return func
+        spec = self.specs[name]
+        with self.lock:
+            if callable(spec.target):
+                func = spec.target
+            else:
+                module_ref, _, attr = spec.target.rpartition(":")
+                func = getattr(self._import(module_ref), attr)
+            self.resolved[name] = func
+        return func
+
+    def validate(self, name: str, params: Any) -> Optional[str]:
+        """Error message if params do not fit the action's schema, else None"""
+        spec = self.get(name)
+        if spec is None:
+            return f"неизвестное действие '{name}'"
+        if not isinstance(params, list):
+            return "params должен быть списком"
+        if spec.params is None:
+            return None
+        schema = spec.params
+        variadic = bool(schema) and schema[-1].get("variadic", False)
+        required = sum(1 for param in schema if not param.get("optional"))
+        if len(params) < required or (not variadic and len(params) > len(schema)):
+            expected = f"{required}+" if variadic else (
+                str(required) if required == len(schema) else f"{required}–{len(schema)}")
+            return f"ожидается параметров: {expected}, передано {len(params)}"
+        for index, value in enumerate(params):
+            param = schema[min(index, len(schema) - 1)]
+            expected_type = PARAM_TYPES[param.get("type", "any")]
+            if not isinstance(value, expected_type) or (isinstance(value, bool) and param.get("type") in ("int", "number")):
+                return f"параметр {param['name']} должен иметь тип {param.get('type')}"
+        return None
+
+    def set_sink(self, sink: Union[LiveSink, DryRunSink]):
+        """Swap the execution sink; the previous one is closed (live lanes keep finishing their work)"""
+        previous, self.sink = self.sink, sink
+        if previous is not sink and previous.dry_run:
+            previous.close()
+
+    def run(self, name: str, params: Optional[list] = None, context: Optional[Dict[str, Any]] = None):
+        """Hand an action to the sink; with LiveSink it runs in its lane"""
+        spec = self.get(name)
+        if spec is None:
+            raise KeyError(name)
+        return self.sink.execute(spec, lambda: self.resolve(name), params or [], context or {})
+
+    def call(self, name: str, func: Callable[..., Any], params: list, lane: str = LANE_INPUT,
+             context: Optional[Dict[str, Any]] = None):
+        """Hand an unregistered callable (e.g. a grammar handler) to the sink like an action"""
+        spec = ActionSpec(name, func, None, lane, "", "call")
+        return self.sink.execute(spec, lambda: func, params, context or {})
+
+_default_registry = None
+
+def default_registry() -> ActionRegistry:
+    """Process-wide registry: built-ins plus discovered plugins (and entry points, if enabled)"""
+    global _default_registry
+    if _default_registry is None:
+        registry = ActionRegistry()
+        registry.load_builtins()
+        registry.discover(entry_points=entry_points_enabled())
+        _default_registry = registry
+    return _default_registry
@@ -0,0 +1,407 @@
+#!/usr/bin/env python3
+"""
+Application launcher: `open -a` on macOS, an index of installed apps elsewhere.
+
+On Linux the index is built once from .desktop files (XDG data dirs, Flatpak
+and Snap exports) and executables on $PATH. Apps are keyed by their English
+and localized names, desktop ids and binary names. The index is cached on
+disk and rebuilt when an application directory changes: inotify watches
+them while the assistant runs, and the directories' mtimes are compared
+when the cache is loaded. Resolving a name is a dictionary lookup, and apps
+are started directly, without a shell.
+"""
+
+import json
+import os
+import select
+import shlex
+import subprocess
+import sys
+import threading
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+CACHE_VERSION = 1
+REFRESH_DELAY = 1.0   # seconds of quiet after the last change before rebuilding (installs touch many files)
+OPEN_TIMEOUT = 10
+
+# Priority of a key when several apps claim it: lower wins
+PRIORITY_NAME = 0       # Name, Name[locale]
+PRIORITY_ID = 1         # desktop file id, StartupWMClass, binary of Exec
+PRIORITY_GENERIC = 2    # GenericName, GenericName[locale]
+PRIORITY_PATH = 3       # executables on $PATH
+
+# macOS app names used in commands.json -> names of their usual Linux counterparts
+APP_ALIASES = {
+    "finder": ("files", "nautilus", "dolphin", "nemo", "thunar", "pcmanfm"),
+    "terminal": ("gnome-terminal", "konsole", "xfce4-terminal", "x-terminal-emulator", "xterm"),
+    "system preferences": ("settings", "gnome-control-center", "systemsettings"),
+    "activity monitor": ("system monitor", "gnome-system-monitor", "plasma-systemmonitor", "htop"),
+    "mail": ("thunderbird", "evolution", "geary"),
+    "calendar": ("gnome-calendar", "korganizer"),
+    "notes": ("gnome-notes", "notes", "xpad"),
+    "maps": ("gnome-maps", "marble"),
+    "google chrome": ("google-chrome-stable", "chromium", "chromium-browser"),
+}
+
+# Exec field codes that stand for files, URLs or icons; the launcher passes none
+FIELD_CODES = {"%f", "%F", "%u", "%U", "%d", "%D", "%n", "%N", "%i", "%c", "%k", "%v", "%m"}
+
+class AppEntry(NamedTuple):
+    name: str
+    argv: List[str]
+    source: str      # .desktop file or executable
+    terminal: bool   # Terminal=true: needs a terminal emulator
+
+def normalize(name: str) -> str:
+    return " ".join(name.replace(".desktop", "").casefold().split())
+
+def default_cache_path() -> str:
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(cache_home, "loner_assistant", "apps.json")
+
+def desktop_dirs() -> List[str]:
+    """applications/ dirs in XDG precedence order (user first), plus Flatpak and Snap exports"""
+    data_home = os.environ.get("XDG_DATA_HOME") or os.path.expanduser("~/.local/share")
+    data_dirs = os.environ.get("XDG_DATA_DIRS") or "/usr/local/share:/usr/share"
+    roots = [data_home] + [path for path in data_dirs.split(":") if path]
+    roots += [os.path.join(data_home, "flatpak/exports/share"), "/var/lib/flatpak/exports/share"]
+    dirs = [os.path.join(root, "applications") for root in roots] + ["/var/lib/snapd/desktop/applications"]
+    return list(dict.fromkeys(os.path.normpath(path) for path in dirs))
+
+def path_dirs() -> List[str]:
+    return list(dict.fromkeys(os.path.normpath(path) for path in os.environ.get("PATH", "").split(os.pathsep) if path))
+
+def parse_exec(value: str) -> List[str]:
+    """argv from a .desktop Exec value, without field codes"""
+    try:
+        words = shlex.split(value)
+    except ValueError:
+        return []
+    argv = []
+    for word in words:
+        if word in FIELD_CODES:
+            continue
+        argv.append(word.replace("%%", "\0").replace("%", "").replace("\0", "%") if "%" in word else word)
+    return argv
+
+def read_desktop_entry(path: str) -> Dict[str, str]:
+    """Keys of the [Desktop Entry] group"""
+    fields = {}
+    group = None
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if line.startswith("["):
+                group = line
+                continue
+            if group == "[Desktop Entry]" and "=" in line:
+                key, value = line.split("=", 1)
+                fields.setdefault(key.strip(), value.strip())
+    return fields
+
+def directory_signature(dirs: List[str]) -> Dict[str, Optional[int]]:
+    """mtime of every directory (None if missing): changes when files are added or removed"""
+    signature = {}
+    for path in dirs:
+        try:
+            signature[path] = os.stat(path).st_mtime_ns
+        except OSError:
+            signature[path] = None
+    return signature
+
+class Inotify:
+    """Minimal inotify via ctypes; None from create() where it is not available"""
+
+    MASK = 0x8 | 0x40 | 0x80 | 0x100 | 0x200 | 0x4  # CLOSE_WRITE, MOVED_FROM/TO, CREATE, DELETE, ATTRIB
+    CLOEXEC = 0o2000000
+
+    def __init__(self, libc, fd: int):
+        self.libc = libc
+        self.fd = fd
+
+    @classmethod
+    def create(cls) -> Optional["Inotify"]:
+        if not sys.platform.startswith("linux"):
+            return None
+        try:
+            import ctypes
+            import ctypes.util
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            fd = libc.inotify_init1(cls.CLOEXEC)
+        except (OSError, AttributeError):
+            return None
+        return cls(libc, fd) if fd >= 0 else None
+
+    def watch(self, path: str) -> bool:
+        return self.libc.inotify_add_watch(self.fd, os.fsencode(path), self.MASK) >= 0
+
+    def wait(self, timeout: Optional[float]) -> bool:
+        """True if events arrived (they are drained)"""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if readable:
+            os.read(self.fd, 65536)
+        return bool(readable)
+
+    def close(self):
+        os.close(self.fd)
+
+class AppIndex:
+    """Installed applications by name, cached on disk and kept fresh while running"""
+
+    def __init__(self, cache_path: Optional[str] = None, applications: Optional[List[str]] = None,
+                 executables: Optional[List[str]] = None):
+        self.cache_path = cache_path or default_cache_path()
+        self.desktop_dirs = applications if applications is not None else desktop_dirs()
+        self.path_dirs = executables if executables is not None else path_dirs()
+        self.index: Optional[Tuple[List[AppEntry], Dict[str, int]]] = None
+        self.signature: Dict[str, Optional[int]] = {}
+        self.lock = threading.Lock()
+        self.watcher: Optional[threading.Thread] = None
+        self.stopping = threading.Event()
+        self.built_at = None
+
+    @property
+    def dirs(self) -> List[str]:
+        return self.desktop_dirs + self.path_dirs
+
+    def warm_up(self):
+        """Load (or build) the index and start watching for installs"""
+        self._ensure()
+        self.watch()
+
+    def _ensure(self) -> Tuple[List[AppEntry], Dict[str, int]]:
+        index = self.index
+        if index is not None:
+            return index
+        with self.lock:
+            if self.index is None:
+                if not self._load_cache():
+                    self._build()
+            return self.index
+
+    def _load_cache(self) -> bool:
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+        signature = directory_signature(self.dirs)
+        if data.get("version") != CACHE_VERSION or data.get("signature") != signature:
+            return False
+        entries = [AppEntry(name, argv, source, terminal) for name, argv, source, terminal in data["entries"]]
+        self.index = (entries, data["keys"])
+        self.signature = signature
+        self.built_at = data.get("built_at")
+        return True
+
+    def _build(self):
+        signature = directory_signature(self.dirs)
+        entries: List[AppEntry] = []
+        keys: Dict[str, Tuple[int, int]] = {}
+
+        def add_key(key: str, priority: int, index: int):
+            key = normalize(key)
+            if key and (key not in keys or keys[key][0] > priority):
+                keys[key] = (priority, index)
+
+        seen_ids = set()
+        for directory in self.desktop_dirs:
+            for root, _, files in os.walk(directory):
+                for filename in sorted(files):
+                    if not filename.endswith(".desktop"):
+                        continue
+                    path = os.path.join(root, filename)
+                    desktop_id = os.path.relpath(path, directory).replace(os.sep, "-")
+                    if desktop_id in seen_ids:
+                        continue  # shadowed by a dir earlier in XDG order
+                    seen_ids.add(desktop_id)
+                    try:
+                        fields = read_desktop_entry(path)
+                    except OSError:
+                        continue
+                    if fields.get("Type") != "Application" or fields.get("Hidden") == "true":
+                        continue
+                    argv = parse_exec(fields.get("Exec", ""))
+                    if not argv or "Name" not in fields:
+                        continue
+                    index = len(entries)
+                    entries.append(AppEntry(fields["Name"], argv, path, fields.get("Terminal") == "true"))
+                    for key, value in fields.items():
+                        if key == "Name" or key.startswith("Name["):
+                            add_key(value, PRIORITY_NAME, index)
+                        elif key == "GenericName" or key.startswith("GenericName["):
+                            add_key(value, PRIORITY_GENERIC, index)
+                    add_key(desktop_id, PRIORITY_ID, index)
+                    add_key(desktop_id.rsplit(".", 2)[-2] if desktop_id.count(".") > 1 else desktop_id, PRIORITY_ID, index)
+                    add_key(fields.get("StartupWMClass", ""), PRIORITY_ID, index)
+                    if argv[0] not in ("env", "flatpak", "snap"):
+                        add_key(os.path.basename(argv[0]), PRIORITY_ID, index)
+
+        for directory in self.path_dirs:
+            try:
+                scanned = list(os.scandir(directory))
+            except OSError:
+                continue
+            for entry in scanned:
+                key = normalize(entry.name)
+                if key in keys:
+                    continue
+                try:
+                    if not entry.is_file() or not os.access(entry.path, os.X_OK):
+                        continue
+                except OSError:
+                    continue
+                index = len(entries)
+                entries.append(AppEntry(entry.name, [entry.path], entry.path, False))
+                keys[key] = (PRIORITY_PATH, index)
+
+        self.index = (entries, {key: index for key, (_, index) in keys.items()})
+        self.signature = signature
+        self.built_at = time.time()
+        self._save_cache()
+
+    def _save_cache(self):
+        entries, keys = self.index
+        data = {"version": CACHE_VERSION, "built_at": self.built_at, "signature": self.signature,
+                "entries": [list(entry) for entry in entries], "keys": keys}
+        try:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            temporary = f"{self.cache_path}.{os.getpid()}.tmp"
+            with open(temporary, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(temporary, self.cache_path)
+        except OSError as e:
+            print(f"Не удалось сохранить кэш приложений: {e}")
+            sys.stdout.flush()
+
+    def refresh(self):
+        """Rebuild from the filesystem and rewrite the cache"""
+        with self.lock:
+            self._build()
+
+    def _stale(self) -> bool:
+        return directory_signature(self.dirs) != self.signature
+
+    def resolve(self, name: str) -> Optional[AppEntry]:
+        """App for a name, its aliases or its dashed/joined spelling"""
+        entries, keys = self._ensure()
+        key = normalize(name)
+        for candidate in (key, key.replace(" ", "-"), key.replace(" ", ""), *APP_ALIASES.get(key, ())):
+            index = keys.get(normalize(candidate))
+            if index is not None:
+                return entries[index]
+        return None
+
+    def command(self, entry: AppEntry) -> List[str]:
+        if not entry.terminal:
+            return entry.argv
+        terminal = self.resolve("x-terminal-emulator") or self.resolve("terminal")
+        return (terminal.argv + ["-e"] if terminal else []) + entry.argv
+
+    def open_app(self, name: str) -> AppEntry:
+        """Start an app by name; LookupError if it is not installed"""
+        entry = self.resolve(name)
+        if entry is None and not self.watching and self._stale():
+            # No inotify: a miss is the moment to notice an install
+            self.refresh()
+            entry = self.resolve(name)
+        if entry is None:
+            raise LookupError(f"Приложение не найдено: {name}")
+        try:
+            spawn(self.command(entry))
+        except FileNotFoundError:
+            # Uninstalled since the index was built
+            self.refresh()
+            entry = self.resolve(name)
+            if entry is None:
+                raise LookupError(f"Приложение не найдено: {name}")
+            spawn(self.command(entry))
+        return entry
+
+    def open_url(self, url: str):
+        spawn(["xdg-open", url])
+
+    @property
+    def watching(self) -> bool:
+        return self.watcher is not None and self.watcher.is_alive()
+
+    def watch(self) -> bool:
+        """Rebuild the index in the background when application dirs change; False without inotify"""
+        if self.watching:
+            return True
+        inotify = Inotify.create()
+        if inotify is None:
+            return False
+        watched = [path for path in self.dirs if os.path.isdir(path) and inotify.watch(path)]
+        if not watched:
+            inotify.close()
+            return False
+        self.stopping.clear()
+        self.watcher = threading.Thread(target=self._watch, args=(inotify,), daemon=True, name="app-index")
+        self.watcher.start()
+        return True
+
+    def _watch(self, inotify: Inotify):
+        try:
+            while not self.stopping.is_set():
+                if not inotify.wait(1.0):
+                    continue
+                while inotify.wait(REFRESH_DELAY) and not self.stopping.is_set():
+                    pass
+                if not self.stopping.is_set():
+                    self.refresh()
+        except OSError as e:
+            print(f"Ошибка отслеживания приложений: {e}")
+            sys.stdout.flush()
+        finally:
+            inotify.close()
+
+    def stop(self):
+        self.stopping.set()
+        if self.watcher:
+            self.watcher.join(timeout=2)
+            self.watcher = None
+
+    def status(self) -> Dict[str, object]:
+        entries, keys = self._ensure()
+        return {"apps": len(entries), "names": len(keys), "cache": self.cache_path,
+                "built_at": self.built_at, "watching": self.watching}
+
+class MacLauncher:
+    """LaunchServices does the lookup on macOS"""
+
+    def warm_up(self):
+        pass
+
+    def open_app(self, name: str) -> str:
+        result = subprocess.run(["open", "-a", name], capture_output=True, text=True, timeout=OPEN_TIMEOUT)
+        if result.returncode != 0:
+            raise LookupError(result.stderr.strip() or f"Приложение не найдено: {name}")
+        return name
+
+    def open_url(self, url: str):
+        subprocess.run(["open", url], check=True, timeout=OPEN_TIMEOUT)
+
+    def stop(self):
+        pass
+
+def spawn(argv: List[str]) -> subprocess.Popen:
+    """Start a detached process without a shell"""
+    return subprocess.Popen(argv, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                            start_new_session=True, close_fds=True)
+
+def default_launcher():
+    return MacLauncher() if sys.platform == "darwin" else AppIndex()
+
+if __name__ == "__main__":
+    index = AppIndex()
+    started = time.perf_counter()
+    index.refresh()
+    print(f"Приложений: {len(index.index[0])}, имён: {len(index.index[1])} "
+          f"за {time.perf_counter() - started:.2f} с, кэш: {index.cache_path}")
+    for name in sys.argv[1:]:
+        entry = index.resolve(name)
+        print(f"{name}: {entry.name + ' → ' + ' '.join(index.command(entry)) if entry else 'не найдено'}")
@@ -1,96 +1,300 @@
-import speech_recognition as sr
-import psutil
 import os
-import pyautogui
 import time
 from datetime import datetime
 import threading
 import subprocess
 import platform
-import pygame
-import pyttsx3
-import re
-import json
 import sys
 import signal
+from contextlib import contextmanager
 
-def load_commands():
-    """Load commands from JSON file"""
-    try:
-        with open('commands.json', 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        print("Файл commands.json не найден. Используются встроенные команды.")
-        sys.stdout.flush()
-        return {}
-    except json.JSONDecodeError as e:
-        print(f"Ошибка чтения JSON файла: {e}")
-        sys.stdout.flush()
-        return {}
+import action_registry
+import command_matcher
+import command_store
 
-success_sound = os.path.abspath("success.wav")
-error_sound = os.path.abspath("error.wav")
+# Heavy dependencies (speech_recognition, pyautogui, pygame, pyttsx3, psutil)
+# are imported inside the functions that need them, so importing this module
+# stays cheap for manage_commands.py, test_commands.py and the GUI.
 
-try:
-    pygame.mixer.init()
-except Exception as e:
-    print(f"Ошибка инициализации pygame mixer: {e}")
-    sys.stdout.flush()
+class StartupTimer:
+    """Startup phase durations and time-to-first-listen report"""
 
-def play_success():
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = []
+        self.background = []
+        self.reported = False
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name, background=False):
+        """Measure one startup phase"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            with self.lock:
+                if background and self.reported:
+                    print(f"⏱️ {name}: {elapsed:.2f} с (в фоне)")
+                    sys.stdout.flush()
+                (self.background if background else self.phases).append((name, elapsed))
+
+    def first_listen(self):
+        """Print the startup report once, when the microphone starts listening"""
+        with self.lock:
+            if self.reported:
+                return
+            self.reported = True
+            total = time.perf_counter() - self.started
+            parts = ", ".join(f"{name} {elapsed:.2f} с" for name, elapsed in self.phases)
+            print(f"⏱️ Время до первого прослушивания: {total:.2f} с ({parts})")
+            if self.background:
+                parts = ", ".join(f"{name} {elapsed:.2f} с" for name, elapsed in self.background)
+                print(f"⏱️ Готово в фоне: {parts}")
+            sys.stdout.flush()
+
+startup_timer = None
+
+class SoundService:
+    """Success/error sounds; pygame mixer is initialized on first use or in warm_up()"""
+
+    def __init__(self, success_path, error_path):
+        self.paths = {"success": success_path, "error": error_path}
+        self.sounds = {}
+        self.ready = threading.Event()
+        self.started = False
+        self.lock = threading.Lock()
+
+    def warm_up(self):
+        """Initialize the mixer and preload sounds"""
+        with self.lock:
+            if self.started:
+                return
+            self.started = True
+        try:
+            import pygame
+            pygame.mixer.init()
+            for name, path in self.paths.items():
+                if os.path.exists(path):
+                    self.sounds[name] = pygame.mixer.Sound(path)
+        except Exception as e:
+            print(f"Ошибка инициализации pygame mixer: {e}")
+            sys.stdout.flush()
+        finally:
+            self.ready.set()
+
+    def play(self, name):
+        if not self.started:
+            self.warm_up()
+        self.ready.wait()
+        sound = self.sounds.get(name)
+        if sound:
+            sound.play()
+
+class TTSService:
+    """pyttsx3 engine with voice selection done on first use or in warm_up()"""
+
+    def __init__(self):
+        self.engine = None
+        self.ready = threading.Event()
+        self.started = False
+        self.lock = threading.Lock()
+
+    def warm_up(self):
+        """Create the engine and pick a Russian voice"""
+        with self.lock:
+            if self.started:
+                return
+            self.started = True
+        try:
+            import pyttsx3
+            engine = pyttsx3.init()
+            voices = engine.getProperty('voices')
+            russian_voice = None
+            for voice in voices:
+                if 'russian' in voice.name.lower() or 'milena' in voice.name.lower():
+                    russian_voice = voice.id
+                    break
+            if russian_voice:
+                engine.setProperty('voice', russian_voice)
+            else:
+                if voices:
+                    engine.setProperty('voice', voices[0].id)
+            self.engine = engine
+        except Exception as e:
+            print(f"Ошибка инициализации TTS: {e}")
+            sys.stdout.flush()
+        finally:
+            self.ready.set()
+
+    def say(self, text):
+        if not self.started:
+            self.warm_up()
+        self.ready.wait()
+        if self.engine:
+            self.engine.say(text)
+            self.engine.runAndWait()
+
+sounds = SoundService(os.path.abspath("success.wav"), os.path.abspath("error.wav"))
+tts = TTSService()
+
+def init_services(timer=None):
+    """Warm up the mixer and TTS voice in the background while the mic starts listening"""
+    def warm(name, service):
+        if timer:
+            with timer.phase(name, background=True):
+                service.warm_up()
+        else:
+            service.warm_up()
+    threading.Thread(target=warm, args=("звук", sounds), daemon=True).start()
+    threading.Thread(target=warm, args=("голос", tts), daemon=True).start()
+    threading.Thread(target=warm, args=("приложения", get_launcher()), daemon=True).start()
+
+# Sounds and voice are skipped in fast text replay
+feedback_enabled = True
+
+def play_sound(name):
+    if not feedback_enabled:
+        return
+    if actions.sink.dry_run:
+        # Recorded like an action; the launch lane keeps a live sink from ever blocking on the input lane here
+        actions.call("play_sound", sounds.play, [name], action_registry.LANE_LAUNCH,
+                     context={"session": current_session().name})
+        return
     try:
-        if os.path.exists(success_sound):
-            pygame.mixer.Sound(success_sound).play()
+        sounds.play(name)
     except Exception as e:
-        print(f"Ошибка воспроизведения звука успеха: {e}")
+        print(f"Ошибка воспроизведения звука ({name}): {e}")
         sys.stdout.flush()
 
+def play_success():
+    play_sound("success")
+
 def play_error():
-    try:
-        if os.path.exists(error_sound):
-            pygame.mixer.Sound(error_sound).play()
-    except Exception as e:
-        print(f"Ошибка воспроизведения звука ошибки: {e}")
-        sys.stdout.flush()
-
-try:
-    engine = pyttsx3.init()
-    voices = engine.getProperty('voices')
-    russian_voice = None
-    for voice in voices:
-        if 'russian' in voice.name.lower() or 'milena' in voice.name.lower():
-            russian_voice = voice.id
-            break
-    if russian_voice:
-        engine.setProperty('voice', russian_voice)
-    else:
-        if voices:
-            engine.setProperty('voice', voices[0].id)
-except Exception as e:
-    print(f"Ошибка инициализации TTS: {e}")
-    sys.stdout.flush()
-    engine = None
+    play_sound("error")
 
 def say(text):
     print(f"🗣️ {text}")
     sys.stdout.flush()
+    if not feedback_enabled:
+        return
     try:
-        if engine:
-            engine.say(text)
-            engine.runAndWait()
+        tts.say(text)
     except Exception as e:
         print(f"Ошибка озвучки: {e}")
         sys.stdout.flush()
+    # Do not take the assistant's own voice for a command
+    for session in sessions:
+        if session.capture:
+            session.capture.skip()
+
+class Session:
+    """One input device and its state: commands on/off and the note being dictated.
+
+    The command matcher, recognizers, action registry, sounds and voice are
+    shared by all sessions of the process.
+    """
+
+    def __init__(self, name, device_index=None):
+        self.name = name
+        self.device_index = device_index
+        self.commands_enabled = True
+        self.recording_note = False
+        self.note_lines = []
+        self.capture = None
+        self.recognizer = None
+        self.idle = threading.Event()
+        self.idle.set()
+        self.lock = threading.RLock()
+        self.thread = None
+
+    def get_capture(self):
+        """Microphone capture that keeps running between commands, created on first use"""
+        if self.capture is None:
+            from audio_capture import ContinuousCapture
+            self.capture = ContinuousCapture(device_index=self.device_index)
+        return self.capture
+
+    def get_recognizer(self):
+        """Per-session recognizer settings (the energy threshold adapts to this microphone)"""
+        if self.recognizer is None:
+            import speech_recognition as sr
+            self.recognizer = sr.Recognizer()
+        return self.recognizer
+
+    def release_microphone(self):
+        if self.capture:
+            self.capture.stop()
+
+    def export(self):
+        with self.lock:
+            return {
+                "commands_enabled": self.commands_enabled,
+                "recording_note": self.recording_note,
+                "note_lines": list(self.note_lines),
+            }
+
+    def apply(self, state):
+        with self.lock:
+            self.commands_enabled = state.get("commands_enabled", True)
+            self.recording_note = state.get("recording_note", False)
+            self.note_lines[:] = state.get("note_lines", [])
+
+    def status(self):
+        return {
+            "name": self.name,
+            "device": self.device_index,
+            "commands_enabled": self.commands_enabled,
+            "recording_note": self.recording_note,
+            "note_lines": len(self.note_lines),
+            "listening": not self.idle.is_set(),
+        }
+
+sessions = [Session("default")]
+session_local = threading.local()
+
+def parse_sessions(specs):
+    """Sessions from "name=device_index" items; a bare number is a device, a bare name the default device"""
+    result = []
+    for index, spec in enumerate(specs):
+        name, _, device = spec.partition("=")
+        if not device and name.strip().isdigit():
+            name, device = f"mic{name.strip()}", name
+        name = name.strip() or f"session{index + 1}"
+        if any(session.name == name for session in result):
+            raise ValueError(f"Сессия {name} указана дважды")
+        result.append(Session(name, int(device) if device.strip() else None))
+    return result or [Session("default")]
+
+def current_session():
+    """Session of the calling thread; the first session for timers, RPC and background actions"""
+    return getattr(session_local, "session", None) or sessions[0]
+
+def find_session(name=None):
+    if name is None:
+        return sessions[0]
+    for session in sessions:
+        if session.name == name:
+            return session
+    raise ValueError(f"Неизвестная сессия: {name}")
+
+@contextmanager
+def in_session(session):
+    previous = getattr(session_local, "session", None)
+    session_local.session = session
+    try:
+        yield session
+    finally:
+        session_local.session = previous
 
-commands_enabled = True
-recording_note = False
-note_lines = []
 screen_recording = False
 recording_process = None
 
 def kill_process(name):
     found = False
     try:
+        import psutil
         for proc in psutil.process_iter(['name']):
             if name.lower() in proc.info['name'].lower():
                 proc.kill()
@@ -104,10 +308,24 @@ def kill_process(name):
         sys.stdout.flush()
         play_error()
 
+launcher = None
+
+def get_launcher():
+    """`open -a` on macOS, the cached index of installed apps elsewhere"""
+    global launcher
+    if launcher is None:
+        import app_resolver
+        launcher = app_resolver.default_launcher()
+    return launcher
+
 def open_app(app_name):
     try:
-        os.system(f"open -a '{app_name}'")
+        get_launcher().open_app(app_name)
         play_success()
+    except LookupError as e:
+        print(f"❌ {e}")
+        sys.stdout.flush()
+        play_error()
     except Exception as e:
         print(f"Ошибка при открытии приложения {app_name}: {e}")
         sys.stdout.flush()
@@ -116,25 +334,123 @@ def open_app(app_name):
 def open_url(url):
     """Open URL in browser"""
     try:
-        os.system(f"open '{url}'")
+        get_launcher().open_url(url)
         play_success()
     except Exception as e:
         print(f"Ошибка при открытии URL {url}: {e}")
         sys.stdout.flush()
         play_error()
 
-def system_command(command):
-    """Execute system command"""
-    try:
-        os.system(command)
+jobs = None
+
+def job_runner():
+    """Background runner for system commands, created on first use"""
+    global jobs
+    if jobs is None:
+        from job_runner import JobRunner
+        jobs = JobRunner(on_output=on_job_output, on_finished=on_job_finished)
+    return jobs
+
+def on_job_output(job, line):
+    print(f"💻 [{job.id}] {line}")
+    sys.stdout.flush()
+    publish_event("job_output", job=job.id, line=line)
+
+def on_job_finished(job):
+    publish_event("job_finished", **job.to_dict())
+    if job.status == "done":
         play_success()
+    elif job.status != "cancelled":
+        print(f"❌ Команда [{job.id}] {job.title}: {job.status}, код {job.returncode}")
+        sys.stdout.flush()
+        play_error()
+
+def system_command(*command):
+    """Run a system command in the job runner; one string goes through the shell, several are argv.
+
+    Commands that power the machine off or delete data need ASSISTANT_ALLOW_DESTRUCTIVE=1.
+    """
+    from job_runner import destructive_allowed, is_destructive
+    command = command[0] if len(command) == 1 else list(command)
+    title = command if isinstance(command, str) else " ".join(command)
+    if is_destructive(command) and not destructive_allowed():
+        print(f"⛔ Команда «{title}» выключает компьютер или удаляет данные и не выполнена. "
+              f"Чтобы разрешить такие команды, запустите ассистента с ASSISTANT_ALLOW_DESTRUCTIVE=1")
+        sys.stdout.flush()
+        play_error()
+        return
+    try:
+        job = job_runner().submit(command)
+        print(f"💻 [{job.id}] {job.title}")
+        sys.stdout.flush()
     except Exception as e:
-        print(f"Ошибка при выполнении команды {command}: {e}")
+        print(f"Ошибка при выполнении команды {title}: {e}")
+        sys.stdout.flush()
+        play_error()
+
+def list_jobs():
+    running = jobs.running() if jobs else []
+    for job in running:
+        print(f"💻 [{job.id}] {job.status}: {job.title}")
+    sys.stdout.flush()
+    say(f"Запущено команд: {len(running)}" if running else "Нет запущенных команд")
+
+def cancel_jobs():
+    cancelled = jobs.cancel() if jobs else []
+    if cancelled:
+        say(f"Отменено команд: {len(cancelled)}")
+    else:
+        play_error()
+
+profiler = None
+
+def get_profiler():
+    """Profiler for this process, created on first use; nothing is sampled or traced until a dump is asked for"""
+    global profiler
+    if profiler is None:
+        import profiler as profiling
+        profiler = profiling.Profiler(queue_depths)
+    return profiler
+
+def queue_depths():
+    """Work waiting in each part of the assistant, for profile dumps"""
+    depths = {"actions": actions.sink.queue_depths(), "timers": len(scheduled_timers),
+              "jobs": len(jobs.running()) if jobs else 0}
+    for session in sessions:
+        depths[f"session {session.name}"] = {
+            "listening": not session.idle.is_set(),
+            "audio_backlog_seconds": round(session.capture.backlog_seconds(), 2) if session.capture else 0.0,
+        }
+    if control_server:
+        depths["control_server"] = control_server.queue_depths()
+    if http_server:
+        depths["http_server"] = http_server.queue_depths()
+    return depths
+
+def on_profile_done(path):
+    if path:
+        print(f"📈 Профиль сохранён: {path}")
         sys.stdout.flush()
+        publish_event("profile", path=path)
+
+def start_profile(seconds=None, memory=True):
+    import profiler as profiling
+    return get_profiler().start_in_background(seconds or profiling.PROFILE_SECONDS, memory, on_done=on_profile_done)
+
+def profile_now():
+    if start_profile():
+        say("Снимаю профиль")
+    else:
         play_error()
 
+def stop_profiling():
+    if profiler:
+        profiler.stop()
+    play_success()
+
 def move_mouse():
     try:
+        import pyautogui
         pyautogui.move(100, 0, duration=0.5)
         pyautogui.move(-100, 0, duration=0.5)
         play_success()
@@ -145,6 +461,7 @@ def move_mouse():
 
 def click_mouse():
     try:
+        import pyautogui
         pyautogui.click()
         play_success()
     except Exception as e:
@@ -155,6 +472,7 @@ def click_mouse():
 def close_all(name):
     count = 0
     try:
+        import psutil
         for proc in psutil.process_iter(['name']):
             if name.lower() in proc.info['name'].lower():
                 proc.kill()
@@ -172,6 +490,7 @@ def take_screenshot():
     try:
         now = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
         filepath = os.path.expanduser(f"~/Desktop/screenshot_{now}.png")
+        import pyautogui
         screenshot = pyautogui.screenshot()
         screenshot.save(filepath)
         play_success()
@@ -193,18 +512,22 @@ def focus_mode():
         play_error()
 
 def append_note(text):
-    global note_lines
-    note_lines.append(text)
+    current_session().note_lines.append(text)
+
+def write_note(path, lines):
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(f"{datetime.now()}\n" + "\n".join(lines) + "\n\n")
+    play_success()
 
 def save_note():
-    global note_lines
+    session = current_session()
     try:
-        if note_lines:
+        if session.note_lines:
             path = os.path.expanduser("~/Desktop/voice_note.txt")
-            with open(path, 'a', encoding='utf-8') as f:
-                f.write(f"{datetime.now()}\n" + "\n".join(note_lines) + "\n\n")
-            note_lines = []
-            play_success()
+            # Through the action sink, so a dry run records the note instead of writing it
+            actions.call("save_note", write_note, [path, list(session.note_lines)],
+                         context={"session": session.name})
+            session.note_lines = []
         else:
             play_error()
     except Exception as e:
@@ -213,18 +536,55 @@ def save_note():
         play_error()
 
 def cancel_note():
-    global note_lines
-    note_lines.clear()
+    current_session().note_lines.clear()
     play_success()
 
+scheduled_timers = {}
+timers_lock = threading.Lock()
+timer_ids = iter(range(1, sys.maxsize))
+
+def schedule_timer(deadline, kind, text=None, session=None):
+    """Schedule a timer event at a wall-clock deadline so it can be handed over to a new process"""
+    with timers_lock:
+        timer_id = next(timer_ids)
+
+    def fire():
+        with timers_lock:
+            if scheduled_timers.pop(timer_id, None) is None:
+                return
+        if kind == "say":
+            say(text)
+        elif kind == "enable_commands":
+            try:
+                target = find_session(session)
+            except ValueError:
+                target = sessions[0]
+            with in_session(target):
+                enable_commands()
+
+    timer = threading.Timer(max(0.0, deadline - time.time()), fire)
+    timer.daemon = True
+    with timers_lock:
+        scheduled_timers[timer_id] = {"deadline": deadline, "kind": kind, "text": text, "session": session,
+                                      "timer": timer}
+    timer.start()
+    return timer_id
+
+def export_timers():
+    """Cancel pending timers and return them for a handover"""
+    with timers_lock:
+        pending = list(scheduled_timers.values())
+        scheduled_timers.clear()
+    for item in pending:
+        item["timer"].cancel()
+    return [{"deadline": item["deadline"], "kind": item["kind"], "text": item["text"], "session": item["session"]}
+            for item in pending]
+
 def timer_5_minutes():
     """Set timer for 5 minutes"""
     try:
         say("Таймер на 5 минут установлен")
-        def timer_callback():
-            time.sleep(300)
-            say("Время истекло! Таймер на 5 минут завершен")
-        threading.Thread(target=timer_callback, daemon=True).start()
+        schedule_timer(time.time() + 300, "say", "Время истекло! Таймер на 5 минут завершен")
     except Exception as e:
         print(f"Ошибка установки таймера: {e}")
         sys.stdout.flush()
@@ -234,10 +594,7 @@ def timer_10_minutes():
     """Set timer for 10 minutes"""
     try:
         say("Таймер на 10 минут установлен")
-        def timer_callback():
-            time.sleep(600)
-            say("Время истекло! Таймер на 10 минут завершен")
-        threading.Thread(target=timer_callback, daemon=True).start()
+        schedule_timer(time.time() + 600, "say", "Время истекло! Таймер на 10 минут завершен")
     except Exception as e:
         print(f"Ошибка установки таймера: {e}")
         sys.stdout.flush()
@@ -247,60 +604,44 @@ def timer_30_minutes():
     """Set timer for 30 minutes"""
     try:
         say("Таймер на 30 минут установлен")
-        def timer_callback():
-            time.sleep(1800)
-            say("Время истекло! Таймер на 30 минут завершен")
-        threading.Thread(target=timer_callback, daemon=True).start()
+        schedule_timer(time.time() + 1800, "say", "Время истекло! Таймер на 30 минут завершен")
     except Exception as e:
         print(f"Ошибка установки таймера: {e}")
         sys.stdout.flush()
         play_error()
 
-FUNCTION_MAP = {
-    "open_app": open_app,
-    "kill_process": kill_process,
-    "open_url": open_url,
-    "system_command": system_command,
-    "move_mouse": move_mouse,
-    "click_mouse": click_mouse,
-    "take_screenshot": take_screenshot,
-    "focus_mode": focus_mode,
-    "say": say,
-    "disable_commands": lambda: disable_commands(),
-    "enable_commands": lambda: enable_commands(),
-    "timer_5_minutes": timer_5_minutes,
-    "timer_10_minutes": timer_10_minutes,
-    "timer_30_minutes": timer_30_minutes
-}
+# Built-in actions are declared in action_registry.BUILTIN_ACTIONS and point
+# at functions in this module; plugins are imported on first use.
+actions = action_registry.default_registry()
+actions.provide_module("assistant", sys.modules[__name__])
 
 def disable_commands():
-    global commands_enabled
-    commands_enabled = False
+    session = current_session()
+    session.commands_enabled = False
+    publish_event("state", session=session.name, commands_enabled=False)
     play_success()
 
 def enable_commands():
-    global commands_enabled
-    commands_enabled = True
+    session = current_session()
+    session.commands_enabled = True
+    publish_event("state", session=session.name, commands_enabled=True)
     play_success()
 
 def disable_commands_for(duration, unit):
-    global commands_enabled
-    commands_enabled = False
+    session = current_session()
+    session.commands_enabled = False
     play_success()
     seconds = duration
     if unit.startswith('мин'):
         seconds *= 60
     elif unit.startswith('час'):
         seconds *= 3600
-    def reenable():
-        global commands_enabled
-        time.sleep(seconds)
-        commands_enabled = True
-        play_success()
-    threading.Thread(target=reenable, daemon=True).start()
+    publish_event("state", session=session.name, commands_enabled=False)
+    schedule_timer(time.time() + seconds, "enable_commands", session=session.name)
 
 def click_mouse_times(times):
     try:
+        import pyautogui
         for _ in range(times):
             pyautogui.click()
             time.sleep(0.1)
@@ -321,6 +662,7 @@ def move_mouse_direction(direction, pixels):
             dx = -pixels
         elif direction == 'вправо':
             dx = pixels
+        import pyautogui
         pyautogui.move(dx, dy, duration=0.5)
         play_success()
     except Exception as e:
@@ -328,18 +670,24 @@ def move_mouse_direction(direction, pixels):
         sys.stdout.flush()
         play_error()
 
+# Handlers for the parametric grammar in command_matcher.GRAMMAR
+GRAMMAR_ACTIONS = {
+    "disable_commands_for": disable_commands_for,
+    "click_mouse_times": click_mouse_times,
+    "move_mouse_direction": move_mouse_direction,
+}
+
+# Returned by execute_command when the action is unknown or raised
+ACTION_FAILED = object()
+
 def execute_command(command_data):
     """Execute command based on JSON data"""
     try:
         action = command_data.get("action")
         params = command_data.get("params", [])
         
-        if action in FUNCTION_MAP:
-            func = FUNCTION_MAP[action]
-            if params:
-                func(*params)
-            else:
-                func()
+        if action in actions:
+            return actions.run(action, params, {"session": current_session().name})
         else:
             print(f"Неизвестное действие: {action}")
             sys.stdout.flush()
@@ -348,129 +696,779 @@ def execute_command(command_data):
         print(f"Ошибка при выполнении команды: {e}")
         sys.stdout.flush()
         play_error()
+    return ACTION_FAILED
 
-def recognize_command():
-    global recording_note, commands_enabled
-    
-    commands_data = load_commands()
-    
+commands_matcher = command_matcher.CommandMatcher([])
+commands_version = None
+commands_from_bundle = False
+command_lock = threading.RLock()
+control_server = None
+http_server = None
+http_address = None
+started_at = time.time()
+
+LISTEN_TIMEOUT = 1
+HANDOFF_TIMEOUT = 15
+ready = threading.Event()
+listening_allowed = threading.Event()
+shutdown_requested = threading.Event()
+
+def publish_event(event_type, **data):
+    """Push an event to control socket and WebSocket subscribers"""
+    if control_server:
+        control_server.publish(event_type, **data)
+    if http_server:
+        http_server.publish(event_type, **data)
+
+def store_version():
     try:
-        r = sr.Recognizer()
-        with sr.Microphone() as source:
-            print("Слушаю...")
-            sys.stdout.flush()
-            audio = r.listen(source)
-        try:
-            text = r.recognize_google(audio, language="ru-RU").lower()
-            print(f"Ты сказал: {text}")
-            sys.stdout.flush()
+        return list(command_store.open_store().version())
+    except Exception:
+        return None
 
-            if recording_note:
-                if "сохрани заметку" in text:
-                    save_note()
-                    recording_note = False
-                    return
-                elif "удали заметку" in text:
-                    cancel_note()
-                    recording_note = False
-                    return
-                else:
-                    append_note(text)
-                    return
-
-            if "запиши заметку" in text:
-                recording_note = True
-                note_lines.clear()
-                play_success()
-                return
+def reload_commands():
+    """Force reload of commands: the compiled bundle if it is current, the store otherwise"""
+    global commands_matcher, commands_version, commands_from_bundle
+    commands_version = store_version()
+    try:
+        commands_matcher, commands_from_bundle = command_matcher.load_matcher(command_store.open_store())
+    except Exception as e:
+        print(f"Ошибка чтения базы команд: {e}")
+        sys.stdout.flush()
+        commands_matcher, commands_from_bundle = command_matcher.CommandMatcher([]), False
+    publish_event("reloaded", commands=len(commands_matcher))
+    return commands_matcher
 
-            for category, commands in commands_data.items():
-                for cmd_phrase, cmd_data in commands.items():
-                    if cmd_phrase in text:
-                        if category == "assistant_control":
-                            execute_command(cmd_data)
-                            return
-                        
-                        if cmd_phrase == "включи команды":
-                            execute_command(cmd_data)
-                            return
-
-                        if not commands_enabled:
-                            print("Команды выключены.")
-                            sys.stdout.flush()
-                            return
-                        
-                        execute_command(cmd_data)
-                        return
-
-            m = re.search(r"выключи команды на (\d+) (секунд[уы]?|минут[уы]?|час[аов]?)", text)
-            if m:
-                duration = int(m.group(1))
-                unit = m.group(2)
-                disable_commands_for(duration, unit)
-                return
-            m = re.search(r"кликни (\d+) раз", text)
-            if m:
-                times = int(m.group(1))
-                click_mouse_times(times)
-                return
-            m = re.search(r"пошевели мышкой (вверх|вниз|влево|вправо) (\d+) пиксел[еяй]", text)
-            if m:
-                direction = m.group(1)
-                pixels = int(m.group(2))
-                move_mouse_direction(direction, pixels)
-                return
+def get_commands():
+    """Cached command matcher, rebuilt when the store's version moves"""
+    if store_version() != commands_version or commands_version is None:
+        reload_commands()
+    return commands_matcher
+
+def process_text(text, session=None, source="rpc", recognize_time=None, backend=None):
+    """Run a transcript through note handling, phrase matching and the regex grammar; recorded in the history"""
+    session = session or current_session()
+    started = time.perf_counter()
+    timings = {}
+    result = run_transcript(text, session, timings)
+    if history:
+        outcome = "error" if result.get("failed") else result["result"]
+        fields = dict(transcript=None if outcome == "note_line" else text,
+                      command=result.get("command"), action=result.get("action"),
+                      session=session.name, source=source, backend=backend, ts=time.time(),
+                      recognize_time=recognize_time, match_time=timings.get("match"),
+                      action_time=timings.get("action"),
+                      total_time=(recognize_time or 0) + time.perf_counter() - started)
+        handle = timings.get("handle")
+        if hasattr(handle, "add_done_callback"):
+            # Launch-lane actions finish in the pool: the entry is recorded once their real duration is known
+            action_started = timings["action_started"]
+            handle.add_done_callback(lambda _: record_history(
+                outcome, **dict(fields, action_time=time.perf_counter() - action_started)))
+        else:
+            record_history(outcome, **fields)
+    return result
+
+def run_transcript(text, session, timings):
+    with command_lock:
+        matcher = get_commands()
 
-            if not commands_enabled:
+    # Sessions share the matcher but run their commands independently
+    with in_session(session), session.lock:
+        publish_event("recognized", session=session.name, text=text)
+
+        if session.recording_note:
+            if NOTE_CONTROL_PHRASES[0] in text:
+                save_note()
+                session.recording_note = False
+                return {"result": "note_saved"}
+            elif NOTE_CONTROL_PHRASES[1] in text:
+                cancel_note()
+                session.recording_note = False
+                return {"result": "note_cancelled"}
+            else:
+                append_note(text)
+                return {"result": "note_line"}
+
+        if NOTE_START_PHRASES[0] in text:
+            session.recording_note = True
+            session.note_lines.clear()
+            play_success()
+            return {"result": "note_started"}
+
+        match_started = time.perf_counter()
+        match = matcher.match_command(text)
+        timings["match"] = time.perf_counter() - match_started
+        if isinstance(match, command_matcher.Match):
+            entry = match.entry
+            if entry.category != "assistant_control" and entry.phrase != "включи команды" and not session.commands_enabled:
                 print("Команды выключены.")
                 sys.stdout.flush()
-                return
+                return {"result": "disabled", "command": entry.phrase}
+
+            publish_event("command", session=session.name, command=entry.phrase, category=entry.category,
+                          action=entry.action)
+            timings["action_started"] = time.perf_counter()
+            handle = timings["handle"] = execute_command({"action": entry.action, "params": entry.params})
+            timings["action"] = time.perf_counter() - timings["action_started"]
+            result = {"result": "command", "command": entry.phrase, "category": entry.category, "action": entry.action}
+            if handle is ACTION_FAILED:
+                result["failed"] = True
+            return dry_run_marked(result)
+
+        grammar = match
+        if grammar and grammar.action in GRAMMAR_ACTIONS:
+            # Like phrases, parametric commands wait for "включи команды"
+            if not session.commands_enabled and grammar.action != "disable_commands_for":
+                print("Команды выключены.")
+                sys.stdout.flush()
+                return {"result": "disabled", "action": grammar.action}
+            timings["action_started"] = time.perf_counter()
+            timings["handle"] = actions.call(grammar.action, GRAMMAR_ACTIONS[grammar.action], grammar.params,
+                                             context={"session": session.name})
+            timings["action"] = time.perf_counter() - timings["action_started"]
+            return dry_run_marked({"result": "grammar", "action": grammar.action, "params": grammar.params})
+
+        if not session.commands_enabled:
+            print("Команды выключены.")
+            sys.stdout.flush()
+            return {"result": "disabled"}
+
+        play_error()
+        publish_event("unmatched", session=session.name, text=text)
+        return {"result": "unmatched"}
+
+history = None
+
+def start_history():
+    """Record every utterance in the history store ($ASSISTANT_HISTORY_DB) from a background writer"""
+    global history
+    import history_store
+    history = history_store.HistoryRecorder()
+    history.start()
+    return history
+
+def stop_history():
+    global history
+    if history:
+        history.stop()
+        history = None
+
+def record_history(outcome, **fields):
+    if history:
+        return history.record(outcome, **fields)
+
+def dry_run_marked(result):
+    if actions.sink.dry_run:
+        result["dry_run"] = True
+    return result
+
+def set_dry_run(enabled, log_path=None):
+    """Switch between performing actions and only recording them (optionally to a JSONL file)"""
+    if enabled:
+        sink = action_registry.DryRunSink(log_path or None, on_record=lambda record: publish_event("dry_run", **record))
+        print("🧪 Пробный запуск: действия только записываются" + (f" в {log_path}" if log_path else ""))
+    else:
+        sink = action_registry.LiveSink()
+        print("🧪 Пробный запуск выключен: действия выполняются")
+    sys.stdout.flush()
+    actions.set_sink(sink)
+    return sink
+
+NOTE_START_PHRASES = ("запиши заметку",)
+NOTE_CONTROL_PHRASES = ("сохрани заметку", "удали заметку")
+
+def release_microphone():
+    for session in sessions:
+        session.release_microphone()
+
+recognition = None
+
+def get_recognition():
+    """Hedged recognizer over $ASSISTANT_BACKENDS, created on first use"""
+    global recognition
+    if recognition is None:
+        import dictation
+        from recognition import HedgedRecognizer
+        recognition = HedgedRecognizer.from_env(accept=lambda alternatives: pick_transcript(alternatives).match is not None,
+                                                on_breaker=on_breaker_change,
+                                                concurrency=len(sessions) * dictation.WORKERS)
+    return recognition
+
+BREAKER_MESSAGES = {
+    "open": "📴 Распознавание через {backend} отключено: {reason}",
+    "half_open": "🔌 Пробую снова распознавание через {backend}",
+    "closed": "📶 Распознавание через {backend} снова работает",
+}
+
+def on_breaker_change(backend, state, previous, reason):
+    print(BREAKER_MESSAGES[state].format(backend=backend, reason=reason))
+    sys.stdout.flush()
+    publish_event("breaker", backend=backend, state=state, previous=previous, reason=reason)
 
+def pick_transcript(alternatives):
+    """Best hypothesis for the current mode: note control phrases while recording, commands otherwise"""
+    with command_lock:
+        matcher = get_commands()
+        if current_session().recording_note:
+            ranked = matcher.rank_alternatives(alternatives, NOTE_CONTROL_PHRASES, commands=False)
+        else:
+            ranked = matcher.rank_alternatives(alternatives, NOTE_START_PHRASES)
+    return ranked[0]
+
+def recognize_command(session=None):
+    session = session or sessions[0]
+    prefix = f"[{session.name}] " if len(sessions) > 1 else ""
+    session.idle.clear()
+    try:
+        import speech_recognition as sr
+        from recognition import OfflineError
+        r = session.get_recognizer()
+        source = session.get_capture()
+        print(f"{prefix}Слушаю...")
+        sys.stdout.flush()
+        publish_event("listening", session=session.name)
+        if startup_timer:
+            startup_timer.first_listen()
+        if session.recording_note and streaming_dictation:
+            dictate(session, r, source, prefix)
+            return
+        audio = None
+        # Short listen timeouts let a handover take the microphone between phrases
+        while audio is None:
+            if not listening_allowed.is_set():
+                return
+            try:
+                audio = source.listen(r, timeout=LISTEN_TIMEOUT)
+            except sr.WaitTimeoutError:
+                pass
+        recognize_started = time.perf_counter()
+        try:
+            with in_session(session):
+                backend, alternatives = get_recognition().recognize(r, audio)
+                best = pick_transcript(alternatives)
+            print(f"{prefix}Ты сказал: {best.text}" + (f" [{backend}]" if backend != recognition.backends[0].name else ""))
+            if best.rank:
+                print(f"  (вариант {best.rank + 1} из {len(alternatives)}; первый: {alternatives[0][0]})")
+            sys.stdout.flush()
+            process_text(best.text, session, source="voice", backend=backend,
+                         recognize_time=time.perf_counter() - recognize_started)
+        except OfflineError:
+            # No network wait: every backend is known to be down until its next probe
+            print("📴 Распознавание недоступно, команда не выполнена")
+            sys.stdout.flush()
+            record_history("recognition_error", session=session.name, source="voice",
+                           recognize_time=time.perf_counter() - recognize_started)
             play_error()
         except sr.UnknownValueError:
+            record_history("not_recognized", session=session.name, source="voice",
+                           recognize_time=time.perf_counter() - recognize_started)
             play_error()
         except sr.RequestError as e:
             print(f"Ошибка распознавания речи: {e}")
             sys.stdout.flush()
+            record_history("recognition_error", session=session.name, source="voice",
+                           recognize_time=time.perf_counter() - recognize_started)
             play_error()
     except Exception as e:
-        print(f"Ошибка при работе с микрофоном: {e}")
+        print(f"{prefix}Ошибка при работе с микрофоном: {e}")
         sys.stdout.flush()
         play_error()
+    finally:
+        session.idle.set()
+
+streaming_dictation = True
+
+def dictate(session, r, source, prefix=""):
+    """Stream a note: text is appended as chunks are recognized, until a control phrase or a handover"""
+    import speech_recognition as sr
+    import dictation
+    from recognition import OfflineError
+
+    def transcribe(audio):
+        try:
+            with in_session(session):
+                _, alternatives = get_recognition().recognize(r, audio)
+                return pick_transcript(alternatives).text
+        except sr.UnknownValueError:
+            return None
+        except (OfflineError, sr.RequestError) as e:
+            print(f"{prefix}Ошибка распознавания диктовки: {e}")
+            sys.stdout.flush()
+            return None
+
+    def on_text(text):
+        with session.lock:
+            session.note_lines.append(text)
+        record_history("note_line", session=session.name, source="voice")
+        print(f"{prefix}📝 {text}")
+        sys.stdout.flush()
+        publish_event("note_line", session=session.name, text=text)
+
+    print(f"{prefix}📝 Диктовка: скажите «{NOTE_CONTROL_PHRASES[0]}» или «{NOTE_CONTROL_PHRASES[1]}»")
+    sys.stdout.flush()
+    streaming = dictation.StreamingDictation(transcribe, on_text, NOTE_CONTROL_PHRASES)
+    stop = lambda: streaming.done.is_set() or not listening_allowed.is_set() or not session.recording_note
+    control = streaming.run(source.stream(r, stop))
+    if control:
+        print(f"{prefix}Ты сказал: {control}")
+        sys.stdout.flush()
+        process_text(control, session, source="voice")
+
+def session_loop(session):
+    """Listen on one session's microphone until shutdown"""
+    while not shutdown_requested.is_set():
+        if not listening_allowed.wait(0.5):
+            continue
+        try:
+            recognize_command(session)
+        except Exception as e:
+            print(f"Критическая ошибка [{session.name}]: {e}")
+            sys.stdout.flush()
+            time.sleep(1)
+
+def start_sessions():
+    for session in sessions:
+        session.thread = threading.Thread(target=session_loop, args=(session,), daemon=True,
+                                          name=f"session-{session.name}")
+        session.thread.start()
+
+def export_state():
+    """Runtime state handed over to a replacement process"""
+    # The first session's state is also kept at the top level for older processes
+    state = sessions[0].export()
+    state["sessions"] = {session.name: session.export() for session in sessions}
+    state["timers"] = export_timers()
+    return state
+
+def apply_state(state):
+    by_name = state.get("sessions") or {sessions[0].name: state}
+    for index, session in enumerate(sessions):
+        session_state = by_name.get(session.name)
+        if session_state is None and index == 0:
+            session_state = state
+        if session_state is not None:
+            session.apply(session_state)
+    for item in state.get("timers", []):
+        schedule_timer(item["deadline"], item["kind"], item.get("text"), item.get("session"))
+
+def rpc_status():
+    primary = sessions[0]
+    return {
+        "pid": os.getpid(),
+        "uptime": round(time.time() - started_at, 1),
+        "commands_enabled": primary.commands_enabled,
+        "recording_note": primary.recording_note,
+        "note_lines": len(primary.note_lines),
+        "commands": len(commands_matcher),
+        "timers": len(scheduled_timers),
+        "ready": ready.is_set(),
+        "active": listening_allowed.is_set(),
+        "dry_run": actions.sink.dry_run,
+        "sessions": [session.status() for session in sessions],
+    }
+
+def rpc_recognition_stats():
+    return get_recognition().stats_dict()
+
+def rpc_dry_run(enabled=True, log=False):
+    """With log, records also go to action_registry.default_dry_run_log(); the path is not a parameter"""
+    if not isinstance(log, bool):
+        raise ValueError("log: ожидается true или false, путь к журналу задаётся только при запуске")
+    if bool(enabled) != actions.sink.dry_run or log:
+        set_dry_run(bool(enabled), action_registry.default_dry_run_log() if log else None)
+    return rpc_status()
+
+def rpc_dry_run_log(limit=50):
+    if not actions.sink.dry_run:
+        return []
+    return actions.sink.recent(int(limit))
+
+def rpc_profile(seconds=None, memory=True, wait=False):
+    """Profile for `seconds`; with wait the call returns after the dump, otherwise a "profile" event follows"""
+    if wait:
+        import profiler as profiling
+        path = get_profiler().dump(seconds or profiling.PROFILE_SECONDS, bool(memory))
+        on_profile_done(path)
+        return dict(get_profiler().status(), path=path)
+    return dict(get_profiler().status(), started=start_profile(seconds, bool(memory)))
+
+def rpc_profile_stop():
+    stop_profiling()
+    return get_profiler().status()
+
+def rpc_apps(name=None, refresh=False):
+    """Application index status; with name, what it resolves to"""
+    index = get_launcher()
+    if not hasattr(index, "resolve"):
+        return {"platform": sys.platform}
+    if refresh:
+        index.refresh()
+    result = index.status()
+    if name:
+        entry = index.resolve(name)
+        result["resolved"] = {"name": entry.name, "argv": index.command(entry), "source": entry.source} if entry else None
+    return result
+
+def rpc_history(report="summary", days=None, limit=None):
+    """History reports: summary, top, failures, slowest, unmatched, stages or recent"""
+    import history_store
+    days = int(days or history_store.REPORT_DAYS)
+    limit = int(limit or history_store.REPORT_LIMIT)
+    if history:
+        history.flush()
+    store = history_store.HistoryStore()
+    try:
+        reports = {
+            "summary": lambda: store.summary(days, limit),
+            "top": lambda: store.top_commands(days, limit),
+            "failures": lambda: store.failure_rates(days),
+            "slowest": lambda: store.slowest_actions(days, limit),
+            "unmatched": lambda: store.unmatched(days, limit),
+            "stages": lambda: store.stages(days),
+            "recent": lambda: store.recent(limit),
+        }
+        if report not in reports:
+            raise ValueError(f"Неизвестный отчёт: {report}")
+        return reports[report]()
+    finally:
+        store.close()
+
+def rpc_reload():
+    with command_lock:
+        matcher = reload_commands()
+    return {"commands": len(matcher), "bundle": commands_from_bundle}
+
+def rpc_enable(session=None):
+    with in_session(find_session(session)):
+        enable_commands()
+    return rpc_status()
+
+def rpc_disable(session=None):
+    with in_session(find_session(session)):
+        disable_commands()
+    return rpc_status()
+
+def rpc_execute_text(text, session=None):
+    target = find_session(session)
+    text = str(text).strip().lower()
+    if not text:
+        raise ValueError("Пустая команда")
+    print(f"Текстовая команда: {text}")
+    sys.stdout.flush()
+    return process_text(text, target)
+
+def recognize_audio(data, session=None):
+    """Recognize an uploaded WAV/AIFF/FLAC recording and run it like a spoken command"""
+    import io
+    import speech_recognition as sr
+    target = find_session(session)
+    with sr.AudioFile(io.BytesIO(data)) as source:
+        audio = target.get_recognizer().record(source)
+    started = time.perf_counter()
+    try:
+        with in_session(target):
+            backend, alternatives = get_recognition().recognize(target.get_recognizer(), audio)
+            best = pick_transcript(alternatives)
+    except sr.UnknownValueError:
+        record_history("not_recognized", session=target.name, source="http",
+                       recognize_time=time.perf_counter() - started)
+        return {"text": None, "result": "not_recognized"}
+    print(f"Аудиокоманда: {best.text}")
+    sys.stdout.flush()
+    result = process_text(best.text, target, source="http", backend=backend,
+                          recognize_time=time.perf_counter() - started)
+    return dict(result, text=best.text, backend=backend)
+
+def text_lines(path):
+    """Lines from a file, from piped stdin, or typed at a prompt ("-" is stdin)"""
+    if path != "-":
+        with open(path, 'r', encoding='utf-8') as f:
+            yield from f
+    elif sys.stdin.isatty():
+        while True:
+            try:
+                yield input("> ")
+            except EOFError:
+                print()
+                return
+    else:
+        yield from sys.stdin
+
+def run_text_mode(path, fast=False, quiet=False):
+    """Stream transcripts through process_text, one per line; prints per-line results and a summary"""
+    global feedback_enabled
+    if fast:
+        feedback_enabled = False
+    session = sessions[0]
+    latencies = []
+    results = {}
+    started = time.perf_counter()
+    for line in text_lines(path):
+        text = line.strip().lower()
+        if not text or text.startswith("#"):
+            continue
+        line_started = time.perf_counter()
+        result = process_text(text, session, source="text")
+        elapsed = time.perf_counter() - line_started
+        latencies.append(elapsed)
+        results[result["result"]] = results.get(result["result"], 0) + 1
+        if not quiet:
+            detail = result.get("command") or result.get("action") or ""
+            print(f"{len(latencies)}\t{elapsed * 1000:.3f} мс\t{result['result']}\t{detail}\t{text}")
+    total = time.perf_counter() - started
+    if latencies:
+        ordered = sorted(latencies)
+        percentile = lambda fraction: ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000
+        print(f"📊 Строк: {len(latencies)} за {total:.2f} с ({len(latencies) / total:.0f} в секунду); "
+              f"задержка p50 {percentile(0.5):.3f} мс, p99 {percentile(0.99):.3f} мс, макс {ordered[-1] * 1000:.3f} мс")
+        print("📊 Результаты: " + ", ".join(f"{name} {count}" for name, count in sorted(results.items(), key=lambda item: -item[1])))
+    if actions.sink.dry_run:
+        print(f"🧪 Записано действий без выполнения: {actions.sink.count}")
+    sys.stdout.flush()
+    return 0
+
+def start_http_server(address):
+    """Serve HTTP/WebSocket on [host:]port; retried on activation while the old process still holds the port"""
+    global http_server
+    import http_server as http
+    host, port = http.parse_address(address)
+    server = http.HttpServer(CONTROL_METHODS, recognize_audio, host, port)
+    if server.start():
+        http_server = server
+        print(f"🌐 HTTP-сервер: http://{host}:{port}")
+        if not os.environ.get("ASSISTANT_HTTP_TOKEN"):
+            print(f"🔑 Токен доступа: {http.token_path()}")
+        sys.stdout.flush()
+    return http_server
+
+def stop_http_server():
+    global http_server
+    if http_server:
+        http_server.stop()
+        http_server = None
+
+def rpc_handoff():
+    """Stop listening after the current phrase and give up state, socket and microphone"""
+    listening_allowed.clear()
+    deadline = time.time() + HANDOFF_TIMEOUT
+    if not all(session.idle.wait(max(0.0, deadline - time.time())) for session in sessions):
+        raise RuntimeError("Текущая команда не завершилась вовремя")
+    release_microphone()
+    stop_http_server()
+    state = export_state()
+    if control_server:
+        control_server.release_path()
+    print("🔁 Передаю работу новому процессу ассистента")
+    sys.stdout.flush()
+    # Exiting before the state is written would leave the standby with nothing
+    import control_server as control
+    control.after_reply(shutdown_requested.set)
+    return state
+
+def rpc_activate(state=None, socket=None):
+    """Take over state and start listening; optionally move the control socket to a new path"""
+    global control_server
+    if state:
+        apply_state(state)
+    if socket and control_server and socket != control_server.path:
+        import control_server as control
+        server = control.ControlServer(CONTROL_METHODS, socket)
+        deadline = time.time() + HANDOFF_TIMEOUT
+        while not server.start():
+            if time.time() > deadline:
+                raise RuntimeError(f"Сокет {socket} занят")
+            time.sleep(0.05)
+        previous, control_server = control_server, server
+        threading.Timer(0.5, previous.stop).start()
+    if http_address and not http_server:
+        start_http_server(http_address)
+    listening_allowed.set()
+    publish_event("activated", pid=os.getpid())
+    print("✅ Ассистент активен")
+    sys.stdout.flush()
+    return rpc_status()
+
+def rpc_jobs():
+    return jobs.list_jobs() if jobs else []
+
+def rpc_cancel_job(id=None):
+    return [job.id for job in jobs.cancel(id)] if jobs else []
+
+CONTROL_METHODS = {
+    "status": rpc_status,
+    "reload": rpc_reload,
+    "enable": rpc_enable,
+    "disable": rpc_disable,
+    "execute_text": rpc_execute_text,
+    "handoff": rpc_handoff,
+    "activate": rpc_activate,
+    "jobs": rpc_jobs,
+    "recognition_stats": rpc_recognition_stats,
+    "cancel_job": rpc_cancel_job,
+    "dry_run": rpc_dry_run,
+    "dry_run_log": rpc_dry_run_log,
+    "profile": rpc_profile,
+    "profile_stop": rpc_profile_stop,
+    "apps": rpc_apps,
+    "history": rpc_history,
+}
+
+def start_control_server(path=None):
+    """Serve the local control socket if the platform supports Unix sockets"""
+    global control_server
+    import control_server as control
+    if not control.is_supported():
+        return None
+    server = control.ControlServer(CONTROL_METHODS, path)
+    try:
+        if server.start():
+            control_server = server
+            print(f"🔌 Управляющий сокет: {server.path}")
+            sys.stdout.flush()
+    except OSError as e:
+        print(f"Ошибка запуска управляющего сокета: {e}")
+        sys.stdout.flush()
+    return control_server
 
 def signal_handler(signum, frame):
     """Signal handler for graceful shutdown"""
     print("\n🛑 Получен сигнал завершения. Останавливаю ассистента...")
     sys.stdout.flush()
+    if control_server:
+        control_server.stop()
+    if jobs:
+        jobs.shutdown()
+    release_microphone()
+    stop_http_server()
+    actions.sink.close()
+    stop_history()
+    if launcher:
+        launcher.stop()
     print("👋 Ассистент остановлен!")
     sys.stdout.flush()
     sys.exit(0)
 
+def profile_signal_handler(signum, frame):
+    """SIGUSR1: take a profile in the background"""
+    if not start_profile():
+        print("📈 Профилирование уже идёт")
+        sys.stdout.flush()
+
+def parse_args(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Голосовой ассистент")
+    parser.add_argument("--socket", help="путь к управляющему Unix-сокету")
+    parser.add_argument("--no-control", action="store_true", help="не открывать управляющий сокет")
+    parser.add_argument("--standby", action="store_true",
+                        help="прогреться и ждать команды activate, не занимая микрофон")
+    parser.add_argument("--session", action="append", metavar="ИМЯ=УСТРОЙСТВО",
+                        help="сессия с отдельным микрофоном (индекс устройства PyAudio); можно указать несколько раз, "
+                             "по умолчанию $ASSISTANT_SESSIONS через запятую")
+    parser.add_argument("--http", metavar="[ХОСТ:]ПОРТ", default=os.environ.get("ASSISTANT_HTTP"),
+                        help="HTTP/WebSocket-сервер команд (по умолчанию $ASSISTANT_HTTP, хост 127.0.0.1)")
+    parser.add_argument("--no-history", action="store_true",
+                        help="не записывать историю команд ($ASSISTANT_HISTORY_DB, по умолчанию history.db)")
+    parser.add_argument("--phrase-notes", action="store_true",
+                        help="диктовать заметки по фразам, а не потоком перекрывающихся фрагментов")
+    parser.add_argument("--no-voice", action="store_true",
+                        help="не слушать микрофон: команды только через сокет и HTTP")
+    parser.add_argument("--text", nargs="?", const="-", metavar="ФАЙЛ",
+                        help="выполнить расшифровки построчно из файла или stdin (по умолчанию) вместо микрофона")
+    parser.add_argument("--fast", action="store_true", help="в режиме --text: без звуков и голоса, как можно быстрее")
+    parser.add_argument("--quiet", action="store_true", help="в режиме --text: только итоговая статистика")
+    parser.add_argument("--dry-run", nargs="?", const="", metavar="JSONL",
+                        help="не выполнять действия, а только записывать их (в память или в JSONL-файл)")
+    return parser.parse_args(argv)
+
 if __name__ == "__main__":
+    args = parse_args()
+    sessions = parse_sessions(args.session or [spec for spec in os.environ.get("ASSISTANT_SESSIONS", "").split(",") if spec.strip()])
+    if args.dry_run is not None:
+        set_dry_run(True, args.dry_run)
+    if not args.no_history:
+        start_history()
+    if args.text is not None:
+        get_commands()
+        try:
+            sys.exit(run_text_mode(args.text, fast=args.fast, quiet=args.quiet))
+        except KeyboardInterrupt:
+            sys.exit(130)
+        except OSError as e:
+            print(f"❌ Не удалось прочитать {args.text}: {e}")
+            sys.exit(1)
+        finally:
+            actions.sink.close()
+            stop_history()
+    startup_timer = StartupTimer()
     signal.signal(signal.SIGTERM, signal_handler)
     signal.signal(signal.SIGINT, signal_handler)
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, profile_signal_handler)
     
-    print("🎤 Голосовой ассистент запущен!")
-    sys.stdout.flush()
-    print("Скажите команду...")
+    print("🎤 Голосовой ассистент запущен!" if not args.standby else "🎤 Резервный ассистент прогревается...")
     sys.stdout.flush()
     
-    commands_data = load_commands()
-    if commands_data:
-        print(f"✅ Загружено {sum(len(commands) for commands in commands_data.values())} команд из JSON файла")
+    with startup_timer.phase("команды"):
+        get_commands()
+    if not args.no_control:
+        with startup_timer.phase("управляющий сокет"):
+            start_control_server(args.socket)
+    http_address = args.http
+    streaming_dictation = not args.phrase_notes
+    if http_address and not args.standby:
+        with startup_timer.phase("HTTP-сервер"):
+            start_http_server(http_address)
+    if args.standby:
+        with startup_timer.phase("звук"):
+            sounds.warm_up()
+        with startup_timer.phase("голос"):
+            tts.warm_up()
+        with startup_timer.phase("приложения"):
+            get_launcher().warm_up()
+    else:
+        init_services(startup_timer)
+    with startup_timer.phase("распознавание речи"):
+        import speech_recognition
+        get_recognition().warm_up()
+    if len(commands_matcher):
+        source = "скомпилированного пакета" if commands_from_bundle else "базы команд"
+        print(f"✅ Загружено {len(commands_matcher)} команд из {source}")
         sys.stdout.flush()
     else:
-        print("⚠️ Команды не загружены из JSON файла")
+        print("⚠️ Команды не загружены из базы команд")
         sys.stdout.flush()
     
-    while True:
-        try:
-            recognize_command()
-        except KeyboardInterrupt:
-            print("\n👋 До свидания!")
-            sys.stdout.flush()
-            break
-        except Exception as e:
-            print(f"Критическая ошибка: {e}")
-            sys.stdout.flush()
-            time.sleep(1)
+    ready.set()
+    if args.standby and control_server:
+        print("⏳ Готов к передаче управления")
+        sys.stdout.flush()
+    else:
+        listening_allowed.set()
+        print("Скажите команду...")
+        sys.stdout.flush()
+    if len(sessions) > 1:
+        print("🎙️ Сессии: " + ", ".join(
+            f"{session.name} (устройство {session.device_index if session.device_index is not None else 'по умолчанию'})"
+            for session in sessions))
+        sys.stdout.flush()
+    
+    if args.no_voice:
+        print("🔇 Микрофон не используется")
+        sys.stdout.flush()
+    else:
+        start_sessions()
+    try:
+        while not shutdown_requested.wait(0.5):
+            pass
+    except KeyboardInterrupt:
+        print("\n👋 До свидания!")
+        sys.stdout.flush()
+    
+    release_microphone()
+    stop_http_server()
+    if control_server:
+        control_server.stop()
+    stop_history()
+    print("👋 Ассистент остановлен!")
+    sys.stdout.flush()
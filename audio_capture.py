@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+Continuous microphone capture into a preallocated ring buffer.
+
+The microphone stays open between commands, so speech that starts while the
+previous command is still running is not lost, and every utterance gets a
+short pre-roll from before the detected speech onset. Memory use is fixed by
+the ring size however long the assistant runs.
+"""
+
+import audioop
+import math
+import threading
+import time
+from typing import Any, Callable, Iterator, Optional, Tuple
+
+RING_SECONDS = 20
+PREROLL_SECONDS = 0.4
+BACKLOG_SECONDS = 3.0   # audio older than this at listen() time is not searched for speech
+STREAM_CHUNK_SECONDS = 6.0
+STREAM_OVERLAP_SECONDS = 1.0
+STOP_CHECK_SECONDS = 0.5
+CHUNK = 1024
+
+class RingBuffer:
+    """Fixed-size byte ring over one preallocated bytearray.
+
+    Positions are absolute byte offsets since the start of capture; only the
+    last `capacity` bytes are available. Writes must be exactly chunk_size
+    bytes, so a chunk never wraps around the end of the array.
+    """
+
+    def __init__(self, chunk_size: int, chunks: int):
+        self.chunk_size = chunk_size
+        self.capacity = chunk_size * chunks
+        self.data = bytearray(self.capacity)
+        self.view = memoryview(self.data)
+        self.written = 0
+
+    @property
+    def oldest(self) -> int:
+        return max(0, self.written - self.capacity)
+
+    def write(self, chunk: bytes):
+        offset = self.written % self.capacity
+        self.view[offset:offset + self.chunk_size] = chunk
+        self.written += self.chunk_size
+
+    def chunk_at(self, position: int) -> memoryview:
+        """View of the chunk starting at a chunk-aligned position (no copy)"""
+        offset = position % self.capacity
+        return self.view[offset:offset + self.chunk_size]
+
+    def read(self, start: int, end: int) -> bytes:
+        """Bytes between two absolute positions; start is clamped to the oldest available byte"""
+        start = max(start, self.oldest)
+        if start >= end:
+            return b""
+        first, last = start % self.capacity, end % self.capacity or self.capacity
+        if first < last:
+            return bytes(self.view[first:last])
+        return bytes(self.view[first:]) + bytes(self.view[:last])
+
+class ContinuousCapture:
+    """Background microphone reader plus a listen() that mirrors sr.Recognizer.listen()"""
+
+    def __init__(self, device_index: Optional[int] = None, sample_rate: Optional[int] = None,
+                 chunk: int = CHUNK, seconds: float = RING_SECONDS, preroll: float = PREROLL_SECONDS):
+        self.device_index = device_index
+        self.sample_rate = sample_rate
+        self.chunk = chunk
+        self.seconds = seconds
+        self.preroll = preroll
+        self.source = None
+        self.ring: Optional[RingBuffer] = None
+        self.cursor = 0
+        self.error: Optional[Exception] = None
+        self.running = False
+        self.thread: Optional[threading.Thread] = None
+        self.changed = threading.Condition()
+
+    def start(self):
+        """Open the microphone and start filling the ring"""
+        if self.running:
+            return
+        self._close()  # after the capture thread died on a device error
+        import speech_recognition as sr
+        source = sr.Microphone(device_index=self.device_index, sample_rate=self.sample_rate, chunk_size=self.chunk)
+        source.__enter__()
+        self.source = source
+        chunk_bytes = source.CHUNK * source.SAMPLE_WIDTH
+        self.ring = RingBuffer(chunk_bytes, math.ceil(self.seconds * source.SAMPLE_RATE / source.CHUNK))
+        self.cursor = 0
+        self.error = None
+        self.running = True
+        self.thread = threading.Thread(target=self._capture, daemon=True, name="audio-capture")
+        self.thread.start()
+
+    def stop(self):
+        """Stop capturing and release the microphone"""
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout=2)
+            self.thread = None
+        self._close()
+
+    def _close(self):
+        if self.source is None:
+            return
+        try:
+            self.source.__exit__(None, None, None)
+        finally:
+            self.source = None
+            with self.changed:
+                self.changed.notify_all()
+
+    def _capture(self):
+        stream, ring = self.source.stream, self.ring
+        try:
+            while self.running:
+                data = stream.read(self.source.CHUNK)
+                if len(data) != ring.chunk_size:
+                    continue
+                with self.changed:
+                    ring.write(data)
+                    self.changed.notify_all()
+        except Exception as e:
+            self.error = e
+            self.running = False
+            with self.changed:
+                self.changed.notify_all()
+
+    def skip(self):
+        """Ignore everything captured so far (e.g. the assistant's own speech)"""
+        if self.ring:
+            with self.changed:
+                self.cursor = self.ring.written
+
+    def backlog_seconds(self) -> float:
+        """Captured audio not yet consumed by listen()"""
+        if not self.ring or not self.source:
+            return 0.0
+        unread = self.ring.written - max(self.cursor, self.ring.oldest)
+        return unread / (self.source.SAMPLE_RATE * self.source.SAMPLE_WIDTH)
+
+    def _next_chunk(self, position: int, deadline: Optional[float]) -> Optional[memoryview]:
+        """Chunk at position, waiting for it to be captured; None when the deadline passes"""
+        with self.changed:
+            while self.ring.written < position + self.ring.chunk_size:
+                if not self.running:
+                    raise OSError(f"Захват звука остановлен: {self.error}" if self.error else "Захват звука остановлен")
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self.changed.wait(remaining)
+            return self.ring.chunk_at(position)
+
+    def _onset(self, chunk: memoryview, recognizer, seconds_per_chunk: float) -> bool:
+        """True if the chunk is louder than the threshold; quiet chunks adapt a dynamic threshold"""
+        energy = audioop.rms(chunk, self.source.SAMPLE_WIDTH)
+        if energy > recognizer.energy_threshold:
+            return True
+        if recognizer.dynamic_energy_threshold:
+            damping = recognizer.dynamic_energy_adjustment_damping ** seconds_per_chunk
+            target = energy * recognizer.dynamic_energy_ratio
+            recognizer.energy_threshold = recognizer.energy_threshold * damping + target * (1 - damping)
+        return False
+
+    def listen(self, recognizer, timeout: Optional[float] = None, phrase_time_limit: Optional[float] = None):
+        """Next phrase as sr.AudioData, starting from where the previous one ended.
+
+        Uses the recognizer's energy threshold, pause and phrase settings like
+        sr.Recognizer.listen(); raises sr.WaitTimeoutError if no speech starts
+        within timeout seconds.
+        """
+        import speech_recognition as sr
+        if not self.running:
+            self.start()
+        ring, source = self.ring, self.source
+        chunk_bytes = ring.chunk_size
+        seconds_per_chunk = source.CHUNK / source.SAMPLE_RATE
+        bytes_per_second = source.SAMPLE_RATE * source.SAMPLE_WIDTH
+        pause_chunks = math.ceil(recognizer.pause_threshold / seconds_per_chunk)
+        phrase_chunks = math.ceil(recognizer.phrase_threshold / seconds_per_chunk)
+        non_speaking_chunks = math.ceil(recognizer.non_speaking_duration / seconds_per_chunk)
+        preroll_bytes = int(self.preroll / seconds_per_chunk) * chunk_bytes
+        # The phrase and its pre-roll have to fit in the ring
+        limit_bytes = ring.capacity - preroll_bytes - 2 * chunk_bytes
+        if phrase_time_limit:
+            limit_bytes = min(limit_bytes, int(phrase_time_limit * bytes_per_second) // chunk_bytes * chunk_bytes)
+        deadline = time.monotonic() + timeout if timeout else None
+
+        with self.changed:
+            backlog = ring.written - int(BACKLOG_SECONDS / seconds_per_chunk) * chunk_bytes
+            position = max(self.cursor, ring.oldest, backlog)
+        while True:
+            # Wait for speech onset
+            while True:
+                position = max(position, ring.oldest)
+                chunk = self._next_chunk(position, deadline)
+                if chunk is None:
+                    self.cursor = position
+                    raise sr.WaitTimeoutError("listening timed out while waiting for phrase to start")
+                if self._onset(chunk, recognizer, seconds_per_chunk):
+                    break
+                position += chunk_bytes
+
+            # Collect the phrase until a long enough pause
+            onset = position
+            speaking = pause = 0
+            while True:
+                chunk = self._next_chunk(position, None)
+                position += chunk_bytes
+                if audioop.rms(chunk, source.SAMPLE_WIDTH) > recognizer.energy_threshold:
+                    speaking += 1
+                    pause = 0
+                else:
+                    pause += 1
+                if pause > pause_chunks or position - onset >= limit_bytes:
+                    break
+            self.cursor = position
+            if speaking >= phrase_chunks:
+                break
+            # Too short to be a phrase: keep looking after it
+
+        end = position - max(0, pause - non_speaking_chunks) * chunk_bytes
+        with self.changed:
+            frame_data = ring.read(onset - preroll_bytes, end)
+        return sr.AudioData(frame_data, source.SAMPLE_RATE, source.SAMPLE_WIDTH)
+
+    def stream(self, recognizer, stop: Callable[[], bool], chunk_seconds: float = STREAM_CHUNK_SECONDS,
+               overlap: float = STREAM_OVERLAP_SECONDS) -> Iterator[Tuple[Any, bool, bool]]:
+        """Continuous speech as (sr.AudioData, overlaps_previous, cut) until stop() returns True.
+
+        A chunk ends at a pause, or after chunk_seconds of speech: then it is
+        `cut` and the next chunk starts `overlap` seconds before the cut, so a
+        word split by the cut is heard whole in one of them. Silence between
+        phrases is skipped; stop() is checked at least every STOP_CHECK_SECONDS.
+        """
+        import speech_recognition as sr
+        if not self.running:
+            self.start()
+        ring, source = self.ring, self.source
+        chunk_bytes = ring.chunk_size
+        seconds_per_chunk = source.CHUNK / source.SAMPLE_RATE
+        pause_chunks = math.ceil(recognizer.pause_threshold / seconds_per_chunk)
+        phrase_chunks = math.ceil(recognizer.phrase_threshold / seconds_per_chunk)
+        non_speaking_chunks = math.ceil(recognizer.non_speaking_duration / seconds_per_chunk)
+        preroll_bytes = int(self.preroll / seconds_per_chunk) * chunk_bytes
+        overlap_bytes = int(overlap / seconds_per_chunk) * chunk_bytes
+        limit_bytes = min(ring.capacity - preroll_bytes - 2 * chunk_bytes,
+                          max(2 * overlap_bytes, int(chunk_seconds / seconds_per_chunk) * chunk_bytes))
+
+        with self.changed:
+            backlog = ring.written - int(BACKLOG_SECONDS / seconds_per_chunk) * chunk_bytes
+            position = max(self.cursor, ring.oldest, backlog)
+        resume = None  # start of the overlap after a cut
+        while not stop():
+            if resume is None:
+                position = max(position, ring.oldest)
+                chunk = self._next_chunk(position, time.monotonic() + STOP_CHECK_SECONDS)
+                if chunk is None or not self._onset(chunk, recognizer, seconds_per_chunk):
+                    if chunk is not None:
+                        position += chunk_bytes
+                    self.cursor = position
+                    continue
+                start = onset = position
+            else:
+                start, onset = resume, position
+
+            speaking = pause = 0
+            while True:
+                chunk = self._next_chunk(position, None)
+                position += chunk_bytes
+                if audioop.rms(chunk, source.SAMPLE_WIDTH) > recognizer.energy_threshold:
+                    speaking += 1
+                    pause = 0
+                else:
+                    pause += 1
+                if pause > pause_chunks or position - start >= limit_bytes:
+                    break
+            self.cursor = position
+            overlapped = resume is not None
+            cut = pause <= pause_chunks
+            resume = position - overlap_bytes if cut else None
+            if not overlapped and not cut and speaking < phrase_chunks:
+                continue  # a blip, not speech
+            end = position - max(0, pause - non_speaking_chunks) * chunk_bytes
+            with self.changed:
+                frame_data = ring.read(start if overlapped else onset - preroll_bytes, end)
+            yield sr.AudioData(frame_data, source.SAMPLE_RATE, source.SAMPLE_WIDTH), overlapped, cut
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Audio transport stage between capture and recognition backends.
+
+An utterance is converted once to the backends' preferred format (16 kHz,
+16-bit mono by default), leading and trailing silence beyond a short margin
+is cut, and each backend gets the most compact encoding it accepts. Sizes
+and timings of every request are kept for the stats.
+"""
+
+import audioop
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, NamedTuple, Optional, Sequence
+
+TARGET_RATE = int(os.environ.get("ASSISTANT_AUDIO_RATE", "16000"))
+SAMPLE_WIDTH = 2
+FRAME_SECONDS = 0.02
+TRIM_MARGIN = 0.2         # seconds of audio kept around the detected speech
+NOISE_PERCENTILE = 0.1    # frame level taken as the noise floor
+SPEECH_RATIO = 2.5        # frames this much louder than the noise floor count as speech
+MIN_SPEECH_LEVEL = 50
+ENCODINGS = ("flac", "pcm")  # most compact first
+RECENT_REQUESTS = 20
+
+class TransportRecord(NamedTuple):
+    backend: str
+    encoding: str
+    input_bytes: int       # PCM as captured
+    payload_bytes: int     # what the backend receives
+    input_seconds: float
+    payload_seconds: float
+    prepare_seconds: float
+
+def speech_bounds(raw: bytes, rate: int, width: int) -> Optional[tuple]:
+    """(start, end) byte offsets of the speech in raw PCM, or None if no frame stands out from the noise"""
+    frame_bytes = max(width, int(rate * FRAME_SECONDS) * width)
+    levels = [audioop.rms(raw[offset:offset + frame_bytes], width)
+              for offset in range(0, len(raw) - frame_bytes + 1, frame_bytes)]
+    if not levels:
+        return None
+    noise = sorted(levels)[int(NOISE_PERCENTILE * (len(levels) - 1))]
+    threshold = max(MIN_SPEECH_LEVEL, noise * SPEECH_RATIO)
+    loud = [index for index, level in enumerate(levels) if level > threshold]
+    if not loud:
+        return None
+    margin = int(TRIM_MARGIN / FRAME_SECONDS)
+    start = max(0, loud[0] - margin) * frame_bytes
+    end = min(len(raw), (loud[-1] + 1 + margin) * frame_bytes)
+    return start, end
+
+_prepared_class = None
+
+def prepared_audio_class():
+    """sr.AudioData subclass that keeps its FLAC encoding, so it is made once per utterance"""
+    global _prepared_class
+    if _prepared_class is None:
+        import speech_recognition as sr
+
+        class PreparedAudio(sr.AudioData):
+            input_bytes = 0
+            input_seconds = 0.0
+            prepare_seconds = 0.0
+
+            def __init__(self, frame_data, sample_rate, sample_width):
+                super().__init__(frame_data, sample_rate, sample_width)
+                self.flac = None
+                self.lock = threading.Lock()
+
+            def get_flac_data(self, convert_rate=None, convert_width=None):
+                if convert_rate not in (None, self.sample_rate) or convert_width not in (None, self.sample_width):
+                    return super().get_flac_data(convert_rate, convert_width)
+                with self.lock:
+                    if self.flac is None:
+                        self.flac = super().get_flac_data()
+                return self.flac
+
+        _prepared_class = PreparedAudio
+    return _prepared_class
+
+def prepare(audio, rate: int = TARGET_RATE, trim: bool = True):
+    """Resampled, 16-bit, silence-trimmed copy of an sr.AudioData"""
+    started = time.perf_counter()
+    rate = min(rate, audio.sample_rate)
+    raw = audio.get_raw_data(convert_rate=rate, convert_width=SAMPLE_WIDTH)
+    if trim:
+        bounds = speech_bounds(raw, rate, SAMPLE_WIDTH)
+        if bounds:
+            raw = raw[bounds[0]:bounds[1]]
+    prepared = prepared_audio_class()(raw, rate, SAMPLE_WIDTH)
+    prepared.input_bytes = len(audio.frame_data)
+    prepared.input_seconds = len(audio.frame_data) / (audio.sample_rate * audio.sample_width)
+    prepared.prepare_seconds = time.perf_counter() - started
+    return prepared
+
+def choose_encoding(accepted: Sequence[str]) -> str:
+    for encoding in ENCODINGS:
+        if encoding in accepted:
+            return encoding
+    return accepted[0]
+
+def encode(prepared, encoding: str) -> bytes:
+    """Payload in the given encoding; FLAC is cached on the prepared audio"""
+    if encoding == "flac":
+        return prepared.get_flac_data()
+    if encoding == "wav":
+        return prepared.get_wav_data()
+    return prepared.frame_data
+
+class TransportStats:
+    """Totals and recent per-request records of what was sent to the backends"""
+
+    def __init__(self):
+        self.requests = 0
+        self.input_bytes = 0
+        self.payload_bytes = 0
+        self.input_seconds = 0.0
+        self.payload_seconds = 0.0
+        self.prepare_seconds = 0.0
+        self.recent = deque(maxlen=RECENT_REQUESTS)
+        self.lock = threading.Lock()
+
+    def record(self, record: TransportRecord):
+        with self.lock:
+            self.requests += 1
+            self.input_bytes += record.input_bytes
+            self.payload_bytes += record.payload_bytes
+            self.input_seconds += record.input_seconds
+            self.payload_seconds += record.payload_seconds
+            self.prepare_seconds += record.prepare_seconds
+            self.recent.append(record)
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "input_bytes": self.input_bytes,
+                "payload_bytes": self.payload_bytes,
+                "saved_percent": round(100 * (1 - self.payload_bytes / self.input_bytes), 1) if self.input_bytes else None,
+                "trimmed_seconds": round(self.input_seconds - self.payload_seconds, 2),
+                "prepare_ms": round(1000 * self.prepare_seconds / self.requests, 1) if self.requests else None,
+                "recent": [dict(record._asdict(),
+                                input_seconds=round(record.input_seconds, 2),
+                                payload_seconds=round(record.payload_seconds, 2),
+                                prepare_seconds=round(record.prepare_seconds, 4))
+                           for record in self.recent],
+            }
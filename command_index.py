@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+In-memory search index over voice assistant commands
+"""
+
+import bisect
+import heapq
+import re
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+FIELDS = ("command", "category", "action", "description")
+
+def normalize(text: str) -> str:
+    return str(text).lower().replace("ё", "е")
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_RE.findall(normalize(text))
+
+class CommandSearchIndex:
+    """Pre-lowered fields and token -> command postings, updated incrementally"""
+
+    def __init__(self, commands: Optional[Dict[str, Any]] = None):
+        self.entries: Dict[int, Tuple[str, str]] = {}
+        self.texts: Dict[int, str] = {}
+        self.lengths: Dict[int, int] = {}
+        self.entry_tokens: Dict[int, List[Tuple[str, str]]] = {}
+        self.ids: Dict[Tuple[str, str], int] = {}
+        self.postings: Dict[str, Dict[str, Set[int]]] = {field: {} for field in FIELDS}
+        self.vocabulary: Set[str] = set()
+        self.next_id = 0
+        self.last_total = 0
+        self._token_cache: Dict[str, List[str]] = {}
+        self._blob: Optional[str] = None
+        self._blob_tokens: List[str] = []
+        self._blob_offsets: List[int] = []
+        if commands:
+            self.build(commands)
+
+    def build(self, commands: Dict[str, Any]):
+        """Rebuild the index from the categories -> commands mapping"""
+        self.entries.clear()
+        self.texts.clear()
+        self.lengths.clear()
+        self.entry_tokens.clear()
+        self.ids.clear()
+        for field in self.postings:
+            self.postings[field].clear()
+        self.vocabulary.clear()
+        self._token_cache.clear()
+        self._blob = None
+        for category, category_commands in commands.items():
+            for command, data in category_commands.items():
+                self.add(category, command, data)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def key(self, entry_id: int) -> Tuple[str, str]:
+        return self.entries[entry_id]
+
+    def add(self, category: str, command: str, data: Dict[str, Any]):
+        """Index one command, replacing an existing entry with the same key"""
+        if (category, command) in self.ids:
+            self.remove(category, command)
+        entry_id = self.next_id
+        self.next_id += 1
+        self.ids[(category, command)] = entry_id
+        self.entries[entry_id] = (category, command)
+        self.texts[entry_id] = normalize(command)
+        self.lengths[entry_id] = len(command)
+        fields = {
+            "command": command,
+            "category": category,
+            "action": data.get("action", ""),
+            "description": data.get("description", "")
+        }
+        indexed = []
+        for field, value in fields.items():
+            postings = self.postings[field]
+            for token in set(tokenize(value)):
+                indexed.append((field, token))
+                postings.setdefault(token, set()).add(entry_id)
+                if token not in self.vocabulary:
+                    self.vocabulary.add(token)
+                    self._token_cache.clear()
+                    self._blob = None
+        self.entry_tokens[entry_id] = indexed
+
+    def remove(self, category: str, command: str):
+        entry_id = self.ids.pop((category, command), None)
+        if entry_id is None:
+            return
+        del self.entries[entry_id]
+        del self.texts[entry_id]
+        del self.lengths[entry_id]
+        for field, token in self.entry_tokens.pop(entry_id):
+            ids = self.postings[field][token]
+            ids.discard(entry_id)
+            if not ids:
+                del self.postings[field][token]
+        # Tokens left without postings are harmless: they simply match nothing
+
+    def matching_tokens(self, fragment: str) -> List[str]:
+        """Vocabulary tokens containing fragment, found with one scan of the joined vocabulary"""
+        cached = self._token_cache.get(fragment)
+        if cached is not None:
+            return cached
+        if self._blob is None:
+            self._blob_tokens = sorted(self.vocabulary)
+            self._blob_offsets = []
+            offset = 0
+            for token in self._blob_tokens:
+                self._blob_offsets.append(offset)
+                offset += len(token) + 1
+            self._blob = "\n".join(self._blob_tokens)
+        tokens = []
+        last = -1
+        for match in re.finditer(re.escape(fragment), self._blob):
+            position = bisect.bisect_right(self._blob_offsets, match.start()) - 1
+            if position != last:
+                tokens.append(self._blob_tokens[position])
+                last = position
+        self._token_cache[fragment] = tokens
+        return tokens
+
+    def _union(self, field: str, tokens: List[str]) -> Set[int]:
+        postings = self.postings[field]
+        return set().union(*[postings[token] for token in tokens if token in postings])
+
+    def search(self, query: str, limit: Optional[int] = None) -> List[Tuple[str, str]]:
+        """Ranked (category, command) keys; every query token must occur in some field.
+
+        Ranking: exact phrase, phrase prefix, phrase substring, all tokens in the
+        phrase, then matches through category/action/description; shorter first.
+        """
+        query = normalize(query).strip()
+        fragments = tokenize(query)
+        self.last_total = 0
+        if not fragments:
+            return []
+
+        candidates = None
+        in_command = None
+        for fragment in fragments:
+            tokens = self.matching_tokens(fragment)
+            command_ids = self._union("command", tokens)
+            matched = command_ids.union(*[self._union(field, tokens) for field in FIELDS[1:]])
+            candidates = matched if candidates is None else candidates & matched
+            in_command = command_ids if in_command is None else in_command & command_ids
+            if not candidates:
+                return []
+
+        texts = self.texts
+        exact, prefix, substring, tokens_only = [], [], [], []
+        for entry_id in in_command:
+            text = texts[entry_id]
+            if query in text:
+                if text == query:
+                    exact.append(entry_id)
+                elif text.startswith(query):
+                    prefix.append(entry_id)
+                else:
+                    substring.append(entry_id)
+            else:
+                tokens_only.append(entry_id)
+        rest = candidates - in_command
+        self.last_total = len(candidates)
+
+        ordered = []
+        length = self.lengths.__getitem__
+        for tier in (exact, prefix, substring, tokens_only, rest):
+            if limit is None:
+                ordered.extend(sorted(tier, key=length))
+                continue
+            remaining = limit - len(ordered)
+            if remaining <= 0:
+                break
+            ordered.extend(heapq.nsmallest(remaining, tier, key=length))
+        return [self.key(entry_id) for entry_id in ordered]
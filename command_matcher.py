@@ -0,0 +1,422 @@
+#!/usr/bin/env python3
+"""
+Precompiled phrase matcher and the versioned command bundle format.
+
+A bundle holds everything the assistant needs to map a transcript to an
+action: normalized phrases, an Aho-Corasick automaton over them, the
+parametric grammar and the action table. The payload is plain JSON, so
+loading a bundle never runs code from it.
+"""
+
+import bisect
+import json
+import os
+import re
+import struct
+from collections import deque
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple, Union
+
+import command_store
+
+BUNDLE_MAGIC = b"LABUNDLE"
+BUNDLE_VERSION = 3
+OVERLAP_HEAD = 3
+
+# N-best scoring: confidence plus a bonus for explaining the utterance with a command
+DEFAULT_CONFIDENCE = 0.8   # recognizers often report confidence for the top hypothesis only
+RANK_PENALTY = 0.1         # assumed confidence drop per rank when it is missing
+MATCH_BONUS = 0.5
+COVERAGE_WEIGHT = 0.3
+
+def default_bundle_path() -> str:
+    """$ASSISTANT_BUNDLE, or commands.bundle next to the command database"""
+    return os.environ.get("ASSISTANT_BUNDLE") or os.path.join(
+        os.path.dirname(command_store.default_db_path()), "commands.bundle")
+
+# (action, pattern, parameter types); tried in order, see CommandMatcher.match_command()
+GRAMMAR = [
+    ("disable_commands_for", r"выключи команды на (\d+) (секунд[уы]?|минут[уы]?|час[аов]?)", ["int", "str"]),
+    ("click_mouse_times", r"кликни (\d+) раз", ["int"]),
+    ("move_mouse_direction", r"пошевели мышкой (вверх|вниз|влево|вправо) (\d+) пиксел[еяй]", ["str", "int"]),
+]
+
+def normalize_text(text: str) -> str:
+    """Lowercase, fold ё to е and collapse whitespace"""
+    return " ".join(str(text).lower().replace("ё", "е").split())
+
+class CommandEntry(NamedTuple):
+    category: str
+    phrase: str
+    action: str
+    params: list
+    description: str
+
+class Match(NamedTuple):
+    index: int
+    entry: CommandEntry
+    start: int
+    end: int
+
+class GrammarMatch(NamedTuple):
+    action: str
+    params: list
+    start: int
+    end: int
+
+def at_word_start(text: str, start: int) -> bool:
+    return start == 0 or text[start - 1] == " "
+
+def prefix_chain(text: str, ordered: List[str], parent: Dict[str, Optional[str]]) -> List[str]:
+    """Phrases text starts with, longest first.
+
+    ordered is the sorted distinct phrases, parent maps each to the longest
+    other phrase it starts with. Every phrase text starts with sorts between
+    it and text, so it starts the last phrase not after text and is on that
+    phrase's parent chain.
+    """
+    position = bisect.bisect_right(ordered, text) - 1
+    candidate = ordered[position] if position >= 0 else None
+    while candidate is not None and not text.startswith(candidate):
+        candidate = parent[candidate]
+    chain = []
+    while candidate is not None:
+        chain.append(candidate)
+        candidate = parent[candidate]
+    return chain
+
+def find_overlaps(phrases: List[str], groups: Optional[List[Any]] = None) -> Tuple[List[int], List[int]]:
+    """(first, cross): for every phrase, the lowest index of another phrase
+    that wins over it when it is said on its own (len(phrases) if none), and
+    the highest index of a different phrase from another group occurring in
+    it (-1 if none).
+
+    Occurrences follow PhraseAutomaton.first(): a phrase starts at a word
+    start and may end mid-word, and of the phrases starting at the same
+    word only the longest counts. So at its own first word a phrase loses
+    only to an earlier copy of itself, and at a later word to the longest
+    phrase starting there. O(n log n) for phrases of a few words.
+    """
+    groups = groups if groups is not None else [0] * len(phrases)
+    indices: Dict[str, List[int]] = {}
+    for index, phrase in enumerate(phrases):
+        if phrase:
+            indices.setdefault(phrase, []).append(index)
+    ordered = sorted(indices)
+    parent: Dict[str, Optional[str]] = {}
+    stack: List[str] = []
+    for phrase in ordered:
+        while stack and not phrase.startswith(stack[-1]):
+            stack.pop()
+        parent[phrase] = stack[-1] if stack else None
+        stack.append(phrase)
+
+    # A phrase can only start where the text shares its first characters
+    heads = {phrase[:OVERLAP_HEAD] for phrase in ordered}
+    short = {phrase for phrase in ordered if len(phrase) < OVERLAP_HEAD}
+
+    first = [len(phrases)] * len(phrases)
+    cross = [-1] * len(phrases)
+    for index, phrase in enumerate(phrases):
+        if not phrase:
+            continue
+        if indices[phrase][0] < index:
+            first[index] = indices[phrase][0]
+        contained = []
+        other_phrase = parent[phrase]
+        while other_phrase is not None:
+            contained.append(other_phrase)
+            other_phrase = parent[other_phrase]
+        start = 0
+        for word in phrase.split(" ")[:-1]:
+            start += len(word) + 1
+            rest = phrase[start:]
+            if rest[:OVERLAP_HEAD] not in heads and (not short or not any(rest[:length] in short
+                                                                         for length in range(1, OVERLAP_HEAD))):
+                continue
+            chain = prefix_chain(rest, ordered, parent)
+            if chain:
+                first[index] = min(first[index], indices[chain[0]][0])
+                contained.extend(chain)
+        for other_phrase in contained:
+            for other in indices[other_phrase]:
+                if groups[other] != groups[index] and other > cross[index]:
+                    cross[index] = other
+    return first, cross
+
+class Hypothesis(NamedTuple):
+    text: str
+    confidence: float
+    rank: int
+    score: float
+    match: Optional[Any]  # Match, GrammarMatch, the matched extra phrase, or None
+
+class PhraseAutomaton:
+    """Aho-Corasick automaton; phrase ids double as priorities (lower wins).
+
+    Only occurrences starting at a word start count, and of the phrases
+    starting at the same word only the longest, so "погода сейчас" is not
+    taken for "погода". find_overlaps() applies the same rule.
+    """
+
+    def __init__(self, phrases: List[str]):
+        self.goto: List[Dict[str, int]] = [{}]
+        self.own: List[List[int]] = [[]]
+        self.lengths = [len(phrase) for phrase in phrases]
+        for phrase_id, phrase in enumerate(phrases):
+            if not phrase:
+                continue
+            node = 0
+            for char in phrase:
+                nxt = self.goto[node].get(char)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[node][char] = nxt
+                    self.goto.append({})
+                    self.own.append([])
+                node = nxt
+            self.own[node].append(phrase_id)
+
+        size = len(self.goto)
+        self.fail = [0] * size
+        self.link = [-1] * size  # nearest node on the fail chain with its own phrases
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            fail = self.fail[node]
+            self.link[node] = fail if self.own[fail] else self.link[fail]
+            for char, child in self.goto[node].items():
+                state = fail
+                while state and char not in self.goto[state]:
+                    state = self.fail[state]
+                target = self.goto[state].get(char, 0)
+                self.fail[child] = target if target != child else 0
+                queue.append(child)
+
+    def _step(self, node: int, char: str) -> int:
+        goto, fail = self.goto, self.fail
+        while node and char not in goto[node]:
+            node = fail[node]
+        return goto[node].get(char, 0)
+
+    def first(self, text: str) -> Optional[Tuple[int, int]]:
+        """(phrase id, end position) of the lowest-id phrase among the longest at each word start"""
+        longest: Dict[int, Tuple[int, int]] = {}  # start -> (end, phrase id)
+        for phrase_id, end in self.find_all(text):
+            start = end - self.lengths[phrase_id]
+            best = longest.get(start)
+            if best is None or end > best[0] or (end == best[0] and phrase_id < best[1]):
+                longest[start] = (end, phrase_id)
+        if not longest:
+            return None
+        end, phrase_id = min(longest.values(), key=lambda found: found[1])
+        return phrase_id, end
+
+    def find_all(self, text: str) -> List[Tuple[int, int]]:
+        """Every (phrase id, end position) occurrence in text"""
+        found = []
+        node = 0
+        own, link, lengths = self.own, self.link, self.lengths
+        for position, char in enumerate(text):
+            node = self._step(node, char)
+            state = node if own[node] else link[node]
+            while state > 0:
+                for phrase_id in own[state]:
+                    if at_word_start(text, position + 1 - lengths[phrase_id]):
+                        found.append((phrase_id, position + 1))
+                state = link[state]
+        return found
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"goto": self.goto, "own": self.own, "fail": self.fail, "link": self.link,
+                "lengths": self.lengths}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "PhraseAutomaton":
+        automaton = cls.__new__(cls)
+        for key in ("goto", "own", "fail", "link", "lengths"):
+            if not isinstance(data.get(key), list):
+                raise ValueError(f"В автомате нет поля {key}")
+            setattr(automaton, key, data[key])
+        return automaton
+
+class CommandMatcher:
+    """Maps transcripts to commands: phrase automaton first, then the regex grammar"""
+
+    def __init__(self, entries: List[CommandEntry], automaton: Optional[PhraseAutomaton] = None,
+                 grammar: Optional[List[Tuple[str, str, List[str]]]] = None, source: Any = None):
+        self.entries = entries
+        self.phrases = [normalize_text(entry.phrase) for entry in entries]
+        self._automaton = automaton
+        self.grammar = list(grammar if grammar is not None else GRAMMAR)
+        self.grammar_res = [(action, re.compile(pattern), types) for action, pattern, types in self.grammar]
+        self.source = source
+
+    @classmethod
+    def from_commands(cls, commands: Dict[str, Any], source: Any = None) -> "CommandMatcher":
+        """Build from {category: {phrase: data}}; JSON order is the match priority"""
+        entries = [
+            CommandEntry(category, phrase, data.get("action", ""), list(data.get("params", [])),
+                         data.get("description", ""))
+            for category, category_commands in commands.items()
+            for phrase, data in category_commands.items()
+        ]
+        return cls(entries, source=source)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    @property
+    def automaton(self) -> PhraseAutomaton:
+        """Built on first use, so conflict analysis alone never pays for it"""
+        if self._automaton is None:
+            self._automaton = PhraseAutomaton(self.phrases)
+        return self._automaton
+
+    def match(self, text: str) -> Optional[Match]:
+        """The command whose phrase occurs in text and comes first in priority order"""
+        found = self.automaton.first(normalize_text(text))
+        if found is None:
+            return None
+        index, end = found
+        return Match(index, self.entries[index], end - self.automaton.lengths[index], end)
+
+    def match_all(self, text: str) -> List[Match]:
+        """All distinct commands whose phrases occur in text, in priority order"""
+        seen = {}
+        for index, end in self.automaton.find_all(normalize_text(text)):
+            if index not in seen:
+                seen[index] = Match(index, self.entries[index], end - self.automaton.lengths[index], end)
+        return [seen[index] for index in sorted(seen)]
+
+    def match_command(self, text: str) -> Optional[Union[Match, GrammarMatch]]:
+        """What text runs: the phrase match, unless a grammar rule matches a span
+        covering it ("кликни 3 раз" is click_mouse_times, not the "кликни"
+        phrase); the grammar also answers when no phrase matches.
+        """
+        normalized = normalize_text(text)
+        match = self.match(normalized)
+        grammar = self.match_grammar(normalized)
+        if grammar and (match is None or (grammar.start <= match.start and match.end <= grammar.end)):
+            return grammar
+        return match
+
+    def match_grammar(self, text: str) -> Optional[GrammarMatch]:
+        for action, regex, types in self.grammar_res:
+            m = regex.search(text)
+            if m:
+                params = [int(value) if kind == "int" else value for value, kind in zip(m.groups(), types)]
+                return GrammarMatch(action, params, m.start(), m.end())
+        return None
+
+    def rank_alternatives(self, alternatives: List[Tuple[str, Optional[float]]],
+                          extra_phrases: Tuple[str, ...] = (), commands: bool = True) -> List[Hypothesis]:
+        """Score recognizer n-best (text, confidence) pairs, best first.
+
+        A hypothesis scores its confidence plus MATCH_BONUS if a command, the
+        grammar or one of extra_phrases matches, plus COVERAGE_WEIGHT times
+        the share of the utterance the match covers.
+        """
+        ranked = []
+        previous = None
+        for rank, (text, confidence) in enumerate(alternatives):
+            if confidence is None:
+                confidence = (DEFAULT_CONFIDENCE if previous is None else previous) - (RANK_PENALTY if rank else 0.0)
+            previous = confidence
+            normalized = normalize_text(text)
+            match, covered = None, 0
+            for phrase in extra_phrases:
+                if phrase in normalized:
+                    match, covered = phrase, len(phrase)
+                    break
+            if match is None and commands:
+                match = self.match_command(text)
+                if match is not None:
+                    covered = match.end - match.start
+            score = confidence
+            if match is not None:
+                score += MATCH_BONUS + COVERAGE_WEIGHT * min(1.0, covered / max(len(normalized), 1))
+            ranked.append(Hypothesis(text, confidence, rank, score, match))
+        ranked.sort(key=lambda hypothesis: (-hypothesis.score, hypothesis.rank))
+        return ranked
+
+    def conflicts(self) -> List[Dict[str, Any]]:
+        """Phrases that can never win or shadow each other across categories.
+
+        Grammar rules are not reported: match_command() lets a rule win over
+        any phrase inside its match.
+
+        Overlaps come from find_overlaps(): a phrase is reported at most once
+        as shadowed (by the first phrase that wins over it) and once as
+        ambiguous (with the last phrase of another category it contains).
+        """
+        report = []
+        first, cross = find_overlaps(self.phrases, [entry.category for entry in self.entries])
+        for index, phrase in enumerate(self.phrases):
+            if not phrase:
+                report.append(self._conflict("empty", index, index))
+            if first[index] < index:
+                kind = "duplicate" if self.phrases[first[index]] == phrase else "shadowed"
+                report.append(self._conflict(kind, index, first[index]))
+            if cross[index] > index:
+                report.append(self._conflict("ambiguous", index, cross[index]))
+        return report
+
+    def _conflict(self, kind: str, index: int, other: int) -> Dict[str, Any]:
+        entry, by = self.entries[index], self.entries[other]
+        return {"kind": kind,
+                "phrase": entry.phrase, "category": entry.category,
+                "by": {"category": by.category, "phrase": by.phrase}}
+
+    def save(self, path: Optional[str] = None):
+        """Write a versioned bundle: magic, format version, JSON payload"""
+        path = path or default_bundle_path()
+        payload = json.dumps({
+            "source": self.source,
+            "entries": [list(entry) for entry in self.entries],
+            "automaton": self.automaton.to_dict(),
+            "grammar": self.grammar,
+        }, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(BUNDLE_MAGIC + struct.pack(">HQ", BUNDLE_VERSION, len(payload)))
+            f.write(payload)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: Optional[str] = None) -> "CommandMatcher":
+        """Load a bundle written by save(); raises ValueError on a foreign or outdated file"""
+        path = path or default_bundle_path()
+        with open(path, 'rb') as f:
+            header = f.read(len(BUNDLE_MAGIC) + 10)
+            if len(header) < len(BUNDLE_MAGIC) + 10 or not header.startswith(BUNDLE_MAGIC):
+                raise ValueError(f"{path} не является пакетом команд")
+            version, size = struct.unpack(">HQ", header[len(BUNDLE_MAGIC):])
+            if version != BUNDLE_VERSION:
+                raise ValueError(f"Версия пакета {version} не поддерживается (нужна {BUNDLE_VERSION})")
+            payload = f.read()
+        if len(payload) != size:
+            raise ValueError(f"{path}: пакет команд повреждён")
+        data = json.loads(payload.decode("utf-8"))
+        entries = [CommandEntry(*entry) for entry in data["entries"]]
+        grammar = [(action, pattern, types) for action, pattern, types in data["grammar"]]
+        return cls(entries, PhraseAutomaton.from_dict(data["automaton"]), grammar, data["source"])
+
+def compile_store(store) -> CommandMatcher:
+    """Matcher for the current contents of a CommandStore, tagged with its version"""
+    version = store.version()
+    return CommandMatcher.from_commands(store.load_all(), source=list(version))
+
+def load_matcher(store, path: Optional[str] = None) -> Tuple[CommandMatcher, bool]:
+    """Compiled bundle if it matches the store, otherwise a matcher built in memory.
+
+    Returns (matcher, loaded_from_bundle).
+    """
+    path = path or default_bundle_path()
+    if os.path.exists(path):
+        try:
+            matcher = CommandMatcher.load(path)
+            if matcher.source == list(store.version()):
+                return matcher, True
+        except (OSError, ValueError, KeyError, TypeError, re.error):
+            pass
+    return compile_store(store), False
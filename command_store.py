@@ -0,0 +1,416 @@
+#!/usr/bin/env python3
+"""
+Shared SQLite command store for the assistant, the GUI and the CLI tools.
+
+commands.json stays the import/export format: a new database is filled from
+it on first open, and export_json() writes the same layout back. Later opens
+only add built-in commands the database has never seen (ones shipped by an
+update); edits to existing entries are loaded with import_json().
+"""
+
+import difflib
+import json
+import os
+import sqlite3
+import sys
+import threading
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+DEFAULT_JSON = 'commands.json'
+SEARCH_LIMIT = 20
+FUZZY_CANDIDATES = 200
+FUZZY_MIN_RATIO = 0.5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS categories (
+    name TEXT PRIMARY KEY,
+    position INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS commands (
+    id INTEGER PRIMARY KEY,
+    category TEXT NOT NULL,
+    phrase TEXT NOT NULL,
+    action TEXT NOT NULL,
+    params TEXT NOT NULL DEFAULT '[]',
+    description TEXT NOT NULL DEFAULT '',
+    UNIQUE (category, phrase)
+);
+CREATE INDEX IF NOT EXISTS idx_commands_phrase ON commands (phrase);
+CREATE INDEX IF NOT EXISTS idx_commands_category ON commands (category, id);
+CREATE INDEX IF NOT EXISTS idx_commands_action ON commands (action);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+-- Built-in (category, phrase) pairs from commands.json already offered to this database
+CREATE TABLE IF NOT EXISTS seeded (
+    category TEXT NOT NULL,
+    phrase TEXT NOT NULL,
+    PRIMARY KEY (category, phrase)
+) WITHOUT ROWID;
+INSERT OR IGNORE INTO meta (key, value) VALUES ('change_counter', 0);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('store_id', abs(random()));
+CREATE TRIGGER IF NOT EXISTS commands_changed_insert AFTER INSERT ON commands BEGIN
+    UPDATE meta SET value = value + 1 WHERE key = 'change_counter';
+END;
+CREATE TRIGGER IF NOT EXISTS commands_changed_update AFTER UPDATE ON commands BEGIN
+    UPDATE meta SET value = value + 1 WHERE key = 'change_counter';
+END;
+CREATE TRIGGER IF NOT EXISTS commands_changed_delete AFTER DELETE ON commands BEGIN
+    UPDATE meta SET value = value + 1 WHERE key = 'change_counter';
+END;
+"""
+
+# Trigram full-text index over the commands table (SQLite 3.34+ built with FTS5);
+# without it search() falls back to a LIKE scan.
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE commands_fts USING fts5 (
+    phrase, description, category, action,
+    content='commands', content_rowid='id', tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS commands_fts_insert AFTER INSERT ON commands BEGIN
+    INSERT INTO commands_fts (rowid, phrase, description, category, action)
+    VALUES (new.id, new.phrase, new.description, new.category, new.action);
+END;
+CREATE TRIGGER IF NOT EXISTS commands_fts_delete AFTER DELETE ON commands BEGIN
+    INSERT INTO commands_fts (commands_fts, rowid, phrase, description, category, action)
+    VALUES ('delete', old.id, old.phrase, old.description, old.category, old.action);
+END;
+CREATE TRIGGER IF NOT EXISTS commands_fts_update AFTER UPDATE ON commands BEGIN
+    INSERT INTO commands_fts (commands_fts, rowid, phrase, description, category, action)
+    VALUES ('delete', old.id, old.phrase, old.description, old.category, old.action);
+    INSERT INTO commands_fts (rowid, phrase, description, category, action)
+    VALUES (new.id, new.phrase, new.description, new.category, new.action);
+END;
+INSERT INTO commands_fts (commands_fts) VALUES ('rebuild');
+"""
+
+ROW_FIELDS = ("category", "phrase", "action", "params", "description")
+
+def default_db_path() -> str:
+    return os.environ.get("ASSISTANT_DB", "commands.db")
+
+class CommandStore:
+    """Row-level access to commands in a WAL-mode SQLite database"""
+
+    def __init__(self, path: Optional[str] = None, json_path: str = DEFAULT_JSON, bootstrap: bool = True):
+        self.path = path or default_db_path()
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        # SQLite's lower() only folds ASCII
+        self.conn.create_function("py_lower", 1, lambda value: value.lower() if value else value, deterministic=True)
+        self.conn.executescript(SCHEMA)
+        self.fts = self._init_fts()
+        if bootstrap:
+            self._bootstrap(json_path)
+
+    def _bootstrap(self, json_path: str):
+        """Add the commands.json entries this database has never been offered: all of them
+        when it is new, later only built-ins shipped by an update.
+
+        Each entry is offered once, so commands the user deleted or moved stay that way,
+        and an entry whose phrase already exists in any category is skipped.
+        """
+        if not os.path.exists(json_path):
+            return
+        try:
+            with open(json_path, 'r', encoding='utf-8') as f:
+                commands = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Ошибка чтения {json_path}, встроенные команды не добавлены: {e}")
+            sys.stdout.flush()
+            return
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                first = self.conn.execute("SELECT 1 FROM meta WHERE key = 'bootstrapped'").fetchone() is None \
+                    and self.count() == 0
+                seeded = set(self.conn.execute("SELECT category, phrase FROM seeded").fetchall())
+                added = 0
+                for category, category_commands in commands.items():
+                    for phrase, data in category_commands.items():
+                        if (category, phrase) in seeded:
+                            continue
+                        self.conn.execute("INSERT INTO seeded (category, phrase) VALUES (?, ?)", (category, phrase))
+                        if self.conn.execute("SELECT 1 FROM commands WHERE phrase = ?", (phrase,)).fetchone():
+                            continue
+                        self._ensure_category(category)
+                        self.conn.execute(
+                            "INSERT INTO commands (category, phrase, action, params, description) VALUES (?, ?, ?, ?, ?)",
+                            (category, phrase, data.get("action", ""),
+                             json.dumps(data.get("params") or [], ensure_ascii=False), data.get("description", ""))
+                        )
+                        added += 1
+                self.conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('bootstrapped', 1)")
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+        if first and added:
+            print(f"📥 Импортировано команд из {json_path} в {self.path}: {added}. "
+                  f"Дальше из {json_path} добавляются только новые встроенные команды, "
+                  f"правки загружает manage_commands.py import-json")
+        elif added:
+            print(f"📥 Добавлено новых встроенных команд из {json_path}: {added}")
+        if added:
+            sys.stdout.flush()
+
+    def _init_fts(self) -> bool:
+        exists = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'commands_fts'"
+        ).fetchone() is not None
+        if exists:
+            return True
+        try:
+            self.conn.executescript("BEGIN IMMEDIATE;" + FTS_SCHEMA + "COMMIT;")
+            return True
+        except sqlite3.OperationalError:
+            if self.conn.in_transaction:
+                self.conn.execute("ROLLBACK")
+            return False
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def count(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM commands").fetchone()[0]
+
+    def change_counter(self) -> int:
+        """Monotonic counter bumped by every insert, update and delete"""
+        with self.lock:
+            return self.conn.execute("SELECT value FROM meta WHERE key = 'change_counter'").fetchone()[0]
+
+    def version(self) -> Tuple[int, int]:
+        """(store id, change counter): identifies the exact contents of this database"""
+        with self.lock:
+            rows = dict(self.conn.execute(
+                "SELECT key, value FROM meta WHERE key IN ('store_id', 'change_counter')"
+            ).fetchall())
+        return rows["store_id"], rows["change_counter"]
+
+    def _ensure_category(self, category: str):
+        self.conn.execute(
+            "INSERT OR IGNORE INTO categories (name, position) "
+            "SELECT ?, COALESCE(MAX(position), -1) + 1 FROM categories",
+            (category,)
+        )
+
+    def load_all(self) -> Dict[str, Dict[str, Any]]:
+        """All commands as {category: {phrase: {action, params, description}}} in insertion order"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT c.category, c.phrase, c.action, c.params, c.description FROM commands c "
+                "LEFT JOIN categories k ON k.name = c.category ORDER BY k.position, c.id"
+            ).fetchall()
+        commands: Dict[str, Dict[str, Any]] = {}
+        for category, phrase, action, params, description in rows:
+            commands.setdefault(category, {})[phrase] = {
+                "action": action,
+                "params": json.loads(params),
+                "description": description
+            }
+        return commands
+
+    def get(self, category: str, phrase: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT action, params, description FROM commands WHERE category = ? AND phrase = ?",
+                (category, phrase)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"action": row[0], "params": json.loads(row[1]), "description": row[2]}
+
+    def find_phrase(self, phrase: str) -> List[str]:
+        """Categories that contain the phrase"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT c.category FROM commands c LEFT JOIN categories k ON k.name = c.category "
+                "WHERE c.phrase = ? ORDER BY k.position", (phrase,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def upsert(self, category: str, phrase: str, action: str, params: Optional[list] = None,
+               description: str = "") -> bool:
+        """Insert or update one command; returns True if it was new"""
+        params_json = json.dumps(params or [], ensure_ascii=False)
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._ensure_category(category)
+                existed = self.conn.execute(
+                    "SELECT 1 FROM commands WHERE category = ? AND phrase = ?", (category, phrase)
+                ).fetchone() is not None
+                self.conn.execute(
+                    "INSERT INTO commands (category, phrase, action, params, description) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT (category, phrase) DO UPDATE SET "
+                    "action = excluded.action, params = excluded.params, description = excluded.description",
+                    (category, phrase, action, params_json, description)
+                )
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+        return not existed
+
+    def delete(self, category: str, phrase: str) -> bool:
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                deleted = self.conn.execute(
+                    "DELETE FROM commands WHERE category = ? AND phrase = ?", (category, phrase)
+                ).rowcount > 0
+                self.conn.execute(
+                    "DELETE FROM categories WHERE name = ? AND NOT EXISTS "
+                    "(SELECT 1 FROM commands WHERE category = ?)", (category, category)
+                )
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+        return deleted
+
+    def search(self, query: str, limit: int = SEARCH_LIMIT) -> List[Tuple[str, str, Dict[str, Any]]]:
+        """Ranked (category, phrase, data) matches for query.
+
+        Ranking: exact phrase, phrase prefix, phrase substring, match in another
+        field, then fuzzy matches (shared trigrams, scored by similarity).
+        """
+        query = " ".join(query.lower().split())
+        if not query:
+            return []
+        with self.lock:
+            if self.fts and len(query) >= 3:
+                substring = self.conn.execute(
+                    "SELECT c.category, c.phrase, c.action, c.params, c.description FROM commands_fts f "
+                    "JOIN commands c ON c.id = f.rowid WHERE commands_fts MATCH ? ORDER BY f.rank",
+                    ('"' + query.replace('"', '""') + '"',)
+                ).fetchall()
+            else:
+                pattern = "%" + query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+                substring = self.conn.execute(
+                    "SELECT category, phrase, action, params, description FROM commands "
+                    "WHERE py_lower(phrase) LIKE ?1 ESCAPE '\\' OR py_lower(description) LIKE ?1 ESCAPE '\\' "
+                    "OR py_lower(category) LIKE ?1 ESCAPE '\\' OR py_lower(action) LIKE ?1 ESCAPE '\\'",
+                    (pattern,)
+                ).fetchall()
+            fuzzy = []
+            if self.fts and len(substring) < limit and len(query) >= 3:
+                trigrams = {query[i:i + 3] for i in range(len(query) - 2)}
+                fuzzy = self.conn.execute(
+                    "SELECT c.category, c.phrase, c.action, c.params, c.description FROM commands_fts f "
+                    "JOIN commands c ON c.id = f.rowid WHERE commands_fts MATCH ? ORDER BY f.rank LIMIT ?",
+                    (" OR ".join('"' + t.replace('"', '""') + '"' for t in trigrams), FUZZY_CANDIDATES)
+                ).fetchall()
+
+        ranked = []
+        seen = set()
+        for row in substring:
+            phrase = row[1].lower()
+            if phrase == query:
+                tier = 0
+            elif phrase.startswith(query):
+                tier = 1
+            elif query in phrase:
+                tier = 2
+            else:
+                tier = 3
+            ranked.append((tier, 0.0, len(phrase), row))
+            seen.add((row[0], row[1]))
+        for row in fuzzy:
+            if (row[0], row[1]) in seen:
+                continue
+            ratio = difflib.SequenceMatcher(None, query, row[1].lower()).ratio()
+            if ratio >= FUZZY_MIN_RATIO:
+                ranked.append((4, -ratio, len(row[1]), row))
+        ranked.sort(key=lambda item: item[:3])
+        return [
+            (category, phrase, {"action": action, "params": json.loads(params), "description": description})
+            for _, _, _, (category, phrase, action, params, description) in ranked[:limit]
+        ]
+
+    def iter_rows(self) -> Iterator[Tuple[str, str, str, list, str]]:
+        """Stream (category, phrase, action, params, description) in store order"""
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute(
+                "SELECT c.category, c.phrase, c.action, c.params, c.description FROM commands c "
+                "LEFT JOIN categories k ON k.name = c.category ORDER BY k.position, c.id"
+            )
+            while True:
+                batch = cursor.fetchmany(1000)
+                if not batch:
+                    return
+                for category, phrase, action, params, description in batch:
+                    yield category, phrase, action, json.loads(params), description
+
+    def import_commands(self, commands: Dict[str, Any], replace: bool = False) -> int:
+        """Insert or update many commands in one transaction"""
+        rows = (
+            (category, phrase, data.get("action", ""), data.get("params", []), data.get("description", ""))
+            for category, category_commands in commands.items()
+            for phrase, data in category_commands.items()
+        )
+        return self.import_rows(rows, replace=replace)
+
+    def import_rows(self, rows: Iterable[Tuple[str, str, str, list, str]], replace: bool = False) -> int:
+        """Insert or update (category, phrase, action, params, description) rows in one transaction"""
+        categories: Dict[str, None] = {}
+        prepared: List[Tuple[str, str, str, str, str]] = []
+        for category, phrase, action, params, description in rows:
+            categories.setdefault(category)
+            prepared.append((category, phrase, action, json.dumps(params or [], ensure_ascii=False), description))
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                if replace:
+                    self.conn.execute("DELETE FROM commands")
+                    self.conn.execute("DELETE FROM categories")
+                for category in categories:
+                    self._ensure_category(category)
+                self.conn.executemany(
+                    "INSERT INTO commands (category, phrase, action, params, description) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT (category, phrase) DO UPDATE SET "
+                    "action = excluded.action, params = excluded.params, description = excluded.description",
+                    prepared
+                )
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+        return len(prepared)
+
+    def import_json(self, json_path: str = DEFAULT_JSON, replace: bool = False) -> int:
+        with open(json_path, 'r', encoding='utf-8') as f:
+            return self.import_commands(json.load(f), replace=replace)
+
+    def export_json(self, json_path: str = DEFAULT_JSON) -> int:
+        """Write all commands in the commands.json layout"""
+        commands = self.load_all()
+        tmp_path = json_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(commands, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, json_path)
+        return sum(len(category_commands) for category_commands in commands.values())
+
+_default_store = None
+
+def open_store() -> CommandStore:
+    """Process-wide store on the default database"""
+    global _default_store
+    if _default_store is None:
+        _default_store = CommandStore()
+    return _default_store
+
+def load_commands() -> Dict[str, Any]:
+    """Load commands from the shared store; empty dict (with a message) on failure"""
+    try:
+        return open_store().load_all()
+    except (sqlite3.Error, OSError, ValueError) as e:
+        print(f"Ошибка чтения базы команд: {e}")
+        sys.stdout.flush()
+        return {}
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+Local control socket for the voice assistant.
+
+Protocol: newline-delimited JSON-RPC 2.0 over a Unix domain socket.
+Requests get exactly one response; after a successful "subscribe" call the
+connection turns into a stream of "event" notifications.
+"""
+
+import json
+import os
+import queue
+import socket
+import socketserver
+import sys
+import tempfile
+import threading
+from typing import Any, Callable, Dict, Optional
+
+EVENT_QUEUE_SIZE = 1000
+
+def default_socket_path() -> str:
+    """Socket path shared by the assistant, the GUI and scripts"""
+    path = os.environ.get("ASSISTANT_SOCKET")
+    if path:
+        return path
+    uid = os.getuid() if hasattr(os, "getuid") else 0
+    return os.path.join(tempfile.gettempdir(), f"loner_assistant_{uid}.sock")
+
+def is_supported() -> bool:
+    return hasattr(socket, "AF_UNIX")
+
+class RPCError(Exception):
+    """Error returned to the client as a JSON-RPC error object"""
+
+    def __init__(self, message: str, code: int = -32000):
+        super().__init__(message)
+        self.code = code
+
+_reply = threading.local()
+
+def after_reply(callback: Callable[[], None]):
+    """Run callback once the response to the request being handled has been written and flushed.
+
+    Outside a socket request (direct calls, HTTP) it runs right away.
+    """
+    callbacks = getattr(_reply, "callbacks", None)
+    if callbacks is None:
+        callback()
+    else:
+        callbacks.append(callback)
+
+class _Subscriber:
+    def __init__(self):
+        self.queue = queue.Queue(maxsize=EVENT_QUEUE_SIZE)
+
+    def push(self, event: Dict[str, Any]):
+        # Slow subscribers lose the oldest events instead of blocking the assistant
+        while True:
+            try:
+                self.queue.put_nowait(event)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        server = self.server.control
+        for raw in self.rfile:
+            try:
+                request = json.loads(raw.decode("utf-8"))
+            except (UnicodeDecodeError, json.JSONDecodeError):
+                self._send({"jsonrpc": "2.0", "id": None,
+                            "error": {"code": -32700, "message": "Parse error"}})
+                continue
+            request_id = request.get("id")
+            method = request.get("method")
+            params = request.get("params") or {}
+            if method == "subscribe":
+                self._send({"jsonrpc": "2.0", "id": request_id, "result": True})
+                self._stream_events(server)
+                return
+            _reply.callbacks = []
+            try:
+                self._send(server.dispatch(request_id, method, params))
+            finally:
+                callbacks, _reply.callbacks = _reply.callbacks, None
+                for callback in callbacks:
+                    callback()
+
+    def _stream_events(self, server: "ControlServer"):
+        subscriber = server.add_subscriber()
+        try:
+            while not server.stopped.is_set():
+                try:
+                    event = subscriber.queue.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                self._send({"jsonrpc": "2.0", "method": "event", "params": event})
+        except OSError:
+            pass
+        finally:
+            server.remove_subscriber(subscriber)
+
+    def _send(self, message: Dict[str, Any]):
+        self.wfile.write(json.dumps(message, ensure_ascii=False).encode("utf-8") + b"\n")
+        self.wfile.flush()
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+class ControlServer:
+    """JSON-RPC control plane: method dispatch plus event fan-out to subscribers"""
+
+    def __init__(self, methods: Dict[str, Callable[..., Any]], path: Optional[str] = None):
+        self.methods = methods
+        self.path = path or default_socket_path()
+        self.subscribers = []
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.server = None
+        self.inode = None
+
+    def start(self) -> bool:
+        """Bind the socket and serve in a background thread"""
+        if os.path.exists(self.path):
+            if ControlClient(self.path).ping():
+                print(f"⚠️ Управляющий сокет {self.path} уже занят другим ассистентом")
+                sys.stdout.flush()
+                return False
+            os.unlink(self.path)
+        self.server = _UnixServer(self.path, _Handler)
+        self.server.control = self
+        os.chmod(self.path, 0o600)
+        self.inode = os.stat(self.path).st_ino
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return True
+
+    def release_path(self):
+        """Unlink the socket path so another process can bind it; open connections keep working"""
+        try:
+            if self.inode is not None and os.stat(self.path).st_ino == self.inode:
+                os.unlink(self.path)
+        except OSError:
+            pass
+        self.inode = None
+
+    def stop(self):
+        self.stopped.set()
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+            self.release_path()
+
+    def dispatch(self, request_id: Any, method: str, params: Any) -> Dict[str, Any]:
+        func = self.methods.get(method)
+        if func is None:
+            return {"jsonrpc": "2.0", "id": request_id,
+                    "error": {"code": -32601, "message": f"Method not found: {method}"}}
+        try:
+            result = func(**params) if isinstance(params, dict) else func(*params)
+            return {"jsonrpc": "2.0", "id": request_id, "result": result}
+        except RPCError as e:
+            return {"jsonrpc": "2.0", "id": request_id, "error": {"code": e.code, "message": str(e)}}
+        except TypeError as e:
+            return {"jsonrpc": "2.0", "id": request_id, "error": {"code": -32602, "message": str(e)}}
+        except Exception as e:
+            return {"jsonrpc": "2.0", "id": request_id, "error": {"code": -32603, "message": str(e)}}
+
+    def add_subscriber(self) -> _Subscriber:
+        subscriber = _Subscriber()
+        with self.lock:
+            self.subscribers.append(subscriber)
+        return subscriber
+
+    def remove_subscriber(self, subscriber: _Subscriber):
+        with self.lock:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+
+    def publish(self, event_type: str, **data):
+        """Send an event to every subscriber"""
+        if not self.subscribers:
+            return
+        event = {"type": event_type, **data}
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            subscriber.push(event)
+
+    def queue_depths(self) -> Dict[str, int]:
+        with self.lock:
+            subscribers = list(self.subscribers)
+        return {"subscribers": len(subscribers),
+                "queued_events": sum(subscriber.queue.qsize() for subscriber in subscribers)}
+
+class ControlClient:
+    """Client for the assistant control socket"""
+
+    def __init__(self, path: Optional[str] = None, timeout: float = 5.0):
+        self.path = path or default_socket_path()
+        self.timeout = timeout
+        self.next_id = 0
+
+    def _connect(self) -> socket.socket:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.path)
+        return sock
+
+    def call(self, method: str, **params) -> Any:
+        """Call a method and return its result; raises RPCError on failure"""
+        self.next_id += 1
+        request = {"jsonrpc": "2.0", "id": self.next_id, "method": method, "params": params}
+        with self._connect() as sock:
+            sock.sendall(json.dumps(request, ensure_ascii=False).encode("utf-8") + b"\n")
+            with sock.makefile("rb") as reader:
+                line = reader.readline()
+        if not line:
+            raise RPCError("Соединение закрыто ассистентом")
+        response = json.loads(line.decode("utf-8"))
+        if "error" in response:
+            raise RPCError(response["error"]["message"], response["error"].get("code", -32000))
+        return response.get("result")
+
+    def ping(self) -> bool:
+        try:
+            self.call("status")
+            return True
+        except (OSError, RPCError, ValueError):
+            return False
+
+    def subscribe(self, callback: Callable[[Dict[str, Any]], None], stop: Optional[threading.Event] = None):
+        """Stream events into callback until the connection closes or stop is set"""
+        with self._connect() as sock:
+            sock.settimeout(None if stop is None else 0.5)
+            sock.sendall(b'{"jsonrpc": "2.0", "id": 0, "method": "subscribe"}\n')
+            buffer = b""
+            while stop is None or not stop.is_set():
+                try:
+                    chunk = sock.recv(65536)
+                except socket.timeout:
+                    continue
+                if not chunk:
+                    return
+                buffer += chunk
+                while b"\n" in buffer:
+                    line, buffer = buffer.split(b"\n", 1)
+                    message = json.loads(line.decode("utf-8"))
+                    if message.get("method") == "event":
+                        callback(message["params"])
+
+def main():
+    """Command-line client: control_server.py <method> [json params] | events"""
+    if len(sys.argv) < 2:
+        print("Использование: python control_server.py <status|reload|enable|disable|execute_text|jobs|cancel_job|recognition_stats|dry_run|dry_run_log|profile|profile_stop|apps|history|events> [параметры JSON]")
+        return 1
+    client = ControlClient()
+    method = sys.argv[1]
+    try:
+        if method == "events":
+            client.subscribe(lambda event: print(json.dumps(event, ensure_ascii=False), flush=True))
+            return 0
+        params = json.loads(sys.argv[2]) if len(sys.argv) > 2 else {}
+        if method == "execute_text" and not isinstance(params, dict):
+            params = {"text": params}
+        print(json.dumps(client.call(method, **params), ensure_ascii=False, indent=2))
+        return 0
+    except (OSError, RPCError) as e:
+        print(f"❌ Ошибка управления ассистентом: {e}")
+        return 1
+    except KeyboardInterrupt:
+        return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Streaming dictation for notes.
+
+Audio is taken from the continuous capture in chunks that end at pauses, or
+that are cut after a few seconds of uninterrupted speech with the next chunk
+overlapping the cut. Chunks are recognized in parallel and merged in order:
+the words a chunk shares with the end of the previous one are dropped, and
+the last words before a cut are held back until the overlapping chunk
+confirms or corrects them. Merged text is handed over as soon as it is
+final, and control phrases end the dictation as soon as their chunk is
+recognized.
+"""
+
+import re
+import sys
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Iterable, List, Optional, Sequence, Tuple
+
+WORKERS = 2
+HOLD_WORDS = 2          # words before a cut kept back until the overlapping chunk arrives
+MAX_OVERLAP_WORDS = 8   # longest run of repeated words looked for at a boundary
+MAX_SKIP_WORDS = 2      # words at the start of an overlapping chunk that may be a clipped fragment
+CONTEXT_WORDS = 12      # committed words kept for matching the next overlap
+
+def word_key(word: str) -> str:
+    return re.sub(r"[^\w]", "", word.casefold().replace("ё", "е"))
+
+class DictationMerger:
+    """Joins chunk transcripts into one text without the words repeated across overlaps"""
+
+    def __init__(self, control_phrases: Sequence[str] = ()):
+        self.control_phrases = [[word_key(word) for word in phrase.split()] for phrase in control_phrases]
+        self.pending: List[str] = []   # held back from a cut chunk
+        self.context: List[str] = []   # last committed words
+
+    def _align(self, words: List[str]) -> Tuple[int, int]:
+        """(pending words to keep, first new word to take) that best join `words` to what came before.
+
+        Pending words after the longest repeated run are dropped as a clipped
+        fragment, so are new words before it. Within the run, the first half
+        is taken from the earlier chunk and the rest from the new one: each
+        heard those words further from its edge.
+        """
+        context = [word_key(word) for word in self.context + self.pending]
+        keys = [word_key(word) for word in words]
+        for length in range(min(MAX_OVERLAP_WORDS, len(context), len(keys)), 0, -1):
+            for dropped in range(0, min(len(self.pending), len(context) - length) + 1):
+                tail = context[len(context) - dropped - length:len(context) - dropped]
+                for skip in range(0, min(MAX_SKIP_WORDS, len(keys) - length) + 1):
+                    if keys[skip:skip + length] == tail:
+                        in_pending = min(length, len(self.pending) - dropped)
+                        old_half = in_pending // 2
+                        return (len(self.pending) - dropped - in_pending + old_half,
+                                skip + length - in_pending + old_half)
+        return len(self.pending), 0
+
+    def _find_control(self, words: List[str]) -> Optional[Tuple[int, int]]:
+        keys = [word_key(word) for word in words]
+        for index, phrase in enumerate(self.control_phrases):
+            for start in range(len(keys) - len(phrase) + 1):
+                if keys[start:start + len(phrase)] == phrase:
+                    return index, start
+        return None
+
+    def add(self, text: str, overlapped: bool, cut: bool) -> Tuple[List[str], Optional[int]]:
+        """Words that became final, and the index of a control phrase if one was spoken.
+
+        After a control phrase the words before it are final and the merger
+        starts over.
+        """
+        words = text.split()
+        if overlapped and (self.pending or self.context):
+            kept, start = self._align(words)
+            self.pending = self.pending[:kept]
+            words = words[start:]
+        words = self.pending + words
+        self.pending = []
+
+        control = self._find_control(words)
+        if control is not None:
+            final = words[:control[1]]
+            self.context = []
+            return final, control[0]
+
+        if cut:
+            final, self.pending = words[:-HOLD_WORDS] if len(words) > HOLD_WORDS else [], words[-HOLD_WORDS:]
+        else:
+            final = words
+        self.context = (self.context + final)[-CONTEXT_WORDS:]
+        return final, None
+
+    def flush(self) -> List[str]:
+        """Held-back words, final once no overlapping chunk will come"""
+        final, self.pending = self.pending, []
+        self.context = (self.context + final)[-CONTEXT_WORDS:]
+        return final
+
+class StreamingDictation:
+    """Recognizes chunks in parallel and feeds the results to a DictationMerger in order"""
+
+    def __init__(self, transcribe: Callable[[Any], Optional[str]], on_text: Callable[[str], None],
+                 control_phrases: Sequence[str] = (), workers: int = WORKERS):
+        self.transcribe = transcribe
+        self.on_text = on_text
+        self.control_phrases = list(control_phrases)
+        self.merger = DictationMerger(control_phrases)
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="dictation")
+        self.queue: deque = deque()   # (future, overlapped, cut) in capture order
+        self.lock = threading.Lock()
+        self.control: Optional[str] = None
+        self.done = threading.Event()   # set by a control phrase
+
+    def submit(self, audio, overlapped: bool, cut: bool):
+        future = self.pool.submit(self.transcribe, audio)
+        with self.lock:
+            self.queue.append((future, overlapped, cut))
+        future.add_done_callback(self._merge_ready)
+
+    def _merge_ready(self, _future: Optional[Future] = None):
+        """Merge every finished chunk at the head of the queue (results arrive out of order)"""
+        with self.lock:
+            while self.queue and self.queue[0][0].done() and not self.done.is_set():
+                future, overlapped, cut = self.queue.popleft()
+                try:
+                    text = future.result()
+                except Exception as e:
+                    print(f"Ошибка распознавания диктовки: {e}")
+                    sys.stdout.flush()
+                    text = None
+                if not text:
+                    # Nothing to align with: the next chunk starts a new line of text
+                    self._emit(self.merger.flush())
+                    continue
+                words, control = self.merger.add(text, overlapped, cut)
+                self._emit(words)
+                if control is not None:
+                    self.control = self.control_phrases[control]
+                    self.done.set()
+
+    def _emit(self, words: List[str]):
+        if words:
+            self.on_text(" ".join(words))
+
+    def run(self, chunks: Iterable[Tuple[Any, bool, bool]]) -> Optional[str]:
+        """Dictate until the chunks end or a control phrase is heard; returns that phrase"""
+        try:
+            for audio, overlapped, cut in chunks:
+                if self.done.is_set():
+                    break
+                self.submit(audio, overlapped, cut)
+            # Let in-flight chunks finish so no dictated words are lost
+            with self.lock:
+                futures = [future for future, _, _ in self.queue]
+            for future in futures:
+                try:
+                    future.exception()
+                except Exception:
+                    pass
+            self._merge_ready()
+            if not self.done.is_set():
+                self._emit(self.merger.flush())
+        finally:
+            self.pool.shutdown(wait=False)
+        return self.control
@@ -5,15 +5,213 @@ Graphical interface for managing voice assistant commands
 
 import tkinter as tk
 from tkinter import ttk, messagebox, simpledialog, scrolledtext
-import json
 import os
 import sys
 import threading
-import subprocess
 import queue
 import time
 import signal
-from typing import Dict, Any
+import sqlite3
+from collections import deque
+from typing import Dict, Any, List, Tuple
+
+import action_registry
+import command_store
+import control_server
+import history_store
+from command_index import CommandSearchIndex, normalize
+from supervisor import AssistantSupervisor
+
+FILTER_DEBOUNCE_MS = 150
+FILTER_MAX_RESULTS = 500
+
+LOG_MAX_LINES = 2000
+LOG_BATCH_MAX = 500
+LOG_TICK_BUDGET = 0.008
+LOG_TICK_IDLE_MS = 100
+LOG_TICK_BUSY_MS = 10
+
+class LogPanel:
+    """Terminal view with a bounded line buffer, batched inserts and level/stage filters"""
+    
+    COLORS = ("green", "red", "orange", "blue")
+    LEVELS = {"Все уровни": 0, "Предупреждения": 1, "Ошибки": 2}
+    STAGES = {
+        "Все этапы": None,
+        "Прослушивание": "listen",
+        "Распознавание": "recognize",
+        "Действия": "action",
+        "Система": "system"
+    }
+    
+    def __init__(self, parent, max_lines=LOG_MAX_LINES):
+        self.max_lines = max_lines
+        self.lines = deque(maxlen=max_lines)
+        
+        toolbar = ttk.Frame(parent)
+        toolbar.grid(row=0, column=0, sticky="ew", pady=(0, 5))
+        self.level_var = tk.StringVar(value="Все уровни")
+        level_combo = ttk.Combobox(toolbar, textvariable=self.level_var, values=list(self.LEVELS), width=14, state="readonly")
+        level_combo.grid(row=0, column=0, padx=(0, 5))
+        level_combo.bind('<<ComboboxSelected>>', lambda event: self.refresh())
+        self.stage_var = tk.StringVar(value="Все этапы")
+        stage_combo = ttk.Combobox(toolbar, textvariable=self.stage_var, values=list(self.STAGES), width=14, state="readonly")
+        stage_combo.grid(row=0, column=1, padx=(0, 5))
+        stage_combo.bind('<<ComboboxSelected>>', lambda event: self.refresh())
+        self.autoscroll_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(toolbar, text="Автопрокрутка", variable=self.autoscroll_var,
+                        command=self.on_autoscroll_toggle).grid(row=0, column=2)
+        
+        self.text = scrolledtext.ScrolledText(parent, width=50, height=15, font=("Consolas", 9))
+        self.text.grid(row=1, column=0, sticky="nsew")
+        for color in self.COLORS:
+            self.text.tag_config(color, foreground=color)
+    
+    @staticmethod
+    def classify(message: str) -> Tuple[int, str]:
+        """Guess level (0 info, 1 warning, 2 error) and pipeline stage of an assistant line"""
+        if message.startswith(("❌", "💥")) or "Ошибка" in message or "Критическая" in message:
+            level = 2
+        elif message.startswith("⚠️"):
+            level = 1
+        else:
+            level = 0
+        if message.startswith("Слушаю"):
+            stage = "listen"
+        elif message.startswith(("Ты сказал", "Текстовая команда", "⌨️")) or "распознавания" in message:
+            stage = "recognize"
+        elif message.startswith("🗣️") or message.startswith("Ошибка при") or "Команды выключены" in message:
+            stage = "action"
+        else:
+            stage = "system"
+        return level, stage
+    
+    def visible(self, level: int, stage: str) -> bool:
+        wanted_stage = self.STAGES.get(self.stage_var.get())
+        return level >= self.LEVELS.get(self.level_var.get(), 0) and (wanted_stage is None or stage == wanted_stage)
+    
+    def write(self, entries: List[Tuple[str, str]]):
+        """Append (message, color) entries with a single widget insert"""
+        timestamp = time.strftime("%H:%M:%S")
+        chunks = []
+        for message, color in entries:
+            level, stage = self.classify(message)
+            if color not in self.COLORS:
+                color = "red" if level == 2 else "orange" if level == 1 else ""
+            line = (f"[{timestamp}] {message}\n", color, level, stage)
+            self.lines.append(line)
+            if self.visible(level, stage):
+                chunks.extend((line[0], line[1]))
+        if not chunks:
+            return
+        self.text.insert(tk.END, *chunks)
+        self.trim()
+        if self.autoscroll_var.get():
+            self.text.see(tk.END)
+    
+    def trim(self):
+        """Drop the oldest widget lines beyond max_lines"""
+        excess = int(self.text.index("end-1c").split(".")[0]) - 1 - self.max_lines
+        if excess > 0:
+            self.text.delete("1.0", f"{excess + 1}.0")
+    
+    def refresh(self):
+        """Re-render the buffer after a filter change"""
+        chunks = []
+        for text, color, level, stage in self.lines:
+            if self.visible(level, stage):
+                chunks.extend((text, color))
+        self.text.delete("1.0", tk.END)
+        if chunks:
+            self.text.insert(tk.END, *chunks)
+        self.text.see(tk.END)
+    
+    def on_autoscroll_toggle(self):
+        if self.autoscroll_var.get():
+            self.text.see(tk.END)
+    
+    def clear(self):
+        self.lines.clear()
+        self.text.delete("1.0", tk.END)
+
+class HistoryWindow:
+    """Usage analytics from the command history: tabs fed by the daily rollups, refreshed on demand"""
+    
+    PERIODS = {"Сегодня": 1, "7 дней": 7, "30 дней": 30, "Год": 365}
+    TABS = (
+        ("top", "🏆 Частые", (("command", "Команда", 260), ("count", "Раз", 60), ("avg_total_ms", "Среднее, мс", 90))),
+        ("failures", "❌ Неудачи", (("command", "Команда", 260), ("count", "Всего", 60), ("errors", "Ошибок", 60),
+                                    ("error_percent", "%", 60))),
+        ("outcomes", "📋 Исходы", (("outcome", "Исход", 200), ("count", "Раз", 60), ("percent", "%", 60))),
+        ("slowest", "🐢 Медленные", (("action", "Действие", 200), ("count", "Раз", 60), ("avg_ms", "Среднее, мс", 90),
+                                     ("max_ms", "Макс., мс", 90))),
+        ("unmatched", "❓ Нераспознанные", (("transcript", "Фраза", 320), ("count", "Раз", 60))),
+    )
+    
+    def __init__(self, parent):
+        self.store = history_store.HistoryStore()
+        self.window = tk.Toplevel(parent)
+        self.window.title("📈 История команд")
+        self.window.geometry("640x420")
+        self.window.columnconfigure(0, weight=1)
+        self.window.rowconfigure(1, weight=1)
+        self.window.protocol("WM_DELETE_WINDOW", self.close)
+        
+        toolbar = ttk.Frame(self.window, padding="5")
+        toolbar.grid(row=0, column=0, sticky="ew")
+        self.period_var = tk.StringVar(value="30 дней")
+        period_combo = ttk.Combobox(toolbar, textvariable=self.period_var, values=list(self.PERIODS), width=10, state="readonly")
+        period_combo.grid(row=0, column=0, padx=(0, 5))
+        period_combo.bind('<<ComboboxSelected>>', lambda event: self.refresh())
+        ttk.Button(toolbar, text="🔄 Обновить", command=self.refresh).grid(row=0, column=1, padx=(0, 10))
+        self.stages_label = ttk.Label(toolbar, text="")
+        self.stages_label.grid(row=0, column=2, sticky="w")
+        
+        notebook = ttk.Notebook(self.window)
+        notebook.grid(row=1, column=0, sticky="nsew", padx=5, pady=(0, 5))
+        self.trees = {}
+        for key, title, columns in self.TABS:
+            frame = ttk.Frame(notebook)
+            frame.columnconfigure(0, weight=1)
+            frame.rowconfigure(0, weight=1)
+            tree = ttk.Treeview(frame, columns=[column for column, _, _ in columns], show="headings")
+            for column, heading, width in columns:
+                tree.heading(column, text=heading)
+                tree.column(column, width=width, anchor="w" if width > 100 else "e")
+            scrollbar = ttk.Scrollbar(frame, orient="vertical", command=tree.yview)
+            tree.configure(yscrollcommand=scrollbar.set)
+            tree.grid(row=0, column=0, sticky="nsew")
+            scrollbar.grid(row=0, column=1, sticky="ns")
+            notebook.add(frame, text=title)
+            self.trees[key] = (tree, [column for column, _, _ in columns])
+        self.refresh()
+    
+    def fill(self, key, rows):
+        tree, columns = self.trees[key]
+        tree.delete(*tree.get_children())
+        for row in rows:
+            tree.insert("", "end", values=["" if row.get(column) is None else row[column] for column in columns])
+    
+    def refresh(self):
+        days = self.PERIODS[self.period_var.get()]
+        try:
+            failures = self.store.failure_rates(days)
+            self.fill("top", self.store.top_commands(days, limit=100))
+            self.fill("failures", failures["commands"])
+            self.fill("outcomes", [dict(share, outcome=outcome) for outcome, share in failures["outcomes"].items()])
+            self.fill("slowest", self.store.slowest_actions(days, limit=100))
+            self.fill("unmatched", self.store.unmatched(days, limit=100))
+            stages = self.store.stages(days)
+        except sqlite3.Error as e:
+            self.stages_label.config(text=f"❌ {e}")
+            return
+        dash = lambda value: "—" if value is None else value
+        self.stages_label.config(text=f"{stages['count']} записей, в среднем: распознавание {dash(stages['recognize_ms'])} мс, "
+                                      f"действие {dash(stages['action_ms'])} мс, всего {dash(stages['total_ms'])} мс")
+    
+    def close(self):
+        self.store.close()
+        self.window.destroy()
 
 class CommandsGUI:
     def __init__(self, root):
@@ -23,26 +221,32 @@ class CommandsGUI:
         self.root.resizable(True, True)
         
         self.commands = self.load_commands()
+        self.search_index = CommandSearchIndex(self.commands)
+        self.category_items = {}
+        self.command_items = {}
+        self.placeholders = {}
+        self.loaded_categories = set()
+        self.total_commands = sum(len(commands) for commands in self.commands.values())
+        self.visible_commands = None
+        self.highlighted_items = set()
+        self.filter_job = None
+        self.history_window = None
         
-        self.assistant_process = None
         self.assistant_running = False
+        self.commands_enabled = True
         self.log_queue = queue.Queue()
         self.listening_animation = False
         self.animation_dots = 0
+        self.control = control_server.ControlClient() if control_server.is_supported() else None
+        self.events_stop = threading.Event()
+        self.breakers = {}
+        self.supervisor = AssistantSupervisor(
+            on_output=self.log_queue.put,
+            on_state=lambda state: self.root.after(0, self.on_supervisor_state, state)
+        )
         
-        self.available_actions = [
-            "open_app",
-            "kill_process", 
-            "open_url",
-            "system_command",
-            "move_mouse",
-            "click_mouse",
-            "take_screenshot",
-            "focus_mode",
-            "say",
-            "disable_commands",
-            "enable_commands"
-        ]
+        self.actions = action_registry.default_registry()
+        self.available_actions = self.actions.names()
         
         self.available_categories = [
             "applications",
@@ -61,23 +265,23 @@ class CommandsGUI:
         self.process_logs()
     
     def load_commands(self) -> Dict[str, Any]:
-        """Load commands from JSON file"""
+        """Load commands from the shared command store"""
         try:
-            with open('commands.json', 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except FileNotFoundError:
-            messagebox.showwarning("Предупреждение", "Файл commands.json не найден. Будет создан новый файл.")
-            return {}
-        except json.JSONDecodeError as e:
-            messagebox.showerror("Ошибка", f"Ошибка чтения JSON файла: {e}")
+            self.store = command_store.open_store()
+            return self.store.load_all()
+        except Exception as e:
+            self.store = None
+            messagebox.showerror("Ошибка", f"Ошибка чтения базы команд: {e}")
             return {}
     
     def save_commands(self):
-        """Save commands to JSON file"""
+        """Export commands to commands.json (edits are already saved row by row)"""
+        if not self.store:
+            messagebox.showerror("Ошибка", "База команд недоступна")
+            return
         try:
-            with open('commands.json', 'w', encoding='utf-8') as f:
-                json.dump(self.commands, f, ensure_ascii=False, indent=2)
-            messagebox.showinfo("Успех", "Команды сохранены!")
+            count = self.store.export_json(command_store.DEFAULT_JSON)
+            messagebox.showinfo("Успех", f"Экспортировано команд в {command_store.DEFAULT_JSON}: {count}")
         except Exception as e:
             messagebox.showerror("Ошибка", f"Ошибка сохранения: {e}")
     
@@ -133,6 +337,7 @@ class CommandsGUI:
         self.commands_tree.column("#0", width=200)
         self.commands_tree.column("category", width=100)
         self.commands_tree.column("action", width=80)
+        self.commands_tree.tag_configure("match", background="#fff3b0")
         
         commands_scrollbar = ttk.Scrollbar(left_frame, orient=tk.VERTICAL, command=self.commands_tree.yview)
         commands_scrollbar.grid(row=1, column=1, sticky="ns")
@@ -148,7 +353,7 @@ class CommandsGUI:
         ttk.Button(list_buttons_frame, text="➕", command=self.add_command_dialog, width=3).grid(row=0, column=0, padx=(0, 2))
         ttk.Button(list_buttons_frame, text="✏️", command=self.edit_command_dialog, width=3).grid(row=0, column=1, padx=(0, 2))
         ttk.Button(list_buttons_frame, text="🗑️", command=self.delete_command, width=3).grid(row=0, column=2, padx=(0, 2))
-        ttk.Button(list_buttons_frame, text="🔄", command=self.refresh_commands_list, width=3).grid(row=0, column=3)
+        ttk.Button(list_buttons_frame, text="🔄", command=self.reload_commands, width=3).grid(row=0, column=3)
         
         center_frame = ttk.LabelFrame(main_frame, text="📝 Редактирование команды", padding="10")
         center_frame.grid(row=2, column=1, sticky="nsew", padx=(0, 8))
@@ -186,7 +391,7 @@ class CommandsGUI:
         
         ttk.Button(buttons_frame, text="💾 Сохранить команду", command=self.save_current_command).grid(row=0, column=0, padx=(0, 10))
         ttk.Button(buttons_frame, text="❌ Отменить", command=self.clear_form).grid(row=0, column=1, padx=(0, 10))
-        ttk.Button(buttons_frame, text="💾 Сохранить файл", command=self.save_commands).grid(row=0, column=2)
+        ttk.Button(buttons_frame, text="💾 Экспорт в JSON", command=self.save_commands).grid(row=0, column=2)
         
         right_frame = ttk.LabelFrame(main_frame, text="🎛️ Управление ассистентом", padding="10")
         right_frame.grid(row=2, column=2, sticky="nsew")
@@ -210,20 +415,45 @@ class CommandsGUI:
         self.restart_button = ttk.Button(assistant_buttons_frame, text="🔄 Перезапустить", command=self.restart_assistant, state="disabled")
         self.restart_button.grid(row=0, column=2)
         
-        ttk.Button(right_frame, text="🗑️ Очистить терминал", command=self.clear_terminal).grid(row=2, column=0, pady=(0, 10))
+        control_frame = ttk.Frame(right_frame)
+        control_frame.grid(row=2, column=0, sticky="ew", pady=(0, 10))
+        control_frame.columnconfigure(0, weight=1)
+        
+        self.toggle_commands_button = ttk.Button(control_frame, text="⏸️ Выключить команды", command=self.toggle_commands, state="disabled")
+        self.toggle_commands_button.grid(row=0, column=0, sticky="ew", padx=(0, 5))
+        self.reload_button = ttk.Button(control_frame, text="♻️ Перечитать команды", command=self.reload_assistant_commands, state="disabled")
+        self.reload_button.grid(row=0, column=1, columnspan=2)
+        
+        self.text_command_var = tk.StringVar()
+        self.text_command_entry = ttk.Entry(control_frame, textvariable=self.text_command_var, state="disabled")
+        self.text_command_entry.grid(row=1, column=0, columnspan=2, sticky="ew", pady=(5, 0), padx=(0, 5))
+        self.text_command_entry.bind('<Return>', lambda event: self.send_text_command())
+        self.send_text_button = ttk.Button(control_frame, text="➤", command=self.send_text_command, width=3, state="disabled")
+        self.send_text_button.grid(row=1, column=2, pady=(5, 0))
+        self.dry_run_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(control_frame, text="🧪 Пробный запуск (без действий)", variable=self.dry_run_var,
+                        command=self.toggle_dry_run).grid(row=2, column=0, columnspan=3, sticky="w", pady=(5, 0))
+        
+        tools_frame = ttk.Frame(right_frame)
+        tools_frame.grid(row=3, column=0, pady=(0, 10))
+        ttk.Button(tools_frame, text="🗑️ Очистить терминал", command=self.clear_terminal).grid(row=0, column=0, padx=(0, 5))
+        ttk.Button(tools_frame, text="📈 История команд", command=self.show_history).grid(row=0, column=1)
         
         self.stats_label = ttk.Label(right_frame, text="Команд: 0 | Категорий: 0", font=("Arial", 10))
-        self.stats_label.grid(row=3, column=0, pady=(0, 10))
+        self.stats_label.grid(row=4, column=0, pady=(0, 5))
+        
+        self.recognition_label = ttk.Label(right_frame, text="", font=("Arial", 10))
+        self.recognition_label.grid(row=5, column=0, pady=(0, 5))
         
         terminal_frame = ttk.LabelFrame(right_frame, text="📊 Терминал", padding="5")
-        terminal_frame.grid(row=4, column=0, sticky="nsew", pady=(0, 10))
+        terminal_frame.grid(row=6, column=0, sticky="nsew", pady=(0, 10))
         terminal_frame.columnconfigure(0, weight=1)
-        terminal_frame.rowconfigure(0, weight=1)
+        terminal_frame.rowconfigure(1, weight=1)
         
-        self.terminal_text = scrolledtext.ScrolledText(terminal_frame, width=50, height=15, font=("Consolas", 9))
-        self.terminal_text.grid(row=0, column=0, sticky="nsew")
+        self.log_panel = LogPanel(terminal_frame)
         
         self.commands_tree.bind('<<TreeviewSelect>>', self.on_command_select)
+        self.commands_tree.bind('<<TreeviewOpen>>', self.on_tree_open)
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
         
         self.update_stats()
@@ -237,10 +467,93 @@ class CommandsGUI:
             self.restart_button.config(state="normal")
             self.status_label.config(text="Статус: Работает", foreground="green")
         else:
+            self.commands_enabled = True
+            self.breakers.clear()
+            self.recognition_label.config(text="")
             self.start_button.config(state="normal")
             self.stop_button.config(state="disabled")
             self.restart_button.config(state="disabled")
             self.status_label.config(text="Статус: Остановлен", foreground="red")
+        
+        control_state = "normal" if self.assistant_running and self.control else "disabled"
+        for widget in (self.toggle_commands_button, self.reload_button, self.text_command_entry, self.send_text_button):
+            widget.config(state=control_state)
+        self.toggle_commands_button.config(
+            text="⏸️ Выключить команды" if self.commands_enabled else "▶️ Включить команды")
+    
+    def control_call(self, method, on_result=None, **params):
+        """Call the assistant control socket in a background thread"""
+        if not self.control:
+            return
+        
+        def worker():
+            try:
+                result = self.control.call(method, **params)
+            except (OSError, control_server.RPCError) as e:
+                self.log_queue.put(f"❌ Ошибка управления ({method}): {e}")
+                return
+            if on_result:
+                self.root.after(0, on_result, result)
+        
+        threading.Thread(target=worker, daemon=True).start()
+    
+    def toggle_commands(self):
+        """Enable or disable assistant commands over the control socket"""
+        self.control_call("disable" if self.commands_enabled else "enable", self.on_assistant_status)
+    
+    def reload_assistant_commands(self):
+        """Ask the running assistant to reload commands"""
+        self.control_call("reload", lambda result: self.log_to_terminal(f"♻️ Перечитано команд: {result['commands']}", "blue"))
+    
+    def send_text_command(self):
+        """Execute the typed text as a command in the running assistant"""
+        text = self.text_command_var.get().strip()
+        if not text:
+            return
+        self.text_command_var.set("")
+        self.control_call("execute_text", lambda result: self.log_to_terminal(f"⌨️ {text} → {result.get('result')}", "blue"), text=text)
+    
+    def toggle_dry_run(self):
+        """Record actions instead of performing them, now and in every assistant started from here"""
+        enabled = self.dry_run_var.get()
+        args = [arg for arg in self.supervisor.args if arg != "--dry-run"]
+        self.supervisor.args = args + ["--dry-run"] if enabled else args
+        if self.assistant_running:
+            self.control_call("dry_run", self.on_assistant_status, enabled=enabled)
+    
+    def on_assistant_status(self, status):
+        self.commands_enabled = status.get("commands_enabled", True)
+        self.update_assistant_controls()
+    
+    def watch_assistant_events(self):
+        """Subscribe to assistant events once its control socket is up"""
+        while not self.events_stop.is_set() and self.assistant_running:
+            try:
+                self.control.subscribe(self.on_assistant_event, self.events_stop)
+            except (OSError, ValueError):
+                pass
+            self.events_stop.wait(0.5)
+    
+    def on_assistant_event(self, event):
+        """Handle an event from the event stream thread"""
+        if event.get("type") in ("state", "reloaded"):
+            self.root.after(0, self.control_call, "status", self.on_assistant_status)
+        elif event.get("type") == "breaker":
+            self.root.after(0, self.on_breaker_event, event)
+        elif event.get("type") == "dry_run":
+            params = " ".join(str(param) for param in event.get("params", []))
+            self.log_queue.put(f"🧪 {event['action']} {params}".rstrip())
+    
+    def on_breaker_event(self, event):
+        """Show recognition backends whose circuit breaker is not closed"""
+        if event["state"] == "closed":
+            self.breakers.pop(event["backend"], None)
+        else:
+            self.breakers[event["backend"]] = event["state"]
+        states = {"open": "офлайн", "half_open": "проверка"}
+        self.recognition_label.config(
+            text=" | ".join(f"📴 {backend}: {states[state]}" for backend, state in sorted(self.breakers.items())),
+            foreground="orange")
     
     def start_assistant(self):
         """Start assistant process"""
@@ -248,74 +561,61 @@ class CommandsGUI:
             return
         
         try:
-            self.assistant_process = subprocess.Popen(
-                [sys.executable, 'assistant.py'],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                text=True,
-                bufsize=1,
-                universal_newlines=True
-            )
+            self.supervisor.start()
             self.assistant_running = True
             self.update_assistant_controls()
             self.start_listening_animation()
             
-            output_thread = threading.Thread(target=self.read_assistant_output, daemon=True)
-            output_thread.start()
+            if self.control:
+                self.events_stop.clear()
+                threading.Thread(target=self.watch_assistant_events, daemon=True).start()
             
             self.log_to_terminal("🎤 Ассистент запущен!", "green")
         except Exception as e:
-            self.log_to_terminal(f"❌ Ошибка запуска ассистента: {e}", "red")
+            self.log_to_terminal(f"❌ Ошибка запуска ассистента: {e}", "red", force=True)
     
     def restart_assistant(self):
-        """Restart assistant process"""
-        self.stop_assistant()
-        time.sleep(1)
-        self.start_assistant()
+        """Restart assistant: a warm standby process takes over once it is ready"""
+        if not self.assistant_running:
+            self.start_assistant()
+            return
+        threading.Thread(target=self.supervisor.restart, daemon=True).start()
     
     def stop_assistant(self, force=False):
         """Stop assistant process"""
-        if not self.assistant_running or not self.assistant_process:
+        if not self.assistant_running:
             return
         
+        self.events_stop.set()
         try:
-            if force:
-                self.assistant_process.kill()
-            else:
-                self.assistant_process.terminate()
-                
-            try:
-                self.assistant_process.wait(timeout=5)
-            except subprocess.TimeoutExpired:
-                self.assistant_process.kill()
-                self.assistant_process.wait()
-                
+            self.supervisor.stop(force=force)
         except Exception as e:
             self.log_to_terminal(f"❌ Ошибка остановки ассистента: {e}", "red")
         finally:
+            self.log_to_terminal("🛑 Ассистент остановлен", "orange")
             self.assistant_running = False
-            self.assistant_process = None
             self.update_assistant_controls()
             self.stop_listening_animation()
-            self.log_to_terminal("🛑 Ассистент остановлен", "orange")
     
-    def read_assistant_output(self):
-        """Read assistant process output"""
-        try:
-            for line in iter(self.assistant_process.stdout.readline, ''):
-                if line:
-                    self.log_queue.put(line.strip())
-                if self.assistant_process.poll() is not None:
-                    break
-        except Exception as e:
-            self.log_to_terminal(f"❌ Ошибка чтения вывода: {e}", "red")
-        finally:
+    def on_supervisor_state(self, state):
+        """Handle supervisor state changes (running, crashed, stopped)"""
+        if state == "running" and not self.assistant_running:
+            self.assistant_running = True
+            self.update_assistant_controls()
+            self.start_listening_animation()
+        elif state == "crashed":
+            self.stop_listening_animation()
+            self.status_label.config(text="Статус: Перезапуск...", foreground="orange")
+            self.root.after(1000, self.start_listening_animation)
+        elif state == "stopped" and self.assistant_running and not self.supervisor.running:
             self.assistant_running = False
-            self.root.after(0, self.update_assistant_controls)
-            self.root.after(0, self.stop_listening_animation)
+            self.update_assistant_controls()
+            self.stop_listening_animation()
     
     def start_listening_animation(self):
         """Start listening animation"""
+        if self.listening_animation:
+            return
         self.listening_animation = True
         self.animate_listening()
     
@@ -336,83 +636,228 @@ class CommandsGUI:
         """Log message to terminal"""
         if not force and not self.assistant_running:
             return
-            
-        color_tags = {
-            "green": "green",
-            "red": "red", 
-            "orange": "orange",
-            "blue": "blue"
-        }
-        
-        tag = color_tags.get(color, "white")
-        timestamp = time.strftime("%H:%M:%S")
-        
-        self.terminal_text.insert(tk.END, f"[{timestamp}] {message}\n", tag)
-        self.terminal_text.see(tk.END)
-        
-        if tag != "white":
-            self.terminal_text.tag_config(tag, foreground=tag)
+        self.log_panel.write([(message, color)])
     
     def clear_terminal(self):
         """Clear terminal output"""
         try:
-            self.terminal_text.delete(1.0, tk.END)
+            self.log_panel.clear()
             self.log_to_terminal("🗑️ Терминал очищен", "blue", force=True)
         except Exception as e:
             self.log_to_terminal(f"❌ Ошибка очистки терминала: {e}", "red", force=True)
     
+    def show_history(self):
+        """Open the usage analytics window (or bring the open one to front)"""
+        if self.history_window is not None and self.history_window.window.winfo_exists():
+            self.history_window.window.lift()
+            self.history_window.refresh()
+            return
+        try:
+            self.history_window = HistoryWindow(self.root)
+        except sqlite3.Error as e:
+            messagebox.showerror("Ошибка", f"Не удалось открыть историю команд: {e}")
+    
     def process_logs(self):
-        """Process log queue"""
+        """Drain the log queue in batches within a per-tick time budget"""
+        batch = []
+        deadline = time.perf_counter() + LOG_TICK_BUDGET
         try:
-            while True:
-                message = self.log_queue.get_nowait()
-                self.log_to_terminal(message)
+            while len(batch) < LOG_BATCH_MAX and time.perf_counter() < deadline:
+                batch.append((self.log_queue.get_nowait(), "white"))
         except queue.Empty:
             pass
         finally:
-            self.root.after(100, self.process_logs)
+            if batch and self.assistant_running:
+                self.log_panel.write(batch)
+            delay = LOG_TICK_IDLE_MS if self.log_queue.empty() else LOG_TICK_BUSY_MS
+            self.root.after(delay, self.process_logs)
     
     def refresh_commands_list(self):
-        """Refresh commands list"""
+        """Refresh commands list; category children are inserted when a category is expanded"""
         for item in self.commands_tree.get_children():
             self.commands_tree.delete(item)
+        self.category_items.clear()
+        self.command_items.clear()
+        self.placeholders.clear()
+        self.loaded_categories.clear()
+        self.highlighted_items.clear()
         
-        for category, commands in self.commands.items():
-            category_item = self.commands_tree.insert("", "end", text=category, values=("", ""))
-            for command, data in commands.items():
-                action = data.get("action", "")
-                self.commands_tree.insert(category_item, "end", text=command, values=(category, action))
+        for category in self.commands:
+            self.insert_category_item(category)
         
+        self.visible_commands = None
+        self.total_commands = sum(len(commands) for commands in self.commands.values())
         self.update_stats()
+        if self.search_var.get().strip():
+            self.apply_filter()
     
-    def filter_commands(self, *args):
-        """Filter commands by search term"""
-        search_term = self.search_var.get().lower()
-        
-        for item in self.commands_tree.get_children():
+    def reload_commands(self):
+        """Re-read commands from the store (picks up edits made by other tools)"""
+        self.commands = self.load_commands()
+        self.search_index.build(self.commands)
+        self.refresh_commands_list()
+    
+    def insert_category_item(self, category, loaded=False):
+        """Insert a collapsed category row with a placeholder child"""
+        category_item = self.commands_tree.insert("", "end", text=category, values=("", ""))
+        self.category_items[category] = category_item
+        if self.commands.get(category) and not loaded:
+            self.placeholders[category] = self.commands_tree.insert(category_item, "end", text="…", values=("", ""))
+        else:
+            self.loaded_categories.add(category)
+        return category_item
+    
+    def insert_command_item(self, category, command, index="end"):
+        data = self.commands[category][command]
+        item = self.commands_tree.insert(self.category_items[category], index, text=command,
+                                         values=(category, data.get("action", "")))
+        self.command_items[(category, command)] = item
+        return item
+    
+    def on_tree_open(self, event):
+        """Fill a category with its commands on first expand"""
+        item = self.commands_tree.focus()
+        if self.commands_tree.parent(item):
+            return
+        category = self.commands_tree.item(item)["text"]
+        if category not in self.loaded_categories and self.visible_commands is None:
+            self.load_category(category)
+    
+    def load_category(self, category):
+        """Insert missing command rows of a category in file order"""
+        tree = self.commands_tree
+        category_item = self.category_items[category]
+        placeholder = self.placeholders.pop(category, None)
+        if placeholder is not None:
+            tree.delete(placeholder)
+        for position, command in enumerate(self.commands.get(category, {})):
+            item = self.command_items.get((category, command))
+            if item is None:
+                self.insert_command_item(category, command)
+            else:
+                tree.move(item, category_item, position)
+        self.loaded_categories.add(category)
+    
+    def tree_upsert_command(self, category, command, is_new):
+        """Apply a saved command to the tree as a single row insert or update"""
+        tree = self.commands_tree
+        if category not in self.category_items:
+            self.insert_category_item(category, loaded=True)
+        item = self.command_items.get((category, command))
+        if item is not None:
+            tree.item(item, values=(category, self.commands[category][command].get("action", "")))
+        elif category in self.loaded_categories:
+            item = self.insert_command_item(category, command)
+        if is_new:
+            self.total_commands += 1
+        if self.visible_commands is not None:
+            if item is not None:
+                self.visible_commands.add((category, command))
+            self.filter_commands()
+        self.update_stats()
+    
+    def tree_delete_command(self, category, command):
+        """Remove a deleted command's row (and its category row if it became empty)"""
+        item = self.command_items.pop((category, command), None)
+        if item is not None:
             self.commands_tree.delete(item)
+            self.highlighted_items.discard(item)
+        if self.visible_commands is not None:
+            self.visible_commands.discard((category, command))
+        if category not in self.commands:
+            category_item = self.category_items.pop(category, None)
+            if category_item is not None:
+                self.commands_tree.delete(category_item)
+            self.placeholders.pop(category, None)
+            self.loaded_categories.discard(category)
+        self.total_commands -= 1
+        self.update_stats()
+    
+    def filter_commands(self, *args):
+        """Debounce search input: filter once typing pauses"""
+        if self.filter_job is not None:
+            self.root.after_cancel(self.filter_job)
+        self.filter_job = self.root.after(FILTER_DEBOUNCE_MS, self.apply_filter)
+    
+    def apply_filter(self):
+        """Show ranked search results by detaching and moving existing tree items"""
+        self.filter_job = None
+        query = self.search_var.get().strip()
+        tree = self.commands_tree
+        
+        for item in self.highlighted_items:
+            if tree.exists(item):
+                tree.item(item, tags=())
+        self.highlighted_items.clear()
+        
+        if not query:
+            self.show_all_commands()
+            return
         
-        for category, commands in self.commands.items():
-            if search_term in category.lower():
-                category_item = self.commands_tree.insert("", "end", text=category, values=("", ""))
-                for command, data in commands.items():
-                    action = data.get("action", "")
-                    description = data.get("description", "")
-                    if (search_term in command.lower() or 
-                        search_term in action.lower() or 
-                        search_term in description.lower()):
-                        self.commands_tree.insert(category_item, "end", text=command, values=(category, action))
+        results = self.search_index.search(query, limit=FILTER_MAX_RESULTS)
+        visible = set(results)
+        previous = self.visible_commands if self.visible_commands is not None else self.command_items.keys()
+        hidden = [self.command_items[key] for key in previous if key not in visible and key in self.command_items]
+        if hidden:
+            tree.detach(*hidden)
+        
+        needle = normalize(query)
+        positions = {}
+        for key in results:
+            category = key[0]
+            if category not in self.category_items:
+                continue
+            item = self.command_items.get(key)
+            if item is None:
+                item = self.insert_command_item(category, key[1])
+            index = positions.get(category, 0)
+            tree.move(item, self.category_items[category], index)
+            positions[category] = index + 1
+            if needle in normalize(key[1]):
+                tree.item(item, tags=("match",))
+                self.highlighted_items.add(item)
+        
+        for index, category in enumerate(positions):
+            placeholder = self.placeholders.get(category)
+            if placeholder is not None:
+                tree.detach(placeholder)
+            tree.move(self.category_items[category], "", index)
+            tree.item(self.category_items[category], open=True)
+        empty = [item for category, item in self.category_items.items() if category not in positions]
+        if empty:
+            tree.detach(*empty)
+        
+        self.visible_commands = visible
+        self.update_stats(found=self.search_index.last_total)
+    
+    def show_all_commands(self):
+        """Leave filter mode: restore loaded categories, collapse the rest behind placeholders"""
+        if self.visible_commands is None:
+            return
+        tree = self.commands_tree
+        created = {}
+        for (category, command), item in self.command_items.items():
+            if category not in self.loaded_categories:
+                created.setdefault(category, []).append(item)
+        for index, category in enumerate(self.commands):
+            category_item = self.category_items.get(category)
+            if category_item is None:
+                continue
+            tree.move(category_item, "", index)
+            if category in self.loaded_categories:
+                for position, command in enumerate(self.commands[category]):
+                    item = self.command_items.get((category, command))
+                    if item is not None:
+                        tree.move(item, category_item, position)
             else:
-                category_item = None
-                for command, data in commands.items():
-                    action = data.get("action", "")
-                    description = data.get("description", "")
-                    if (search_term in command.lower() or 
-                        search_term in action.lower() or 
-                        search_term in description.lower()):
-                        if category_item is None:
-                            category_item = self.commands_tree.insert("", "end", text=category, values=("", ""))
-                        self.commands_tree.insert(category_item, "end", text=command, values=(category, action))
+                if created.get(category):
+                    tree.detach(*created[category])
+                placeholder = self.placeholders.get(category)
+                if placeholder is not None:
+                    tree.move(placeholder, category_item, 0)
+                tree.item(category_item, open=False)
+        self.visible_commands = None
+        self.update_stats()
     
     def on_command_select(self, event):
         """Handle command selection"""
@@ -475,10 +920,17 @@ class CommandsGUI:
             
             if messagebox.askyesno("Подтверждение", f"Удалить команду '{command}'?"):
                 if category in self.commands and command in self.commands[category]:
+                    try:
+                        if self.store:
+                            self.store.delete(category, command)
+                    except Exception as e:
+                        messagebox.showerror("Ошибка", f"Ошибка удаления: {e}")
+                        return
                     del self.commands[category][command]
+                    self.search_index.remove(category, command)
                     if not self.commands[category]:
                         del self.commands[category]
-                    self.refresh_commands_list()
+                    self.tree_delete_command(category, command)
                     self.clear_form()
                     messagebox.showinfo("Успех", "Команда удалена!")
     
@@ -494,20 +946,33 @@ class CommandsGUI:
             messagebox.showerror("Ошибка", "Заполните все обязательные поля")
             return
         
-        if category not in self.commands:
-            self.commands[category] = {}
-        
         params = []
         if params_str:
             params = [p.strip() for p in params_str.split(",")]
         
+        error = self.actions.validate(action, params)
+        if error:
+            messagebox.showerror("Ошибка", f"Действие {action}: {error}")
+            return
+        
+        try:
+            if self.store:
+                self.store.upsert(category, command, action, params, description)
+        except Exception as e:
+            messagebox.showerror("Ошибка", f"Ошибка сохранения: {e}")
+            return
+        
+        if category not in self.commands:
+            self.commands[category] = {}
+        is_new = command not in self.commands[category]
         self.commands[category][command] = {
             "action": action,
             "params": params,
             "description": description
         }
+        self.search_index.add(category, command, self.commands[category][command])
         
-        self.refresh_commands_list()
+        self.tree_upsert_command(category, command, is_new)
         messagebox.showinfo("Успех", "Команда сохранена!")
     
     def clear_form(self):
@@ -518,11 +983,12 @@ class CommandsGUI:
         self.params_var.set("")
         self.description_var.set("")
     
-    def update_stats(self):
+    def update_stats(self, found=None):
         """Update statistics"""
-        total_commands = sum(len(commands) for commands in self.commands.values())
-        total_categories = len(self.commands)
-        self.stats_label.config(text=f"Команд: {total_commands} | Категорий: {total_categories}")
+        text = f"Команд: {self.total_commands} | Категорий: {len(self.commands)}"
+        if found is not None:
+            text += f" | Найдено: {found}"
+        self.stats_label.config(text=text)
     
     def on_closing(self):
         """Handle window closing"""
@@ -0,0 +1,418 @@
+#!/usr/bin/env python3
+"""
+Command history and usage analytics in SQLite.
+
+Every utterance becomes one row: transcript, matched command and action, the
+outcome and how long recognition, matching and the action took. Strings are
+interned in a names table, so a row is a handful of integers. Rows are
+written in batches by a background thread. Each batch also adds to per-day
+rollups, so reports read the small rollup tables, not millions of rows.
+The background thread expires raw rows after RAW_DAYS and rollups after
+KEEP_DAYS, then returns the freed pages to the filesystem.
+"""
+
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import Counter, deque
+from typing import Any, Dict, List, Optional, Tuple
+
+RAW_DAYS = int(os.environ.get("ASSISTANT_HISTORY_RAW_DAYS", "30"))
+KEEP_DAYS = int(os.environ.get("ASSISTANT_HISTORY_KEEP_DAYS", "365"))
+FLUSH_INTERVAL = 1.0
+COMPACT_INTERVAL = 3600.0
+DELETE_BATCH = 10000
+MAX_PENDING = 10000       # records kept in memory if the database is busy or unavailable
+NAME_CACHE_SIZE = 50000
+REPORT_DAYS = 30
+REPORT_LIMIT = 20
+
+# Names are interned per kind
+TRANSCRIPT, COMMAND, ACTION, SESSION, SOURCE, BACKEND = range(6)
+NAME_FIELDS = {"transcript": TRANSCRIPT, "command": COMMAND, "action": ACTION, "session": SESSION,
+               "source": SOURCE, "backend": BACKEND}
+
+# Outcomes, stored as their index; the last ones count as failures
+OUTCOMES = ("command", "grammar", "note_started", "note_line", "note_saved", "note_cancelled", "disabled",
+            "unmatched", "not_recognized", "recognition_error", "error")
+FAILURES = ("unmatched", "not_recognized", "recognition_error", "error")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS names (
+    id INTEGER PRIMARY KEY,
+    kind INTEGER NOT NULL,
+    value TEXT NOT NULL,
+    UNIQUE (kind, value)
+);
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    source INTEGER NOT NULL,
+    session INTEGER NOT NULL,
+    transcript INTEGER NOT NULL,
+    command INTEGER NOT NULL,
+    action INTEGER NOT NULL,
+    backend INTEGER NOT NULL,
+    outcome INTEGER NOT NULL,
+    recognize_us INTEGER,
+    match_us INTEGER,
+    action_us INTEGER,
+    total_us INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_events_ts ON events (ts);
+CREATE TABLE IF NOT EXISTS daily (
+    day INTEGER NOT NULL,
+    source INTEGER NOT NULL,
+    outcome INTEGER NOT NULL,
+    command INTEGER NOT NULL,
+    action INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    total_us INTEGER NOT NULL,
+    recognize_us INTEGER NOT NULL,
+    recognize_count INTEGER NOT NULL,
+    match_us INTEGER NOT NULL,
+    action_us INTEGER NOT NULL,
+    action_count INTEGER NOT NULL,
+    action_us_max INTEGER NOT NULL,
+    PRIMARY KEY (day, source, outcome, command, action)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS daily_unmatched (
+    day INTEGER NOT NULL,
+    source INTEGER NOT NULL,
+    transcript INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (day, source, transcript)
+) WITHOUT ROWID;
+"""
+
+def default_db_path() -> str:
+    return os.environ.get("ASSISTANT_HISTORY_DB", "history.db")
+
+def day_of(ts: float) -> int:
+    return int(ts // 86400)
+
+def us(seconds: Optional[float]) -> Optional[int]:
+    """Durations are stored as integer microseconds: matching takes well under a millisecond"""
+    return None if seconds is None else int(round(seconds * 1000000))
+
+def ms(microseconds: Optional[float], digits: int = 2) -> Optional[float]:
+    return None if microseconds is None else round(microseconds / 1000, digits)
+
+class HistoryStore:
+    """Append-only command history with per-day rollups"""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or default_db_path()
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False, isolation_level=None)
+        # Must precede the first table for freed pages to be reclaimable
+        self.conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self.names: Dict[Tuple[int, str], int] = {}
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def _name_id(self, kind: int, value: Optional[str]) -> int:
+        """Interned id of a string; 0 for none"""
+        if not value:
+            return 0
+        key = (kind, value)
+        name_id = self.names.get(key)
+        if name_id is None:
+            self.conn.execute("INSERT OR IGNORE INTO names (kind, value) VALUES (?, ?)", key)
+            name_id = self.conn.execute("SELECT id FROM names WHERE kind = ? AND value = ?", key).fetchone()[0]
+            if len(self.names) >= NAME_CACHE_SIZE:
+                self.names.clear()
+            self.names[key] = name_id
+        return name_id
+
+    def append(self, records: List[Dict[str, Any]]):
+        """Write records (see HistoryRecorder.record) and add them to the rollups, in one transaction"""
+        if not records:
+            return
+        rows = []
+        daily: Dict[tuple, List[int]] = {}
+        unmatched = Counter()
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                for record in records:
+                    ids = {field: self._name_id(kind, record.get(field)) for field, kind in NAME_FIELDS.items()}
+                    outcome = OUTCOMES.index(record["outcome"]) if record["outcome"] in OUTCOMES else OUTCOMES.index("error")
+                    recognize_us, match_us = us(record.get("recognize_time")), us(record.get("match_time"))
+                    action_us, total_us = us(record.get("action_time")), us(record.get("total_time"))
+                    rows.append((record["ts"], ids["source"], ids["session"], ids["transcript"], ids["command"],
+                                 ids["action"], ids["backend"], outcome, recognize_us, match_us, action_us, total_us))
+                    day = day_of(record["ts"])
+                    totals = daily.setdefault((day, ids["source"], outcome, ids["command"], ids["action"]),
+                                              [0, 0, 0, 0, 0, 0, 0, 0])
+                    totals[0] += 1
+                    totals[1] += total_us or 0
+                    totals[2] += recognize_us or 0
+                    totals[3] += recognize_us is not None
+                    totals[4] += match_us or 0
+                    totals[5] += action_us or 0
+                    totals[6] += action_us is not None
+                    totals[7] = max(totals[7], action_us or 0)
+                    if record["outcome"] == "unmatched" and ids["transcript"]:
+                        unmatched[(day, ids["source"], ids["transcript"])] += 1
+                self.conn.executemany(
+                    "INSERT INTO events (ts, source, session, transcript, command, action, backend, outcome, "
+                    "recognize_us, match_us, action_us, total_us) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+                self.conn.executemany(
+                    "INSERT INTO daily VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (day, source, outcome, command, action) DO UPDATE SET "
+                    "count = count + excluded.count, total_us = total_us + excluded.total_us, "
+                    "recognize_us = recognize_us + excluded.recognize_us, "
+                    "recognize_count = recognize_count + excluded.recognize_count, "
+                    "match_us = match_us + excluded.match_us, action_us = action_us + excluded.action_us, "
+                    "action_count = action_count + excluded.action_count, "
+                    "action_us_max = max(action_us_max, excluded.action_us_max)",
+                    [key + tuple(totals) for key, totals in daily.items()])
+                self.conn.executemany(
+                    "INSERT INTO daily_unmatched VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (day, source, transcript) DO UPDATE SET count = count + excluded.count",
+                    [key + (count,) for key, count in unmatched.items()])
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                self.names.clear()  # ids of names inserted in the rolled back transaction are gone
+                raise
+
+    def compact(self, now: Optional[float] = None) -> Dict[str, int]:
+        """Expire raw rows and rollups, drop names nothing refers to, give freed pages back"""
+        now = now or time.time()
+        deleted = {"events": 0, "daily": 0, "names": 0}
+        raw_cutoff = now - RAW_DAYS * 86400
+        while True:
+            # Small transactions so the writer is never held up for long
+            with self.lock:
+                cursor = self.conn.execute(
+                    "DELETE FROM events WHERE id IN (SELECT id FROM events WHERE ts < ? ORDER BY ts LIMIT ?)",
+                    (raw_cutoff, DELETE_BATCH))
+            deleted["events"] += cursor.rowcount
+            if cursor.rowcount < DELETE_BATCH:
+                break
+        with self.lock:
+            day_cutoff = day_of(now) - KEEP_DAYS
+            deleted["daily"] = self.conn.execute("DELETE FROM daily WHERE day < ?", (day_cutoff,)).rowcount
+            self.conn.execute("DELETE FROM daily_unmatched WHERE day < ?", (day_cutoff,))
+            if deleted["events"] or deleted["daily"]:
+                deleted["names"] = self.conn.execute(
+                    "DELETE FROM names WHERE kind = ? AND id NOT IN (SELECT transcript FROM events) "
+                    "AND id NOT IN (SELECT transcript FROM daily_unmatched)", (TRANSCRIPT,)).rowcount
+                self.names.clear()
+            self.conn.execute("PRAGMA incremental_vacuum")
+        return deleted
+
+    def _where(self, days: int, source: Optional[str]) -> Tuple[str, list]:
+        clause, args = "day >= ?", [day_of(time.time()) - days + 1]
+        if source:
+            clause += " AND source = (SELECT id FROM names WHERE kind = ? AND value = ?)"
+            args += [SOURCE, source]
+        return clause, args
+
+    def _query(self, sql: str, args: list) -> List[tuple]:
+        with self.lock:
+            return self.conn.execute(sql, args).fetchall()
+
+    def top_commands(self, days: int = REPORT_DAYS, limit: int = REPORT_LIMIT, source: Optional[str] = None) -> List[Dict[str, Any]]:
+        where, args = self._where(days, source)
+        rows = self._query(
+            f"SELECT names.value, sum(count), sum(total_us) * 1.0 / sum(count) FROM daily "
+            f"JOIN names ON names.id = daily.command WHERE {where} GROUP BY daily.command "
+            f"ORDER BY 2 DESC LIMIT ?", args + [limit])
+        return [{"command": command, "count": count, "avg_total_ms": ms(avg)} for command, count, avg in rows]
+
+    def failure_rates(self, days: int = REPORT_DAYS, source: Optional[str] = None) -> Dict[str, Any]:
+        """Share of every outcome, and per command how often its action raised"""
+        where, args = self._where(days, source)
+        outcomes = dict(self._query(f"SELECT outcome, sum(count) FROM daily WHERE {where} GROUP BY outcome", args))
+        total = sum(outcomes.values())
+        commands = self._query(
+            f"SELECT names.value, sum(count) AS total, sum(CASE WHEN outcome = ? THEN count ELSE 0 END) AS errors "
+            f"FROM daily JOIN names ON names.id = daily.command WHERE {where} GROUP BY daily.command "
+            f"HAVING errors > 0 ORDER BY errors * 1.0 / total DESC",
+            [OUTCOMES.index("error")] + args)
+        failed = sum(outcomes.get(OUTCOMES.index(name), 0) for name in FAILURES)
+        return {
+            "total": total,
+            "failure_percent": round(100 * failed / total, 1) if total else None,
+            "outcomes": {OUTCOMES[outcome]: {"count": count, "percent": round(100 * count / total, 1)}
+                         for outcome, count in sorted(outcomes.items(), key=lambda item: -item[1])},
+            "commands": [{"command": command, "count": count, "errors": errors,
+                          "error_percent": round(100 * errors / count, 1)} for command, count, errors in commands],
+        }
+
+    def slowest_actions(self, days: int = REPORT_DAYS, limit: int = REPORT_LIMIT, source: Optional[str] = None) -> List[Dict[str, Any]]:
+        where, args = self._where(days, source)
+        rows = self._query(
+            f"SELECT names.value, sum(action_count), sum(action_us) * 1.0 / sum(action_count), max(action_us_max) "
+            f"FROM daily JOIN names ON names.id = daily.action WHERE {where} AND action_count > 0 "
+            f"GROUP BY daily.action ORDER BY 3 DESC LIMIT ?", args + [limit])
+        return [{"action": action, "count": count, "avg_ms": ms(avg), "max_ms": ms(longest)}
+                for action, count, avg, longest in rows]
+
+    def unmatched(self, days: int = REPORT_DAYS, limit: int = REPORT_LIMIT, source: Optional[str] = None) -> List[Dict[str, Any]]:
+        where, args = self._where(days, source)
+        rows = self._query(
+            f"SELECT names.value, sum(count) FROM daily_unmatched JOIN names ON names.id = daily_unmatched.transcript "
+            f"WHERE {where} GROUP BY daily_unmatched.transcript ORDER BY 2 DESC LIMIT ?", args + [limit])
+        return [{"transcript": transcript, "count": count} for transcript, count in rows]
+
+    def stages(self, days: int = REPORT_DAYS, source: Optional[str] = None) -> Dict[str, Any]:
+        """Average time per stage"""
+        where, args = self._where(days, source)
+        count, total, recognize, recognized, match, action, actions = self._query(
+            f"SELECT sum(count), sum(total_us), sum(recognize_us), sum(recognize_count), sum(match_us), "
+            f"sum(action_us), sum(action_count) FROM daily WHERE {where}", args)[0]
+        average = lambda value, n: ms(value / n, 3) if n else None
+        return {"count": count or 0, "recognize_ms": average(recognize, recognized), "match_ms": average(match, count),
+                "action_ms": average(action, actions), "total_ms": average(total, count)}
+
+    def recent(self, limit: int = REPORT_LIMIT) -> List[Dict[str, Any]]:
+        rows = self._query(
+            "SELECT e.ts, t.value, c.value, a.value, s.value, e.outcome, e.recognize_us, e.match_us, e.action_us, "
+            "e.total_us FROM (SELECT * FROM events ORDER BY id DESC LIMIT ?) e "
+            "LEFT JOIN names t ON t.id = e.transcript LEFT JOIN names c ON c.id = e.command "
+            "LEFT JOIN names a ON a.id = e.action LEFT JOIN names s ON s.id = e.source ORDER BY e.id DESC", [limit])
+        return [{"ts": ts, "transcript": transcript, "command": command, "action": action, "source": source,
+                 "outcome": OUTCOMES[outcome], "recognize_ms": ms(recognize_us), "match_ms": ms(match_us, 3),
+                 "action_ms": ms(action_us), "total_ms": ms(total_us)}
+                for ts, transcript, command, action, source, outcome, recognize_us, match_us, action_us, total_us in rows]
+
+    def summary(self, days: int = REPORT_DAYS, limit: int = REPORT_LIMIT, source: Optional[str] = None) -> Dict[str, Any]:
+        return {"top_commands": self.top_commands(days, limit, source),
+                "failures": self.failure_rates(days, source),
+                "slowest_actions": self.slowest_actions(days, limit, source),
+                "unmatched": self.unmatched(days, limit, source),
+                "stages": self.stages(days, source)}
+
+class HistoryRecorder:
+    """Queues records from the assistant and writes them in batches from a background thread"""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.pending = deque(maxlen=MAX_PENDING)
+        self.store: Optional[HistoryStore] = None
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+        self.compacted_at = 0.0
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, daemon=True, name="history")
+            self.thread.start()
+
+    def record(self, outcome: str, **fields) -> Dict[str, Any]:
+        """Queue a record; fields: transcript, command, action, session, source, backend and stage
+        times in seconds (recognize_time, match_time, action_time, total_time), and ts if the
+        utterance is recorded after the fact (e.g. once a background action finishes).
+        """
+        record = dict(fields, outcome=outcome, ts=fields.get("ts") or time.time())
+        self.pending.append(record)
+        return record
+
+    def _run(self):
+        while not self.stopping.is_set():
+            self.wakeup.wait(FLUSH_INTERVAL)
+            self.wakeup.clear()
+            self.flush()
+            if time.time() - self.compacted_at >= COMPACT_INTERVAL:
+                self.compacted_at = time.time()
+                try:
+                    self._store().compact()
+                except sqlite3.Error as e:
+                    print(f"Ошибка сжатия истории команд: {e}")
+                    sys.stdout.flush()
+        self.flush()
+
+    def _store(self) -> HistoryStore:
+        if self.store is None:
+            self.store = HistoryStore(self.path)
+        return self.store
+
+    def flush(self):
+        batch = []
+        while self.pending:
+            batch.append(self.pending.popleft())
+        if not batch:
+            return
+        try:
+            self._store().append(batch)
+        except sqlite3.Error as e:
+            print(f"Ошибка записи истории команд: {e}")
+            sys.stdout.flush()
+            # Keep them for the next attempt; the deque drops the oldest if it stays down
+            self.pending.extendleft(reversed(batch))
+
+    def stop(self):
+        self.stopping.set()
+        self.wakeup.set()
+        if self.thread:
+            self.thread.join(timeout=5)
+            self.thread = None
+        if self.store:
+            self.store.close()
+            self.store = None
+
+REPORTS = ("summary", "top", "failures", "slowest", "unmatched", "stages", "recent", "compact")
+
+def print_report(store: HistoryStore, report: str, days: int, limit: int, source: Optional[str]):
+    if report in ("summary", "top"):
+        print(f"🏆 Частые команды за {days} дн.:")
+        for row in store.top_commands(days, limit, source):
+            print(f"  {row['count']:>7}  {row['command']}  (в среднем {row['avg_total_ms']} мс)")
+    if report in ("summary", "failures"):
+        failures = store.failure_rates(days, source)
+        print(f"❌ Неудачи: {failures['failure_percent']}% из {failures['total']}")
+        for outcome, row in failures["outcomes"].items():
+            print(f"  {row['count']:>7}  {row['percent']:5.1f}%  {outcome}")
+        for row in failures["commands"][:limit]:
+            print(f"  ошибки {row['error_percent']:5.1f}% ({row['errors']} из {row['count']})  {row['command']}")
+    if report in ("summary", "slowest"):
+        print("🐢 Самые медленные действия:")
+        for row in store.slowest_actions(days, limit, source):
+            print(f"  {row['avg_ms']:>9} мс в среднем, до {row['max_ms']} мс, {row['count']} раз  {row['action']}")
+    if report in ("summary", "unmatched"):
+        print("❓ Частые нераспознанные фразы:")
+        for row in store.unmatched(days, limit, source):
+            print(f"  {row['count']:>7}  {row['transcript']}")
+    if report in ("summary", "stages"):
+        stages = store.stages(days, source)
+        print(f"⏱️ Этапы ({stages['count']} записей): распознавание {stages['recognize_ms']} мс, "
+              f"сопоставление {stages['match_ms']} мс, действие {stages['action_ms']} мс, всего {stages['total_ms']} мс")
+    if report == "recent":
+        for row in store.recent(limit):
+            stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(row["ts"]))
+            total = "-" if row["total_ms"] is None else row["total_ms"]
+            print(f"{stamp}  {row['outcome']:<17} {total:>9} мс  {row['transcript'] or ''}"
+                  + (f" → {row['command']}" if row["command"] else ""))
+    if report == "compact":
+        deleted = store.compact()
+        print(f"🧹 Удалено записей: {deleted['events']}, дневных сводок: {deleted['daily']}, фраз: {deleted['names']}")
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="История и статистика команд ассистента")
+    parser.add_argument("report", nargs="?", default="summary", choices=REPORTS)
+    parser.add_argument("--days", type=int, default=REPORT_DAYS, help="за сколько последних дней")
+    parser.add_argument("--limit", type=int, default=REPORT_LIMIT, help="сколько строк в каждом списке")
+    parser.add_argument("--source", help="только voice, text, http или rpc")
+    parser.add_argument("--db", help="файл истории (по умолчанию $ASSISTANT_HISTORY_DB или history.db)")
+    args = parser.parse_args(argv)
+    store = HistoryStore(args.db)
+    try:
+        print_report(store, args.report, args.days, args.limit, args.source)
+    finally:
+        store.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,440 @@
+#!/usr/bin/env python3
+"""
+Local HTTP/WebSocket server for the voice assistant (asyncio, standard library only).
+
+HTTP/1.1 with keep-alive, bound to 127.0.0.1 by default:
+
+    GET  /status                   assistant status
+    POST /execute                  {"text": "...", "session": "..."} or a text/plain body
+    POST /recognize?session=NAME   WAV/AIFF/FLAC body: recognize, then execute
+    POST /rpc/<method>             JSON params for any control method
+    GET  /events                   WebSocket: assistant events; messages
+                                   {"id": 1, "method": "...", "params": {...}} are answered
+                                   with {"id": 1, "result": ...}
+
+Every request must carry "Authorization: Bearer <token>". The token is
+$ASSISTANT_HTTP_TOKEN or, when that is unset, read from a file readable only
+by the user (generated on first start, see token_path()). Requests with an
+Origin header are refused unless the origin is listed in
+$ASSISTANT_HTTP_ORIGINS (comma-separated), and the Host header must name the
+loopback address, so web pages cannot drive the assistant even through DNS
+rebinding.
+"""
+
+import asyncio
+import base64
+import functools
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import struct
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, NamedTuple, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+MAX_CONNECTIONS = 64
+MAX_CONCURRENT = 8        # requests executed at once
+MAX_QUEUED = 64           # requests waiting for a slot before 429
+KEEPALIVE_TIMEOUT = 15.0
+MAX_HEADER = 16 * 1024
+MAX_BODY = 10 * 1024 * 1024
+EVENT_QUEUE_SIZE = 1000
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+EXCLUDED_METHODS = {"handoff", "activate"}  # process lifecycle stays on the control socket
+LOCAL_HOSTS = {"localhost", "127.0.0.1"}
+
+STATUS_TEXT = {
+    101: "Switching Protocols", 200: "OK", 400: "Bad Request", 401: "Unauthorized", 403: "Forbidden",
+    404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large", 429: "Too Many Requests",
+    431: "Request Header Fields Too Large", 500: "Internal Server Error", 501: "Not Implemented",
+    503: "Service Unavailable",
+}
+
+def parse_address(address: str) -> Tuple[str, int]:
+    """"8765", ":8765" or "host:8765" -> (host, port)"""
+    host, _, port = address.rpartition(":")
+    return host or DEFAULT_HOST, int(port)
+
+def token_path() -> str:
+    config_home = os.environ.get("XDG_CONFIG_HOME") or os.path.expanduser("~/.config")
+    return os.environ.get("ASSISTANT_HTTP_TOKEN_FILE") or os.path.join(config_home, "loner_assistant", "http_token")
+
+def load_token(path: Optional[str] = None) -> str:
+    """$ASSISTANT_HTTP_TOKEN, or the token file, created with mode 0600 on first use"""
+    token = os.environ.get("ASSISTANT_HTTP_TOKEN")
+    if token:
+        return token
+    path = path or token_path()
+    try:
+        with open(path, encoding="utf-8") as f:
+            token = f.read().strip()
+        if token:
+            return token
+    except FileNotFoundError:
+        pass
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+    token = secrets.token_urlsafe(32)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(token + "\n")
+    return token
+
+def host_name(header: str) -> str:
+    """Host header without the port ("localhost:8765" -> "localhost", "[::1]:8765" -> "::1")"""
+    if header.startswith("["):
+        return header[1:].partition("]")[0]
+    return header.rpartition(":")[0] if header.count(":") == 1 else header
+
+class HttpError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+class Request(NamedTuple):
+    method: str
+    path: str
+    query: Dict[str, str]
+    headers: Dict[str, str]
+    body: bytes
+
+    @property
+    def keep_alive(self) -> bool:
+        return self.headers.get("connection", "").lower() != "close"
+
+class HttpServer:
+    """asyncio server in its own thread; handlers run in a bounded thread pool"""
+
+    def __init__(self, methods: Dict[str, Callable[..., Any]],
+                 audio_handler: Optional[Callable[[bytes, Optional[str]], Any]] = None,
+                 host: str = DEFAULT_HOST, port: int = DEFAULT_PORT):
+        self.methods = methods
+        self.audio_handler = audio_handler
+        self.host = host
+        self.port = port
+        self.token = load_token()
+        # A host given explicitly on the command line is accepted as well
+        self.hosts = LOCAL_HOSTS | {host}
+        self.origins = {origin.strip() for origin in os.environ.get("ASSISTANT_HTTP_ORIGINS", "").split(",") if origin.strip()}
+        self.executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT, thread_name_prefix="http")
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.server = None
+        self.thread: Optional[threading.Thread] = None
+        self.connections = 0
+        self.pending = 0
+        self.semaphore: Optional[asyncio.Semaphore] = None
+        self.subscribers = set()
+        self.tasks = set()
+
+    def start(self) -> bool:
+        """Bind and serve in a background thread; False if the port is taken"""
+        started = threading.Event()
+        error = []
+
+        def run():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            self.loop = loop
+            self.semaphore = asyncio.Semaphore(MAX_CONCURRENT)
+            try:
+                self.server = loop.run_until_complete(
+                    asyncio.start_server(self._connection, self.host, self.port, limit=MAX_HEADER))
+            except OSError as e:
+                error.append(e)
+                started.set()
+                loop.close()
+                return
+            started.set()
+            loop.run_forever()
+            loop.close()
+
+        self.thread = threading.Thread(target=run, daemon=True, name="http-server")
+        self.thread.start()
+        started.wait()
+        if error:
+            print(f"⚠️ HTTP-сервер {self.host}:{self.port} не запущен: {error[0]}")
+            sys.stdout.flush()
+            return False
+        return True
+
+    def stop(self):
+        if not self.loop or not self.loop.is_running():
+            return
+
+        async def shutdown():
+            self.server.close()
+            self._fan_out(None)  # tells WebSocket clients to close
+            await asyncio.sleep(0)
+            # Idle keep-alive connections would otherwise outlive the loop
+            for task in list(self.tasks):
+                task.cancel()
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+            await self.server.wait_closed()
+
+        future = asyncio.run_coroutine_threadsafe(shutdown(), self.loop)
+        try:
+            future.result(timeout=2)
+        except Exception:
+            pass
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout=2)
+
+    def publish(self, event_type: str, **data):
+        """Push an event to WebSocket subscribers (thread-safe)"""
+        if not self.subscribers or not self.loop:
+            return
+        event = {"type": event_type, **data}
+        self.loop.call_soon_threadsafe(self._fan_out, event)
+
+    def queue_depths(self) -> Dict[str, int]:
+        subscribers = list(self.subscribers)
+        return {"connections": self.connections, "pending": self.pending, "subscribers": len(subscribers),
+                "queued_events": sum(queue.qsize() for queue in subscribers)}
+
+    def _fan_out(self, event: Optional[Dict[str, Any]]):
+        for queue in self.subscribers:
+            # Slow subscribers lose the oldest events instead of growing without bound
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(event)
+
+    async def _connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        if self.connections >= MAX_CONNECTIONS:
+            await self._respond(writer, 503, {"error": "слишком много соединений"}, keep_alive=False)
+            writer.close()
+            return
+        self.connections += 1
+        task = asyncio.current_task()
+        self.tasks.add(task)
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(self._read_request(reader), KEEPALIVE_TIMEOUT)
+                except HttpError as e:
+                    await self._respond(writer, e.status, {"error": str(e)}, keep_alive=False)
+                    break
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    break
+                if request is None:
+                    break
+                if request.path == "/events" and request.headers.get("upgrade", "").lower() == "websocket":
+                    await self._websocket(request, reader, writer)
+                    break
+                status, payload = await self._route(request)
+                await self._respond(writer, status, payload, request.keep_alive)
+                if not request.keep_alive:
+                    break
+        except (ConnectionError, asyncio.CancelledError):
+            pass  # cancelled: the server is stopping
+        finally:
+            self.connections -= 1
+            self.tasks.discard(task)
+            writer.close()
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> Optional[Request]:
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.LimitOverrunError:
+            raise HttpError(431, "слишком большие заголовки")
+        except asyncio.IncompleteReadError as e:
+            if not e.partial.strip():
+                return None
+            raise
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, _version = lines[0].split(" ", 2)
+        except ValueError:
+            raise HttpError(400, "неверная строка запроса")
+        headers = {}
+        for line in lines[1:]:
+            if line:
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+        if "chunked" in headers.get("transfer-encoding", "").lower():
+            raise HttpError(501, "chunked не поддерживается, укажите Content-Length")
+        try:
+            length = int(headers.get("content-length") or 0)
+        except ValueError:
+            raise HttpError(400, "неверный Content-Length")
+        if length > MAX_BODY:
+            raise HttpError(413, "слишком большое тело запроса")
+        body = await reader.readexactly(length) if length else b""
+        url = urlsplit(target)
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        return Request(method.upper(), url.path, query, headers, body)
+
+    def _check_access(self, request: Request):
+        origin = request.headers.get("origin")
+        if origin and origin not in self.origins:
+            raise HttpError(403, f"источник {origin} не разрешён")
+        if host_name(request.headers.get("host", "")).lower() not in self.hosts:
+            raise HttpError(403, "неверный заголовок Host")
+        if not hmac.compare_digest(request.headers.get("authorization", "").encode("utf-8"),
+                                   f"Bearer {self.token}".encode("utf-8")):
+            raise HttpError(401, "нужен токен доступа")
+
+    async def _route(self, request: Request) -> Tuple[int, Dict[str, Any]]:
+        try:
+            self._check_access(request)
+            if request.path == "/status":
+                return 200, {"result": await self._call(self.methods["status"])}
+            if request.method != "POST":
+                raise HttpError(405 if request.path in ("/execute", "/recognize") or request.path.startswith("/rpc/")
+                                else 404, "неизвестный адрес или метод")
+            if request.path == "/execute":
+                params = self._params(request, text_field="text")
+                return 200, {"result": await self._call(self.methods["execute_text"], **params)}
+            if request.path == "/recognize":
+                if self.audio_handler is None:
+                    raise HttpError(501, "распознавание аудио недоступно")
+                return 200, {"result": await self._call(self.audio_handler, request.body, request.query.get("session"))}
+            if request.path.startswith("/rpc/"):
+                name = request.path[len("/rpc/"):]
+                if name not in self.methods or name in EXCLUDED_METHODS:
+                    raise HttpError(404, f"неизвестный метод {name}")
+                return 200, {"result": await self._call(self.methods[name], **self._params(request))}
+            raise HttpError(404, "неизвестный адрес")
+        except HttpError as e:
+            return e.status, {"error": str(e)}
+        except (ValueError, TypeError) as e:
+            return 400, {"error": str(e)}
+        except Exception as e:
+            return 500, {"error": str(e)}
+
+    @staticmethod
+    def _params(request: Request, text_field: Optional[str] = None) -> Dict[str, Any]:
+        if not request.body:
+            return {}
+        if text_field and request.headers.get("content-type", "").startswith("text/plain"):
+            return {text_field: request.body.decode("utf-8")}
+        params = json.loads(request.body.decode("utf-8"))
+        if not isinstance(params, dict):
+            raise ValueError("ожидается JSON-объект")
+        return params
+
+    async def _call(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """Run a handler in the pool, at most MAX_CONCURRENT at once and MAX_QUEUED waiting"""
+        if self.pending >= MAX_CONCURRENT + MAX_QUEUED:
+            raise HttpError(429, "слишком много запросов")
+        self.pending += 1
+        try:
+            async with self.semaphore:
+                return await self.loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+        finally:
+            self.pending -= 1
+
+    async def _respond(self, writer: asyncio.StreamWriter, status: int, payload: Dict[str, Any], keep_alive: bool):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        head = (f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+                f"Content-Type: application/json; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                + (f"Connection: keep-alive\r\nKeep-Alive: timeout={KEEPALIVE_TIMEOUT:g}\r\n" if keep_alive
+                   else "Connection: close\r\n")
+                + "\r\n")
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
+
+    async def _websocket(self, request: Request, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            self._check_access(request)
+        except HttpError as e:
+            await self._respond(writer, e.status, {"error": str(e)}, keep_alive=False)
+            return
+        key = request.headers.get("sec-websocket-key", "")
+        accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode("ascii")).digest()).decode("ascii")
+        writer.write(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                      f"Sec-WebSocket-Accept: {accept}\r\n\r\n").encode("latin-1"))
+        await writer.drain()
+
+        queue: asyncio.Queue = asyncio.Queue(maxsize=EVENT_QUEUE_SIZE)
+        self.subscribers.add(queue)
+        sender = asyncio.ensure_future(self._ws_send_events(queue, writer))
+        try:
+            while True:
+                opcode, payload = await self._ws_read_frame(reader)
+                if opcode == 0x8:
+                    self._ws_write(writer, 0x8, payload[:2])
+                    break
+                if opcode == 0x9:
+                    self._ws_write(writer, 0xA, payload)
+                elif opcode == 0x1:
+                    asyncio.ensure_future(self._ws_call(payload, writer))
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            self.subscribers.discard(queue)
+            sender.cancel()
+
+    async def _ws_send_events(self, queue: asyncio.Queue, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                event = await queue.get()
+                if event is None:
+                    self._ws_write(writer, 0x8, struct.pack("!H", 1001))
+                    writer.close()
+                    return
+                self._ws_write(writer, 0x1, json.dumps(event, ensure_ascii=False).encode("utf-8"))
+                await writer.drain()
+        except ConnectionError:
+            pass
+
+    async def _ws_call(self, payload: bytes, writer: asyncio.StreamWriter):
+        message_id = None
+        try:
+            message = json.loads(payload.decode("utf-8"))
+            message_id = message.get("id")
+            name = message.get("method")
+            if name not in self.methods or name in EXCLUDED_METHODS:
+                raise ValueError(f"неизвестный метод {name}")
+            result = {"id": message_id, "result": await self._call(self.methods[name], **(message.get("params") or {}))}
+        except Exception as e:
+            result = {"id": message_id, "error": str(e)}
+        try:
+            self._ws_write(writer, 0x1, json.dumps(result, ensure_ascii=False).encode("utf-8"))
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+    @staticmethod
+    async def _ws_read_frame(reader: asyncio.StreamReader) -> Tuple[int, bytes]:
+        """One complete message (continuation frames are joined); client frames are masked"""
+        message = b""
+        first_opcode = None
+        while True:
+            head = await reader.readexactly(2)
+            fin, opcode = head[0] & 0x80, head[0] & 0x0F
+            masked, length = head[1] & 0x80, head[1] & 0x7F
+            if length == 126:
+                length = struct.unpack("!H", await reader.readexactly(2))[0]
+            elif length == 127:
+                length = struct.unpack("!Q", await reader.readexactly(8))[0]
+            if length > MAX_BODY:
+                raise ValueError("слишком большое сообщение")
+            mask = await reader.readexactly(4) if masked else None
+            payload = await reader.readexactly(length)
+            if mask:
+                key = int.from_bytes((mask * (length // 4 + 1))[:length], "big")
+                payload = (int.from_bytes(payload, "big") ^ key).to_bytes(length, "big")
+            if opcode >= 0x8:
+                return opcode, payload  # control frames may arrive between fragments
+            if first_opcode is None:
+                first_opcode = opcode
+            message += payload
+            if fin:
+                return first_opcode, message
+
+    @staticmethod
+    def _ws_write(writer: asyncio.StreamWriter, opcode: int, payload: bytes):
+        length = len(payload)
+        if length < 126:
+            head = struct.pack("!BB", 0x80 | opcode, length)
+        elif length < 65536:
+            head = struct.pack("!BBH", 0x80 | opcode, 126, length)
+        else:
+            head = struct.pack("!BBQ", 0x80 | opcode, 127, length)
+        writer.write(head + payload)
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+Managed subprocess runner for system commands: bounded concurrency, output
+streaming, per-job timeouts and cancellation by process group.
+"""
+
+import itertools
+import os
+import re
+import shlex
+import signal
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Union
+
+JOB_WORKERS = 4
+JOB_TIMEOUT = float(os.environ.get("ASSISTANT_JOB_TIMEOUT", "120"))
+KILL_GRACE = 3
+FINISHED_KEEP = 50
+
+# Programs that power the machine off or destroy data run only with ASSISTANT_ALLOW_DESTRUCTIVE=1.
+# A shell string is checked command by command, through wrappers and "sh -c"; one that cannot be
+# read (command substitution, a program named by a variable, a script piped into a shell) counts
+# as destructive.
+DESTRUCTIVE_PROGRAMS = {"shutdown", "reboot", "halt", "poweroff", "rm", "dd", "mkfs", "diskutil", "sudo"}
+
+# Wrappers that run the rest of their words as a command: options that take a value, and how many
+# positional arguments come before the command
+COMMAND_WRAPPERS = {
+    "env": ({"-u", "--unset", "-C", "--chdir"}, 0),
+    "nice": ({"-n", "--adjustment"}, 0),
+    "nohup": (set(), 0),
+    "exec": ({"-a"}, 0),
+    "time": ({"-f", "--format", "-o", "--output"}, 0),
+    "command": (set(), 0),
+    "builtin": (set(), 0),
+    "setsid": (set(), 0),
+    "caffeinate": ({"-t", "-w"}, 0),
+    "stdbuf": ({"-i", "-o", "-e"}, 0),
+    "ionice": ({"-c", "--class", "-n", "--classdata"}, 0),
+    "timeout": ({"-s", "--signal", "-k", "--kill-after"}, 1),
+    "xargs": ({"-a", "-d", "-E", "-I", "-L", "-n", "-P", "-s"}, 0),
+}
+SHELLS = {"sh", "bash", "dash", "zsh", "ksh"}
+SHELL_KEYWORDS = {"!", "{", "}", "if", "then", "else", "elif", "do", "while", "until"}
+ASSIGNMENT = re.compile(r"[A-Za-z_][A-Za-z0-9_]*=")
+
+def destructive_allowed() -> bool:
+    return os.environ.get("ASSISTANT_ALLOW_DESTRUCTIVE", "") not in ("", "0")
+
+def split_commands(command: str) -> List[List[str]]:
+    """Words of each simple command in a shell string, split on ; && || | & and parentheses,
+    without redirections; ValueError if the string cannot be read without running it
+    """
+    if "`" in command or "$(" in command:
+        raise ValueError("command substitution")
+    lexer = shlex.shlex(command.replace("\n", ";"), posix=True, punctuation_chars=True)
+    lexer.whitespace_split = True
+    commands: List[List[str]] = [[]]
+    redirect = False
+    for token in lexer:
+        if redirect:
+            redirect = False
+        elif token and all(char in lexer.punctuation_chars for char in token):
+            if "<" in token or ">" in token:
+                redirect = True
+            elif commands[-1]:
+                commands.append([])
+        else:
+            commands[-1].append(token)
+    return [words for words in commands if words]
+
+def programs_of(command: Union[str, List[str]]) -> List[str]:
+    """Names of every program a command starts; ValueError if that cannot be told"""
+    programs = []
+    for words in split_commands(command) if isinstance(command, str) else [list(command)]:
+        index = 0
+        while index < len(words):
+            word = words[index]
+            if word in SHELL_KEYWORDS or ASSIGNMENT.match(word):
+                index += 1
+                continue
+            if word.startswith("$"):
+                raise ValueError(f"program named by a variable: {word}")
+            program = os.path.basename(word)
+            programs.append(program)
+            if program == "eval":
+                programs.extend(programs_of(" ".join(words[index + 1:])))
+            elif program in SHELLS:
+                scripts = [words[position + 1] for position in range(index + 1, len(words) - 1)
+                           if words[position][:1] == "-" and words[position][1:2] != "-" and "c" in words[position]]
+                if not scripts:
+                    raise ValueError(f"{program} runs a script that cannot be checked")
+                programs.extend(programs_of(scripts[0]))
+            elif program in COMMAND_WRAPPERS:
+                with_value, positional = COMMAND_WRAPPERS[program]
+                index += 1
+                while index < len(words) and (words[index].startswith("-") or ASSIGNMENT.match(words[index])):
+                    index += 2 if words[index] in with_value else 1
+                index += positional
+                continue
+            break
+    return programs
+
+def is_destructive(command: Union[str, List[str]]) -> bool:
+    try:
+        return any(program in DESTRUCTIVE_PROGRAMS for program in programs_of(command))
+    except ValueError:
+        return True
+
+class Job:
+    """One system command and its state: queued, running, done, failed, timeout or cancelled"""
+
+    def __init__(self, job_id: int, command: Union[str, List[str]], timeout: float):
+        self.id = job_id
+        self.command = command
+        self.timeout = timeout
+        self.status = "queued"
+        self.returncode = None
+        self.process: Optional[subprocess.Popen] = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.cancel_requested = False
+        self.done = threading.Event()
+
+    @property
+    def title(self) -> str:
+        return self.command if isinstance(self.command, str) else " ".join(self.command)
+
+    def to_dict(self) -> Dict[str, object]:
+        return {
+            "id": self.id,
+            "command": self.title,
+            "status": self.status,
+            "returncode": self.returncode,
+            "pid": self.process.pid if self.process else None,
+            "started": self.started,
+            "runtime": round((self.finished or time.time()) - self.started, 1) if self.started else None,
+        }
+
+class JobRunner:
+    """Runs commands in a bounded pool; callbacks receive output lines and finished jobs"""
+
+    def __init__(self, on_output: Optional[Callable[[Job, str], None]] = None,
+                 on_finished: Optional[Callable[[Job], None]] = None,
+                 workers: int = JOB_WORKERS, timeout: float = JOB_TIMEOUT):
+        self.on_output = on_output or (lambda job, line: print(f"[{job.id}] {line}", flush=True))
+        self.on_finished = on_finished or (lambda job: None)
+        self.timeout = timeout
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self.jobs: Dict[int, Job] = {}
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+
+    def submit(self, command: Union[str, List[str]], timeout: Optional[float] = None) -> Job:
+        """Queue a command; a string runs through the shell, a list runs as argv"""
+        with self.lock:
+            job = Job(next(self.ids), command, timeout or self.timeout)
+            self.jobs[job.id] = job
+            self._forget_finished()
+        self.pool.submit(self._run, job)
+        return job
+
+    def _forget_finished(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.done.is_set()]
+        for job_id in finished[:-FINISHED_KEEP] if len(finished) > FINISHED_KEEP else []:
+            del self.jobs[job_id]
+
+    def _run(self, job: Job):
+        if job.cancel_requested:
+            self._finish(job, "cancelled")
+            return
+        try:
+            job.process = subprocess.Popen(
+                job.command,
+                shell=isinstance(job.command, str),
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                text=True,
+                errors="replace",
+                bufsize=1,
+                start_new_session=True
+            )
+        except OSError as e:
+            self.on_output(job, f"Не удалось запустить: {e}")
+            self._finish(job, "failed")
+            return
+        job.started = time.time()
+        job.status = "running"
+        if job.cancel_requested:
+            job.status = "cancelled"
+            self._kill(job)
+
+        watchdog = threading.Timer(job.timeout, self._expire, args=(job,))
+        watchdog.daemon = True
+        watchdog.start()
+        try:
+            for line in iter(job.process.stdout.readline, ''):
+                line = line.rstrip()
+                if line:
+                    self.on_output(job, line)
+        except (OSError, ValueError):
+            pass
+        job.returncode = job.process.wait()
+        watchdog.cancel()
+        if job.status == "running":
+            self._finish(job, "done" if job.returncode == 0 else "failed")
+        else:
+            self._finish(job, job.status)
+
+    def _finish(self, job: Job, status: str):
+        job.status = status
+        job.finished = time.time()
+        job.done.set()
+        self.on_finished(job)
+
+    def _expire(self, job: Job):
+        if job.status == "running":
+            job.status = "timeout"
+            self.on_output(job, f"⏱️ Превышено время выполнения ({job.timeout:g} с), останавливаю")
+            self._kill(job)
+
+    def _kill(self, job: Job):
+        """SIGTERM the job's process group, SIGKILL it if it is still alive after a grace period"""
+        process = job.process
+        if process is None or process.poll() is not None:
+            return
+        try:
+            if hasattr(os, "killpg"):
+                os.killpg(process.pid, signal.SIGTERM)
+            else:
+                process.terminate()
+            try:
+                process.wait(timeout=KILL_GRACE)
+            except subprocess.TimeoutExpired:
+                if hasattr(os, "killpg"):
+                    os.killpg(process.pid, signal.SIGKILL)
+                else:
+                    process.kill()
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    def running(self) -> List[Job]:
+        with self.lock:
+            return [job for job in self.jobs.values() if job.status in ("queued", "running")]
+
+    def list_jobs(self) -> List[Dict[str, object]]:
+        with self.lock:
+            return [job.to_dict() for job in self.jobs.values()]
+
+    def cancel(self, job_id: Optional[int] = None) -> List[Job]:
+        """Cancel one job, or every queued and running job when job_id is None"""
+        with self.lock:
+            if job_id is None:
+                targets = [job for job in self.jobs.values() if job.status in ("queued", "running")]
+            else:
+                job = self.jobs.get(job_id)
+                targets = [job] if job and job.status in ("queued", "running") else []
+        for job in targets:
+            job.cancel_requested = True
+            if job.status == "running":
+                job.status = "cancelled"
+                self._kill(job)
+        return targets
+
+    def shutdown(self):
+        """Cancel everything and stop accepting jobs"""
+        self.cancel()
+        self.pool.shutdown(wait=False)
@@ -3,31 +3,30 @@
 Utility for managing voice assistant commands
 """
 
+import csv
 import json
 import os
 import sys
-from typing import Dict, Any
-
-def load_commands(filename: str = 'commands.json') -> Dict[str, Any]:
-    """Load commands from JSON file"""
-    try:
-        with open(filename, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        print(f"Файл {filename} не найден.")
-        return {}
-    except json.JSONDecodeError as e:
-        print(f"Ошибка чтения JSON файла: {e}")
-        return {}
-
-def save_commands(commands: Dict[str, Any], filename: str = 'commands.json'):
-    """Save commands to JSON file"""
-    try:
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(commands, f, ensure_ascii=False, indent=2)
-        print(f"✅ Команды сохранены в {filename}")
-    except Exception as e:
-        print(f"❌ Ошибка сохранения: {e}")
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import action_registry
+import command_matcher
+import command_store
+
+DIFF_PREVIEW = 20
+ERROR_PREVIEW = 20
+
+CONFLICT_LABELS = {
+    "duplicate": "Дубликат (никогда не сработает)",
+    "shadowed": "Перекрыта более ранней фразой (никогда не сработает)",
+    "ambiguous": "Содержит фразу из другой категории",
+    "empty": "Пустая фраза",
+}
+
+def load_commands() -> Dict[str, Any]:
+    """Load commands from the shared command store"""
+    return command_store.load_commands()
 
 def list_commands(commands: Dict[str, Any]):
     """List all commands"""
@@ -51,41 +50,170 @@ def list_commands(commands: Dict[str, Any]):
     
     print(f"\n📊 Всего команд: {total_commands}")
 
-def add_command(commands: Dict[str, Any], category: str, command: str, action: str, params: list, description: str):
+def add_command(store: command_store.CommandStore, category: str, command: str, action: str, params: list, description: str):
     """Add new command"""
-    if category not in commands:
-        commands[category] = {}
-    
-    commands[category][command] = {
-        "action": action,
-        "params": params,
-        "description": description
-    }
+    store.upsert(category, command, action, params, description)
     print(f"✅ Команда '{command}' добавлена в категорию '{category}'")
 
-def remove_command(commands: Dict[str, Any], command: str):
+def remove_command(store: command_store.CommandStore, command: str):
     """Remove command"""
-    for category in commands:
-        if command in commands[category]:
-            del commands[category][command]
-            print(f"✅ Команда '{command}' удалена из категории '{category}'")
-            return
+    for category in store.find_phrase(command):
+        store.delete(category, command)
+        print(f"✅ Команда '{command}' удалена из категории '{category}'")
+        return
     print(f"❌ Команда '{command}' не найдена")
 
-def search_command(commands: Dict[str, Any], query: str):
-    """Search commands by query"""
-    found = False
-    for category, category_commands in commands.items():
-        for cmd, data in category_commands.items():
-            if query.lower() in cmd.lower() or query.lower() in data.get('description', '').lower():
-                if not found:
-                    print(f"\n🔍 Результаты поиска для '{query}':")
-                    found = True
-                print(f"  📂 {category}: {cmd}")
-                print(f"     {data.get('description', 'Без описания')}")
-    
-    if not found:
+def search_command(store: command_store.CommandStore, query: str, limit: int = command_store.SEARCH_LIMIT):
+    """Search commands by query using the store's ranked index"""
+    results = store.search(query, limit)
+    if not results:
         print(f"🔍 Команды с '{query}' не найдены")
+        return
+    print(f"\n🔍 Результаты поиска для '{query}':")
+    for category, cmd, data in results:
+        print(f"  📂 {category}: {cmd}")
+        print(f"     {data.get('description') or 'Без описания'}")
+
+def file_format(path: str, fmt: Optional[str] = None) -> str:
+    fmt = (fmt or os.path.splitext(path)[1].lstrip('.')).lower()
+    if fmt == 'ndjson':
+        fmt = 'jsonl'
+    if fmt not in ('csv', 'jsonl'):
+        raise ValueError(f"Неизвестный формат '{fmt}', используйте csv или jsonl")
+    return fmt
+
+def export_file(store: command_store.CommandStore, path: str, fmt: Optional[str] = None) -> int:
+    """Stream all commands to a CSV or JSONL file"""
+    fmt = file_format(path, fmt)
+    count = 0
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8', newline='') as f:
+        if fmt == 'csv':
+            writer = csv.writer(f)
+            writer.writerow(command_store.ROW_FIELDS)
+        for category, phrase, action, params, description in store.iter_rows():
+            if fmt == 'csv':
+                writer.writerow([category, phrase, action, json.dumps(params, ensure_ascii=False), description])
+            else:
+                f.write(json.dumps({"category": category, "phrase": phrase, "action": action,
+                                    "params": params, "description": description}, ensure_ascii=False) + "\n")
+            count += 1
+    os.replace(tmp_path, path)
+    return count
+
+def read_records(path: str, fmt: str) -> Iterator[Tuple[int, Any]]:
+    """(line number, record) pairs; records are dicts, or an error string for unparsable lines"""
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        if fmt == 'csv':
+            reader = csv.DictReader(f)
+            missing = {"category", "phrase", "action"} - set(reader.fieldnames or [])
+            if missing:
+                raise ValueError(f"В CSV нет столбцов: {', '.join(sorted(missing))}")
+            for record in reader:
+                yield reader.line_num, record
+        else:
+            for line_num, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    yield line_num, json.loads(line)
+                except json.JSONDecodeError as e:
+                    yield line_num, f"некорректный JSON: {e}"
+
+def validate_record(record: Any, registry: action_registry.ActionRegistry) -> Tuple[Optional[tuple], Optional[str]]:
+    """Turn a record into a store row, or return an error message"""
+    if isinstance(record, str):
+        return None, record
+    if not isinstance(record, dict):
+        return None, "ожидается объект"
+    category = str(record.get("category") or "").strip()
+    phrase = str(record.get("phrase") or "").strip()
+    action = str(record.get("action") or "").strip()
+    description = str(record.get("description") or "")
+    if not category or not phrase or not action:
+        return None, "пустые category, phrase или action"
+    params = record.get("params") or []
+    if isinstance(params, str):
+        try:
+            params = json.loads(params) if params.strip() else []
+        except json.JSONDecodeError:
+            return None, f"params не является JSON: {params!r}"
+    error = registry.validate(action, params)
+    if error:
+        return None, error
+    return (category, phrase, action, params, description), None
+
+def import_file(store: command_store.CommandStore, path: str, fmt: Optional[str] = None,
+                dry_run: bool = False, replace: bool = False) -> bool:
+    """Validate a CSV/JSONL file, show the diff against the store and apply it in one transaction"""
+    registry = action_registry.default_registry()
+    started = time.perf_counter()
+    fmt = file_format(path, fmt)
+    rows: Dict[Tuple[str, str], tuple] = {}
+    errors: List[str] = []
+    for line_num, record in read_records(path, fmt):
+        row, error = validate_record(record, registry)
+        if error:
+            errors.append(f"строка {line_num}: {error}")
+        elif row[:2] in rows:
+            errors.append(f"строка {line_num}: повтор команды '{row[1]}' в категории '{row[0]}'")
+        else:
+            rows[row[:2]] = row
+
+    existing = {(category, phrase): (action, params, description)
+                for category, phrase, action, params, description in store.iter_rows()}
+    added = [key for key in rows if key not in existing]
+    changed = [key for key in rows if key in existing and existing[key] != rows[key][2:]]
+    removed = [key for key in existing if key not in rows] if replace else []
+
+    print(f"📄 {path}: {len(rows)} команд, ошибок: {len(errors)}")
+    for error in errors[:ERROR_PREVIEW]:
+        print(f"  ❌ {error}")
+    if len(errors) > ERROR_PREVIEW:
+        print(f"  … и ещё {len(errors) - ERROR_PREVIEW}")
+    print(f"  + новых: {len(added)}, ~ изменённых: {len(changed)}, - удаляемых: {len(removed)}, "
+          f"без изменений: {len(rows) - len(added) - len(changed)}")
+    if dry_run:
+        for sign, keys in (("+", added), ("~", changed), ("-", removed)):
+            for category, phrase in keys[:DIFF_PREVIEW]:
+                print(f"  {sign} {category}: {phrase}")
+            if len(keys) > DIFF_PREVIEW:
+                print(f"  {sign} … и ещё {len(keys) - DIFF_PREVIEW}")
+        print("ℹ️ Пробный запуск: база не изменена")
+        return not errors
+    if errors:
+        print("❌ Импорт отменён из-за ошибок")
+        return False
+
+    if replace:
+        store.import_rows(rows.values(), replace=True)
+    else:
+        store.import_rows(rows[key] for key in added + changed)
+    print(f"✅ Импорт завершён за {time.perf_counter() - started:.1f} с")
+    return True
+
+def compile_bundle(store: command_store.CommandStore, path: str) -> int:
+    """Compile commands into a bundle and report conflicts; returns the number of dead phrases"""
+    matcher = command_matcher.compile_store(store)
+    matcher.save(path)
+    print(f"✅ Скомпилировано {len(matcher)} команд в {path} (версия формата {command_matcher.BUNDLE_VERSION})")
+
+    conflicts = matcher.conflicts()
+    if not conflicts:
+        print("✅ Конфликтов фраз не найдено")
+        return 0
+    by_kind: Dict[str, list] = {}
+    for conflict in conflicts:
+        by_kind.setdefault(conflict["kind"], []).append(conflict)
+    for kind, label in CONFLICT_LABELS.items():
+        items = by_kind.get(kind)
+        if not items:
+            continue
+        print(f"\n⚠️ {label}: {len(items)}")
+        for item in items:
+            by = item["by"]
+            print(f"  🎯 '{item['phrase']}' ({item['category']}) ← '{by['phrase']}' ({by['category']})")
+    return sum(len(by_kind.get(kind, [])) for kind in ("duplicate", "shadowed", "empty"))
 
 def show_help():
     """Show help"""
@@ -100,7 +228,17 @@ def show_help():
   add <категория> <команда> <действие> <параметры> <описание>
                           - Добавить новую команду
   remove <команда>        - Удалить команду
-  search <запрос>         - Найти команды
+  search <запрос> [--limit N]
+                          - Найти команды (ранжированный поиск с учётом опечаток)
+  export-json [файл]      - Выгрузить команды из базы в JSON (по умолчанию commands.json)
+  import-json [файл]      - Загрузить команды из JSON в базу (--replace заменяет все команды)
+  export <файл.csv|файл.jsonl>
+                          - Выгрузить все команды в CSV или JSONL
+  import <файл.csv|файл.jsonl> [--dry-run] [--replace]
+                          - Загрузить команды одной транзакцией с проверкой;
+                            --dry-run показывает изменения без записи, --replace заменяет все команды
+  compile [файл]          - Скомпилировать пакет команд (по умолчанию commands.bundle рядом с базой) и проверить конфликты фраз
+                            (--strict завершает с ошибкой, если есть фразы, которые никогда не сработают)
   help                    - Показать эту справку
 
 Примеры:
@@ -108,19 +246,15 @@ def show_help():
   python manage_commands.py add applications "открой spotify" open_app ["Spotify"] "Открывает Spotify"
   python manage_commands.py remove "открой spotify"
   python manage_commands.py search "браузер"
-
-Доступные действия:
-  - open_app: открыть приложение
-  - kill_process: закрыть процесс
-  - open_url: открыть URL
-  - system_command: выполнить системную команду
-  - move_mouse: двигать мышью
-  - click_mouse: кликнуть мышью
-  - say: произнести текст
-  - take_screenshot: сделать скриншот
-  - focus_mode: режим фокуса
-  - timer_5_minutes: таймер
+  python manage_commands.py import commands.csv --dry-run
+  python manage_commands.py compile --strict
 """)
+    registry = action_registry.default_registry()
+    print("Доступные действия:")
+    for name in registry.names():
+        spec = registry.get(name)
+        params = ", ".join(param["name"] for param in spec.params or [])
+        print(f"  - {name}({params}): {spec.description or spec.source}")
 
 def main():
     if len(sys.argv) < 2:
@@ -128,10 +262,9 @@ def main():
         return
     
     command = sys.argv[1].lower()
-    commands = load_commands()
     
     if command == 'list':
-        list_commands(commands)
+        list_commands(load_commands())
     
     elif command == 'add':
         if len(sys.argv) < 7:
@@ -151,8 +284,7 @@ def main():
             print("❌ Ошибка в формате параметров. Используйте JSON формат, например: [\"param1\", \"param2\"]")
             return
         
-        add_command(commands, category, cmd, action, params, description)
-        save_commands(commands)
+        add_command(command_store.open_store(), category, cmd, action, params, description)
     
     elif command == 'remove':
         if len(sys.argv) < 3:
@@ -160,16 +292,74 @@ def main():
             return
         
         cmd = sys.argv[2]
-        remove_command(commands, cmd)
-        save_commands(commands)
+        remove_command(command_store.open_store(), cmd)
     
     elif command == 'search':
         if len(sys.argv) < 3:
             print("❌ Укажите запрос для поиска")
             return
         
-        query = sys.argv[2]
-        search_command(commands, query)
+        args = sys.argv[2:]
+        limit = command_store.SEARCH_LIMIT
+        if '--limit' in args:
+            index = args.index('--limit')
+            try:
+                limit = int(args[index + 1])
+            except (IndexError, ValueError):
+                print("❌ После --limit укажите число")
+                return
+            del args[index:index + 2]
+        if not args:
+            print("❌ Укажите запрос для поиска")
+            return
+        search_command(command_store.open_store(), " ".join(args), limit)
+    
+    elif command == 'export-json':
+        filename = sys.argv[2] if len(sys.argv) > 2 else command_store.DEFAULT_JSON
+        count = command_store.open_store().export_json(filename)
+        print(f"✅ Экспортировано {count} команд в {filename}")
+    
+    elif command == 'import-json':
+        args = [arg for arg in sys.argv[2:] if arg != '--replace']
+        filename = args[0] if args else command_store.DEFAULT_JSON
+        try:
+            count = command_store.open_store().import_json(filename, replace='--replace' in sys.argv)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"❌ Ошибка импорта: {e}")
+            return
+        print(f"✅ Импортировано {count} команд из {filename}")
+    
+    elif command == 'export':
+        if len(sys.argv) < 3:
+            print("❌ Укажите файл для экспорта (.csv или .jsonl)")
+            return
+        try:
+            count = export_file(command_store.open_store(), sys.argv[2])
+        except (OSError, ValueError) as e:
+            print(f"❌ Ошибка экспорта: {e}")
+            return
+        print(f"✅ Экспортировано {count} команд в {sys.argv[2]}")
+    
+    elif command == 'import':
+        args = [arg for arg in sys.argv[2:] if arg not in ('--dry-run', '--replace')]
+        if not args:
+            print("❌ Укажите файл для импорта (.csv или .jsonl)")
+            return
+        try:
+            ok = import_file(command_store.open_store(), args[0],
+                             dry_run='--dry-run' in sys.argv, replace='--replace' in sys.argv)
+        except (OSError, ValueError, csv.Error) as e:
+            print(f"❌ Ошибка импорта: {e}")
+            ok = False
+        if not ok:
+            sys.exit(1)
+    
+    elif command == 'compile':
+        args = [arg for arg in sys.argv[2:] if arg != '--strict']
+        filename = args[0] if args else command_matcher.default_bundle_path()
+        dead = compile_bundle(command_store.open_store(), filename)
+        if dead and '--strict' in sys.argv:
+            sys.exit(1)
     
     elif command == 'help':
         show_help()
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+On-demand profiling of the running assistant.
+
+Nothing runs while profiling is off: the CPU profile is a sampling thread that
+exists only for the requested number of seconds, and tracemalloc is started by
+the first dump and stopped by stop(). Each dump writes a timestamped report
+(hot functions, allocation growth since the previous dump, thread stacks and
+queue depths) plus the sampled stacks in collapsed format for flame graphs.
+"""
+
+import os
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import linecache
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+
+PROFILE_SECONDS = 5.0
+MAX_PROFILE_SECONDS = 120.0
+SAMPLE_INTERVAL = 0.005
+TRACEMALLOC_FRAMES = 10
+TOP_FUNCTIONS = 40
+TOP_ALLOCATIONS = 25
+
+def default_dump_dir() -> str:
+    return os.environ.get("ASSISTANT_PROFILE_DIR") or os.path.join(tempfile.gettempdir(), "loner_assistant_profiles")
+
+def frame_key(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+def sample_stacks(seconds: float, interval: float = SAMPLE_INTERVAL) -> Dict[str, Any]:
+    """Sample the stacks of all threads for a while.
+
+    Returns total samples, per-function self and cumulative sample counts and
+    collapsed stacks ("thread;outer;...;inner" -> count).
+    """
+    names = {thread.ident: thread.name for thread in threading.enumerate()}
+    own = threading.get_ident()
+    own_samples = Counter()
+    cumulative = Counter()
+    stacks = Counter()
+    samples = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            keys = []
+            while frame is not None:
+                keys.append(frame_key(frame))
+                frame = frame.f_back
+            if not keys:
+                continue
+            own_samples[keys[0]] += 1
+            cumulative.update(set(keys))
+            if ident not in names:
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+            stacks[";".join([names.get(ident, str(ident))] + keys[::-1])] += 1
+        samples += 1
+        time.sleep(interval)
+    return {"samples": samples, "self": own_samples, "cumulative": cumulative, "stacks": stacks}
+
+def thread_stacks() -> str:
+    names = {thread.ident: thread for thread in threading.enumerate()}
+    lines = []
+    for ident, frame in sys._current_frames().items():
+        thread = names.get(ident)
+        title = f"{thread.name}{' (daemon)' if thread.daemon else ''}" if thread else f"поток {ident}"
+        lines.append(f"--- {title}")
+        lines.extend(line.rstrip() for line in traceback.format_stack(frame))
+    return "\n".join(lines)
+
+class Profiler:
+    """Time-boxed CPU sampling plus tracemalloc diffs, one dump at a time"""
+
+    def __init__(self, queue_depths: Optional[Callable[[], Dict[str, Any]]] = None, dump_dir: Optional[str] = None):
+        self.queue_depths = queue_depths or (lambda: {})
+        self.dump_dir = dump_dir or default_dump_dir()
+        self.snapshot = None
+        self.running = threading.Lock()
+        self.last_dump: Optional[str] = None
+
+    @property
+    def tracing(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def start_in_background(self, seconds: float = PROFILE_SECONDS, memory: bool = True,
+                            on_done: Optional[Callable[[Optional[str]], None]] = None) -> bool:
+        """Dump from a new thread (signal handlers and voice commands must not block); False if one is running"""
+        if self.running.locked():
+            return False
+
+        def run():
+            path = None
+            try:
+                path = self.dump(seconds, memory)
+            except RuntimeError:
+                pass
+            except Exception as e:
+                print(f"Ошибка профилирования: {e}")
+                sys.stdout.flush()
+            if on_done:
+                on_done(path)
+
+        threading.Thread(target=run, daemon=True, name="profiler").start()
+        return True
+
+    def dump(self, seconds: float = PROFILE_SECONDS, memory: bool = True) -> str:
+        """Profile for `seconds`, write the report and return its path"""
+        if not self.running.acquire(blocking=False):
+            raise RuntimeError("Профилирование уже идёт")
+        try:
+            seconds = max(0.1, min(float(seconds), MAX_PROFILE_SECONDS))
+            started_tracing = False
+            if memory and not tracemalloc.is_tracing():
+                tracemalloc.start(TRACEMALLOC_FRAMES)
+                started_tracing = True
+            started = datetime.now()
+            cpu = sample_stacks(seconds)
+            # Memory first, before formatting the report allocates anything
+            memory_section = self._memory_section(started_tracing) if memory else ""
+            sections = [
+                f"Профиль ассистента, PID {os.getpid()}, {started:%Y-%m-%d %H:%M:%S}, {seconds:g} с, "
+                f"{cpu['samples']} выборок по {SAMPLE_INTERVAL * 1000:g} мс",
+                self._cpu_section(cpu),
+                memory_section,
+                self._queue_section(),
+                "=== Стеки потоков\n" + thread_stacks(),
+            ]
+            os.makedirs(self.dump_dir, exist_ok=True)
+            base = os.path.join(self.dump_dir, f"profile_{started:%Y%m%d_%H%M%S}_{os.getpid()}")
+            with open(base + ".txt", 'w', encoding='utf-8') as f:
+                f.write("\n\n".join(section for section in sections if section) + "\n")
+            with open(base + ".folded", 'w', encoding='utf-8') as f:
+                for stack, count in cpu["stacks"].most_common():
+                    f.write(f"{stack} {count}\n")
+            self.last_dump = base + ".txt"
+            return self.last_dump
+        finally:
+            self.running.release()
+
+    def _cpu_section(self, cpu: Dict[str, Any]) -> str:
+        samples = cpu["samples"] or 1
+        lines = ["=== CPU: функции по собственным выборкам (сумма по всем потокам)",
+                 f"{'своё %':>7} {'всего %':>8}  функция"]
+        for key, count in cpu["self"].most_common(TOP_FUNCTIONS):
+            lines.append(f"{100 * count / samples:7.1f} {100 * cpu['cumulative'][key] / samples:8.1f}  {key}")
+        return "\n".join(lines)
+
+    def _memory_section(self, started_tracing: bool) -> str:
+        # The profiler's own allocations (and the source lines cached for stack dumps) are not of interest
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, linecache.__file__),
+            tracemalloc.Filter(False, __file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [f"=== Память: отслеживается {current / 1024:.0f} КБ, пик {peak / 1024:.0f} КБ"]
+        if started_tracing or self.snapshot is None:
+            lines.append("Отслеживание выделений начато сейчас; рост будет виден в следующем профиле.")
+            stats = snapshot.statistics("lineno")[:TOP_ALLOCATIONS]
+            lines.extend(str(stat) for stat in stats)
+        else:
+            lines.append("Рост с предыдущего профиля:")
+            stats = snapshot.compare_to(self.snapshot, "lineno")[:TOP_ALLOCATIONS]
+            lines.extend(str(stat) for stat in stats)
+        self.snapshot = snapshot
+        return "\n".join(lines)
+
+    def _queue_section(self) -> str:
+        try:
+            depths = self.queue_depths()
+        except Exception as e:
+            depths = {"ошибка": str(e)}
+        lines = ["=== Очереди"]
+        lines.extend(f"{name}: {value}" for name, value in depths.items())
+        return "\n".join(lines)
+
+    def stop(self):
+        """Stop allocation tracing and forget the baseline snapshot"""
+        self.snapshot = None
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "running": self.running.locked(),
+            "tracing": self.tracing,
+            "dump_dir": self.dump_dir,
+            "last_dump": self.last_dump,
+        }
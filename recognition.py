@@ -0,0 +1,407 @@
+#!/usr/bin/env python3
+"""
+Speech recognition backends and hedged recognition across them.
+
+Every backend returns n-best (text, confidence) pairs; confidence may be
+None. HedgedRecognizer sends the audio to the primary backend first and to
+the fallbacks after a hedge delay, and takes the first result that the
+caller accepts (normally: it maps to a known command).
+
+Each backend sits behind a circuit breaker: after repeated errors or slow
+answers it opens and the backend is skipped until a probe after a cooldown
+succeeds. With every breaker open, recognize() fails at once with
+OfflineError instead of waiting for network timeouts.
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import audio_transport
+
+LANGUAGE = "ru-RU"
+STATS_WINDOW = 50
+MIN_SAMPLES = 5
+HEDGE_DEFAULT = 1.0
+HEDGE_MIN = 0.2
+HEDGE_MAX = 3.0
+HEDGE_PERCENTILE = 0.9
+VOSK_SAMPLE_RATE = 16000
+VOSK_ALTERNATIVES = 5
+REQUEST_TIMEOUT = 8.0
+
+# Circuit breaker states
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+BREAKER_FAILURES = 3       # consecutive failures that open the breaker
+BREAKER_WINDOW = 10        # recent calls for the error rate
+BREAKER_ERROR_RATE = 0.5   # share of failures among them that opens the breaker
+BREAKER_COOLDOWN = 15.0    # seconds before a half-open probe, doubled after a failed probe
+BREAKER_COOLDOWN_MAX = 120.0
+SLOW_CALL = 5.0            # an answer slower than this counts as a failure
+
+Alternatives = List[Tuple[str, Optional[float]]]
+
+class OfflineError(Exception):
+    """Every recognition backend is unavailable (all breakers open)"""
+
+class Backend:
+    """Base class: name, preferred audio format, optional warm_up() and recognize()"""
+
+    name = "backend"
+    sample_rate = audio_transport.TARGET_RATE
+    encodings: Tuple[str, ...] = ("pcm",)
+
+    def warm_up(self):
+        pass
+
+    def recognize(self, recognizer, audio) -> Alternatives:
+        raise NotImplementedError
+
+class GoogleBackend(Backend):
+    """Google Web Speech API through speech_recognition, with n-best alternatives"""
+
+    name = "google"
+    encodings = ("flac",)  # recognize_google always uploads FLAC
+
+    def recognize(self, recognizer, audio) -> Alternatives:
+        import speech_recognition as sr
+        if recognizer.operation_timeout is None:
+            recognizer.operation_timeout = REQUEST_TIMEOUT
+        result = recognizer.recognize_google(audio, language=LANGUAGE, show_all=True)
+        alternatives = []
+        if isinstance(result, dict):
+            for item in result.get("alternative", []):
+                transcript = item.get("transcript", "").strip()
+                if transcript:
+                    alternatives.append((transcript.lower(), item.get("confidence")))
+        if not alternatives:
+            raise sr.UnknownValueError()
+        return alternatives
+
+class VoskBackend(Backend):
+    """Offline Vosk model from $ASSISTANT_VOSK_MODEL (default ./model)"""
+
+    name = "vosk"
+    sample_rate = VOSK_SAMPLE_RATE
+
+    def __init__(self, model_path: Optional[str] = None):
+        self.model_path = model_path or os.environ.get("ASSISTANT_VOSK_MODEL", "model")
+        self.model = None
+        self.lock = threading.Lock()
+
+    def warm_up(self):
+        with self.lock:
+            if self.model is None:
+                from vosk import Model, SetLogLevel
+                SetLogLevel(-1)
+                self.model = Model(self.model_path)
+
+    def recognize(self, recognizer, audio) -> Alternatives:
+        import speech_recognition as sr
+        from vosk import KaldiRecognizer
+        self.warm_up()
+        rec = KaldiRecognizer(self.model, VOSK_SAMPLE_RATE)
+        rec.SetMaxAlternatives(VOSK_ALTERNATIVES)
+        rec.AcceptWaveform(audio.get_raw_data(convert_rate=VOSK_SAMPLE_RATE, convert_width=2))
+        result = json.loads(rec.FinalResult())
+        # Vosk confidences are not probabilities; leave them to rank-based estimation
+        texts = [item.get("text", "").strip() for item in result.get("alternatives", [])]
+        if not texts and result.get("text"):
+            texts = [result["text"].strip()]
+        alternatives = [(text.lower(), None) for text in texts if text]
+        if not alternatives:
+            raise sr.UnknownValueError()
+        return alternatives
+
+BACKENDS: Dict[str, Callable[[], Backend]] = {
+    "google": GoogleBackend,
+    "vosk": VoskBackend,
+}
+
+def create_backends(names: Optional[str] = None) -> List[Backend]:
+    """Backends from a comma-separated list ($ASSISTANT_BACKENDS, default "google"), primary first"""
+    names = names or os.environ.get("ASSISTANT_BACKENDS", "google")
+    backends = []
+    for name in [name.strip() for name in names.split(",") if name.strip()]:
+        factory = BACKENDS.get(name)
+        if any(backend.name == name for backend in backends):
+            continue
+        if factory is None:
+            print(f"⚠️ Неизвестный бэкенд распознавания: {name}")
+            sys.stdout.flush()
+            continue
+        backends.append(factory())
+    return backends or [GoogleBackend()]
+
+class LatencyStats:
+    """Recent latencies and outcome counts of one backend"""
+
+    def __init__(self, window: int = STATS_WINDOW):
+        self.latencies = deque(maxlen=window)
+        self.ok = 0
+        self.unknown = 0
+        self.errors = 0
+        self.wins = 0
+        self.lock = threading.Lock()
+
+    def record(self, latency: float, outcome: str):
+        with self.lock:
+            self.latencies.append(latency)
+            if outcome == "ok":
+                self.ok += 1
+            elif outcome == "unknown":
+                self.unknown += 1
+            else:
+                self.errors += 1
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        with self.lock:
+            if len(self.latencies) < MIN_SAMPLES:
+                return None
+            ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def to_dict(self) -> Dict[str, Any]:
+        p50, p90 = self.percentile(0.5), self.percentile(0.9)
+        return {
+            "requests": self.ok + self.unknown + self.errors,
+            "ok": self.ok,
+            "unknown": self.unknown,
+            "errors": self.errors,
+            "wins": self.wins,
+            "p50": round(p50, 3) if p50 is not None else None,
+            "p90": round(p90, 3) if p90 is not None else None,
+        }
+
+class CircuitBreaker:
+    """closed -> open after repeated failures -> half_open probe after a cooldown -> closed or open again"""
+
+    def __init__(self, name: str, on_change: Optional[Callable[[str, str, str, str], None]] = None):
+        self.name = name
+        self.on_change = on_change or (lambda name, state, previous, reason: None)
+        self.state = CLOSED
+        self.outcomes = deque(maxlen=BREAKER_WINDOW)
+        self.consecutive = 0
+        self.cooldown = BREAKER_COOLDOWN
+        self.opened_at = 0.0
+        self.probing = False
+        self.reason = ""
+        self.lock = threading.Lock()
+
+    def available(self) -> bool:
+        """Whether a call would be let through now (without reserving the probe)"""
+        with self.lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                return time.monotonic() - self.opened_at >= self.cooldown
+            return not self.probing
+
+    def allow(self) -> bool:
+        """Let a call through; in half-open state only one probe at a time"""
+        change = None
+        with self.lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                if time.monotonic() - self.opened_at < self.cooldown:
+                    return False
+                change = self._set(HALF_OPEN, "пробный запрос")
+            if self.probing:
+                allowed = False
+            else:
+                self.probing = allowed = True
+        self._notify(change)
+        return allowed
+
+    def record(self, ok: bool, reason: str = ""):
+        change = None
+        with self.lock:
+            if self.state == HALF_OPEN:
+                self.probing = False
+                if ok:
+                    self.cooldown = BREAKER_COOLDOWN
+                    self.outcomes.clear()
+                    self.consecutive = 0
+                    change = self._set(CLOSED, "бэкенд снова отвечает")
+                else:
+                    self.cooldown = min(BREAKER_COOLDOWN_MAX, self.cooldown * 2)
+                    change = self._open(reason)
+            else:
+                self.outcomes.append(ok)
+                self.consecutive = 0 if ok else self.consecutive + 1
+                failures = self.outcomes.count(False)
+                if self.state == CLOSED and not ok and (
+                        self.consecutive >= BREAKER_FAILURES
+                        or (len(self.outcomes) == BREAKER_WINDOW and failures >= BREAKER_ERROR_RATE * BREAKER_WINDOW)):
+                    change = self._open(reason)
+        self._notify(change)
+
+    def _open(self, reason: str):
+        self.opened_at = time.monotonic()
+        return self._set(OPEN, reason)
+
+    def _set(self, state: str, reason: str):
+        previous, self.state, self.reason = self.state, state, reason
+        return state, previous, reason
+
+    def _notify(self, change):
+        if change:
+            self.on_change(self.name, *change)
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self.lock:
+            retry = self.cooldown - (time.monotonic() - self.opened_at) if self.state == OPEN else None
+            return {
+                "state": self.state,
+                "reason": self.reason,
+                "retry_in": round(max(0.0, retry), 1) if retry is not None else None,
+            }
+
+class HedgedRecognizer:
+    """Primary backend first, fallbacks after a hedge delay; the first accepted result wins.
+
+    hedge_delay: seconds, 0 to query all backends at once, or None to use
+    the primary's recent p90 latency (HEDGE_DEFAULT until enough samples).
+    on_breaker(backend, state, previous, reason) is called on breaker state changes.
+    concurrency: how many recognize() calls may run at once (one per session).
+    """
+
+    def __init__(self, backends: List[Backend], accept: Optional[Callable[[Alternatives], bool]] = None,
+                 hedge_delay: Optional[float] = None,
+                 on_breaker: Optional[Callable[[str, str, str, str], None]] = None, concurrency: int = 1):
+        self.backends = backends
+        self.accept = accept or (lambda alternatives: True)
+        self.hedge_delay = hedge_delay
+        self.stats = {backend.name: LatencyStats() for backend in backends}
+        self.breakers = {backend.name: CircuitBreaker(backend.name, on_breaker) for backend in backends}
+        self.transport = audio_transport.TransportStats()
+        self.pool = ThreadPoolExecutor(max_workers=max(1, len(backends) * concurrency), thread_name_prefix="recognize")
+
+    @classmethod
+    def from_env(cls, accept: Optional[Callable[[Alternatives], bool]] = None,
+                 on_breaker: Optional[Callable[[str, str, str, str], None]] = None,
+                 concurrency: int = 1) -> "HedgedRecognizer":
+        delay = os.environ.get("ASSISTANT_HEDGE_DELAY", "auto")
+        return cls(create_backends(), accept, None if delay == "auto" else float(delay), on_breaker, concurrency)
+
+    def warm_up(self):
+        for backend in self.backends:
+            try:
+                backend.warm_up()
+            except Exception as e:
+                print(f"⚠️ Бэкенд {backend.name} не готов: {e}")
+                sys.stdout.flush()
+
+    def current_delay(self) -> float:
+        if self.hedge_delay is not None:
+            return self.hedge_delay
+        p90 = self.stats[self.backends[0].name].percentile(HEDGE_PERCENTILE)
+        return HEDGE_DEFAULT if p90 is None else min(HEDGE_MAX, max(HEDGE_MIN, p90))
+
+    def _call(self, backend: Backend, recognizer, audio) -> Alternatives:
+        import speech_recognition as sr
+        breaker = self.breakers[backend.name]
+        if not breaker.allow():
+            raise OfflineError(f"{backend.name}: бэкенд временно отключён")
+        started = time.perf_counter()
+        try:
+            encoding = audio_transport.choose_encoding(backend.encodings)
+            payload = audio_transport.encode(audio, encoding)
+            self.transport.record(audio_transport.TransportRecord(
+                backend.name, encoding, audio.input_bytes, len(payload), audio.input_seconds,
+                len(audio.frame_data) / (audio.sample_rate * audio.sample_width),
+                audio.prepare_seconds + time.perf_counter() - started))
+            alternatives = backend.recognize(recognizer, audio)
+        except sr.UnknownValueError:
+            # The service answered, there was just no speech in the audio
+            self._record(backend.name, time.perf_counter() - started, "unknown")
+            raise
+        except Exception as e:
+            self._record(backend.name, time.perf_counter() - started, "error", str(e))
+            raise
+        self._record(backend.name, time.perf_counter() - started, "ok")
+        return alternatives
+
+    def _record(self, name: str, latency: float, outcome: str, error: str = ""):
+        self.stats[name].record(latency, outcome)
+        if outcome == "error":
+            self.breakers[name].record(False, error or "ошибка")
+        elif latency > SLOW_CALL:
+            self.breakers[name].record(False, f"медленный ответ ({latency:.1f} с)")
+        else:
+            self.breakers[name].record(True)
+
+    def recognize(self, recognizer, audio) -> Tuple[str, Alternatives]:
+        """(backend name, alternatives); raises UnknownValueError or RequestError if nothing usable
+        came back and OfflineError right away if every backend's breaker is open"""
+        import speech_recognition as sr
+        backends = [backend for backend in self.backends if self.breakers[backend.name].available()]
+        if not backends:
+            raise OfflineError("все бэкенды распознавания недоступны")
+        prepared = {}
+        for backend in backends:
+            if backend.sample_rate not in prepared:
+                prepared[backend.sample_rate] = audio_transport.prepare(audio, backend.sample_rate)
+        if len(backends) == 1:
+            backend = backends[0]
+            alternatives = self._call(backend, recognizer, prepared[backend.sample_rate])
+            self.stats[backend.name].wins += 1
+            return backend.name, alternatives
+
+        # With the primary's breaker open the first available fallback is asked right away
+        pending = {self.pool.submit(self._call, backends[0], recognizer, prepared[backends[0].sample_rate]): backends[0]}
+        waiting = list(backends[1:])
+        hedge_at = time.perf_counter() + self.current_delay()
+        results: Dict[str, Alternatives] = {}
+        errors: List[Exception] = []
+        while pending or waiting:
+            timeout = max(0.0, hedge_at - time.perf_counter()) if waiting else None
+            done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done and waiting:
+                # Hedge: the primary is slow (or already failed), ask the fallbacks too
+                for backend in waiting:
+                    pending[self.pool.submit(self._call, backend, recognizer, prepared[backend.sample_rate])] = backend
+                waiting = []
+            for future in done:
+                backend = pending.pop(future)
+                try:
+                    alternatives = future.result()
+                except Exception as e:
+                    errors.append(e)
+                    if waiting:
+                        hedge_at = time.perf_counter()
+                    continue
+                results[backend.name] = alternatives
+                if self.accept(alternatives):
+                    for other in pending:
+                        other.cancel()  # Running requests finish in the background and are ignored
+                    self.stats[backend.name].wins += 1
+                    return backend.name, alternatives
+
+        # Nobody produced a command: fall back to the highest-priority transcript
+        for backend in self.backends:
+            if backend.name in results:
+                self.stats[backend.name].wins += 1
+                return backend.name, results[backend.name]
+        if errors and all(isinstance(e, OfflineError) for e in errors):
+            raise OfflineError("; ".join(str(e) for e in errors))
+        if errors and all(not isinstance(e, sr.UnknownValueError) for e in errors):
+            raise sr.RequestError("; ".join(str(e) for e in errors))
+        raise sr.UnknownValueError()
+
+    def stats_dict(self) -> Dict[str, Any]:
+        return {
+            "hedge_delay": round(self.current_delay(), 3),
+            "transport": self.transport.to_dict(),
+            "backends": {name: dict(stats.to_dict(), breaker=self.breakers[name].to_dict())
+                         for name, stats in self.stats.items()},
+        }
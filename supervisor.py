@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Supervisor for the assistant process: warm-standby restarts and crash recovery
+"""
+
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+import control_server
+
+READY_TIMEOUT = 60
+HANDOFF_TIMEOUT = 20
+STOP_TIMEOUT = 5
+MIN_BACKOFF = 1
+MAX_BACKOFF = 30
+STABLE_UPTIME = 60
+
+class AssistantSupervisor:
+    """Runs assistant.py, swaps in a warmed-up standby on restart and restarts it after crashes"""
+
+    def __init__(self, on_output: Optional[Callable[[str], None]] = None,
+                 on_state: Optional[Callable[[str], None]] = None,
+                 socket_path: Optional[str] = None, args: Optional[List[str]] = None):
+        self.on_output = on_output or (lambda line: print(line, flush=True))
+        self.on_state = on_state or (lambda state: None)
+        self.socket_path = socket_path or control_server.default_socket_path()
+        self.args = args or []
+        self.process = None
+        self.labels: Dict[subprocess.Popen, str] = {}
+        self.retiring = set()
+        self.lock = threading.RLock()
+        self.restart_lock = threading.Lock()
+        self.stopping = False
+        self.started_at = 0.0
+        self.backoff = MIN_BACKOFF
+        self.restart_timer = None
+
+    @property
+    def running(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def _spawn(self, extra_args: List[str], label: str = "") -> subprocess.Popen:
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assistant.py")
+        process = subprocess.Popen(
+            [sys.executable, script, *self.args, *extra_args],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            bufsize=1
+        )
+        self.labels[process] = label
+        threading.Thread(target=self._pump, args=(process,), daemon=True).start()
+        return process
+
+    def _pump(self, process: subprocess.Popen):
+        """Forward process output and notice when it exits"""
+        try:
+            for line in iter(process.stdout.readline, ''):
+                if line.strip():
+                    self.on_output(self.labels.get(process, "") + line.strip())
+        except (OSError, ValueError):
+            pass
+        process.wait()
+        self._on_exit(process)
+
+    def start(self):
+        """Start the assistant if it is not running"""
+        with self.lock:
+            if self.running:
+                return
+            self.stopping = False
+            extra = ["--socket", self.socket_path] if control_server.is_supported() else []
+            self.process = self._spawn(extra)
+            self.started_at = time.time()
+        self.on_state("running")
+
+    def stop(self, force: bool = False):
+        """Stop the assistant and any standby process; disables crash restarts"""
+        with self.lock:
+            self.stopping = True
+            if self.restart_timer:
+                self.restart_timer.cancel()
+                self.restart_timer = None
+            processes = [p for p in list(self.labels) if p.poll() is None]
+            self.process = None
+        for process in processes:
+            self._terminate(process, force)
+        self.on_state("stopped")
+
+    def _terminate(self, process: subprocess.Popen, force: bool = False):
+        with self.lock:
+            self.retiring.add(process)
+        try:
+            if force:
+                process.kill()
+            else:
+                process.terminate()
+            try:
+                process.wait(timeout=STOP_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+        except OSError:
+            pass
+
+    def restart(self) -> bool:
+        """Zero-downtime restart; falls back to a cold restart when no control socket is available"""
+        with self.restart_lock:
+            old = self.process
+            if old is None or old.poll() is not None or not control_server.is_supported():
+                self.stop()
+                self.start()
+                return True
+
+            self.on_output("🔄 Прогреваю резервный процесс ассистента...")
+            standby_path = self.socket_path + ".standby"
+            standby = self._spawn(["--standby", "--socket", standby_path], label="[резерв] ")
+            standby_client = control_server.ControlClient(standby_path)
+            if not self._wait_ready(standby, standby_client):
+                self.on_output("❌ Резервный процесс не прогрелся, продолжаю работу со старым")
+                self._terminate(standby, force=True)
+                return False
+
+            with self.lock:
+                self.retiring.add(old)
+            state = None
+            try:
+                state = control_server.ControlClient(self.socket_path, timeout=HANDOFF_TIMEOUT).call("handoff")
+            except (OSError, ValueError, control_server.RPCError) as e:
+                self.on_output(f"⚠️ Старый процесс не передал состояние: {e}")
+
+            try:
+                standby_client.call("activate", state=state, socket=self.socket_path)
+            except (OSError, ValueError, control_server.RPCError) as e:
+                self.on_output(f"❌ Ошибка активации резервного процесса: {e}")
+                self._terminate(standby, force=True)
+                with self.lock:
+                    self.retiring.discard(old)
+                if old.poll() is not None:
+                    self.start()
+                return False
+
+            with self.lock:
+                self.labels[standby] = ""
+                self.process = standby
+                self.started_at = time.time()
+            try:
+                old.wait(timeout=STOP_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                self._terminate(old)
+            self.on_output("✅ Ассистент перезапущен без простоя")
+            self.on_state("running")
+            return True
+
+    def _wait_ready(self, process: subprocess.Popen, client: "control_server.ControlClient") -> bool:
+        deadline = time.time() + READY_TIMEOUT
+        while time.time() < deadline and process.poll() is None and not self.stopping:
+            try:
+                if client.call("status").get("ready"):
+                    return True
+            except (OSError, ValueError, control_server.RPCError):
+                pass
+            time.sleep(0.1)
+        return False
+
+    def _on_exit(self, process: subprocess.Popen):
+        with self.lock:
+            self.labels.pop(process, None)
+            if process in self.retiring:
+                self.retiring.discard(process)
+                return
+            if process is not self.process or self.stopping:
+                return
+            self.process = None
+            if process.returncode == 0:
+                crashed = False
+            else:
+                crashed = True
+                if time.time() - self.started_at > STABLE_UPTIME:
+                    self.backoff = MIN_BACKOFF
+                delay = self.backoff
+                self.backoff = min(self.backoff * 2, MAX_BACKOFF)
+                self.restart_timer = threading.Timer(delay, self._restart_after_crash)
+                self.restart_timer.daemon = True
+                self.restart_timer.start()
+        if crashed:
+            self.on_output(f"💥 Ассистент завершился с кодом {process.returncode}, перезапуск через {delay} с")
+            self.on_state("crashed")
+        else:
+            self.on_state("stopped")
+
+    def _restart_after_crash(self):
+        with self.lock:
+            self.restart_timer = None
+            if self.stopping:
+                return
+        self.start()
+
+def main():
+    """Run the assistant under supervision; SIGHUP restarts it without downtime"""
+    supervisor = AssistantSupervisor(args=sys.argv[1:])
+    done = threading.Event()
+
+    def shutdown(signum, frame):
+        done.set()
+
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+    if hasattr(signal, "SIGHUP"):
+        signal.signal(signal.SIGHUP, lambda signum, frame: threading.Thread(target=supervisor.restart, daemon=True).start())
+
+    supervisor.start()
+    while not done.wait(0.5):
+        pass
+    supervisor.stop()
+
+if __name__ == "__main__":
+    main()
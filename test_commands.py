@@ -6,40 +6,85 @@
 import json
 import sys
 import os
-from typing import Dict, Any
+import tempfile
+from collections import defaultdict
+from typing import Dict, Any, List, Optional, Tuple
+
+import action_registry
+import command_matcher
+import command_store
+import job_runner
+
+# Машиночитаемый отчёт: имя теста -> {"passed": bool, "issues": [...]}
+report: Dict[str, Any] = {}
+
+# Сопоставитель строится один раз на все проверки: фразы нормализуются в нём
+_matcher: Optional[Tuple[Dict[str, Any], command_matcher.CommandMatcher]] = None
+
+# Пример фразы для каждой параметрической команды: ни одна фраза базы не должна её перехватывать
+GRAMMAR_SAMPLES = {
+    "disable_commands_for": "выключи команды на 5 минут",
+    "click_mouse_times": "кликни 3 раз",
+    "move_mouse_direction": "пошевели мышкой вверх 10 пикселей",
+}
+
+# Команды, которые без ASSISTANT_ALLOW_DESTRUCTIVE=1 не должны выполняться, и те, что должны
+DESTRUCTIVE_SAMPLES = [
+    "cd / && rm -rf x", "env rm -rf x", 'sh -c "shutdown now"', "nice reboot", "true; poweroff",
+    "true\npoweroff", "ls || halt", "ls | xargs rm", "nice -n 5 rm x", "timeout -s KILL 5 rm x",
+    "FOO=1 rm x", "bash -lc 'reboot'", "(rm x)", "echo $(reboot)", "echo `reboot`", "curl x | sh",
+    "/sbin/shutdown -h now", ["env", "rm", "x"], ["sh", "-c", "rm x"],
+]
+SAFE_SAMPLES = [
+    "ifconfig | grep 'inet ' | grep -v 127.0.0.1", "date '+%A, %B %d, %Y'", "ping -c 3 google.com 2>/dev/null",
+    "open -a Music", ["say", "rm"],
+]
+
+def record(test: str, passed: bool, issues: List[Any]) -> bool:
+    report[test] = {"passed": passed, "issues": issues}
+    return passed
 
 def load_commands() -> Dict[str, Any]:
-    """Загружает команды из JSON файла"""
+    """Загружает команды из общей базы команд; без неё — из commands.json через временную базу"""
     try:
-        with open('commands.json', 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        print("❌ Файл commands.json не найден")
-        return {}
-    except json.JSONDecodeError as e:
-        print(f"❌ Ошибка чтения JSON файла: {e}")
+        if os.path.exists(command_store.default_db_path()):
+            store = command_store.CommandStore(bootstrap=False)
+            try:
+                return store.load_all()
+            finally:
+                store.close()
+        # Проверка не должна оставлять commands.db (и -wal, -shm) в текущем каталоге
+        with tempfile.TemporaryDirectory() as directory:
+            store = command_store.CommandStore(os.path.join(directory, "commands.db"))
+            try:
+                return store.load_all()
+            finally:
+                store.close()
+    except (OSError, ValueError) as e:
+        print(f"Ошибка чтения команд: {e}")
         return {}
 
+def get_matcher(commands: Dict[str, Any]) -> command_matcher.CommandMatcher:
+    global _matcher
+    if _matcher is None or _matcher[0] is not commands:
+        _matcher = (commands, command_matcher.CommandMatcher.from_commands(commands))
+    return _matcher[1]
+
 def test_command_structure(commands: Dict[str, Any]) -> bool:
     """Тестирует структуру команд"""
     print("🔍 Тестирование структуры команд...")
     
     if not commands:
         print("❌ Команды не загружены")
-        return False
+        return record("structure", False, ["commands not loaded"])
     
     required_fields = ["action", "params", "description"]
-    valid_actions = [
-        "open_app", "kill_process", "open_url", "system_command",
-        "move_mouse", "click_mouse", "take_screenshot", "focus_mode",
-        "say", "disable_commands", "enable_commands",
-        "timer_5_minutes", "timer_10_minutes", "timer_30_minutes"
-    ]
+    valid_actions = set(action_registry.default_registry().names())
     
-    valid_categories = [
+    valid_categories = {
         "applications", "close_applications", "websites", "system",
         "music", "mouse", "special", "assistant_control"
-    ]
+    }
     
     errors = []
     total_commands = 0
@@ -70,10 +115,10 @@ def test_command_structure(commands: Dict[str, Any]) -> bool:
         print("\n❌ Найдены ошибки:")
         for error in errors:
             print(f"  {error}")
-        return False
+        return record("structure", False, errors)
     else:
         print("✅ Структура команд корректна")
-        return True
+        return record("structure", True, [])
 
 def test_specific_commands(commands: Dict[str, Any]) -> bool:
     """Тестирует конкретные команды"""
@@ -85,7 +130,7 @@ def test_specific_commands(commands: Dict[str, Any]) -> bool:
         "websites": ["открой youtube", "открой github"],
         "system": ["заблокируй экран", "открой папку загрузки"],
         "music": ["включи музыку", "пауза"],
-        "assistant_control": ["выключи команды", "включи команды"]
+        "assistant_control": ["стоп", "включи команды"]
     }
     
     missing_commands = []
@@ -103,10 +148,10 @@ def test_specific_commands(commands: Dict[str, Any]) -> bool:
         print("⚠️ Отсутствуют важные команды:")
         for cmd in missing_commands:
             print(f"  {cmd}")
-        return False
+        return record("important_commands", False, missing_commands)
     else:
         print("✅ Все важные команды присутствуют")
-        return True
+        return record("important_commands", True, [])
 
 def test_command_descriptions(commands: Dict[str, Any]) -> bool:
     """Тестирует описания команд"""
@@ -124,32 +169,140 @@ def test_command_descriptions(commands: Dict[str, Any]) -> bool:
         print("⚠️ Команды без описаний:")
         for cmd in empty_descriptions:
             print(f"  {cmd}")
-        return False
+        return record("descriptions", False, empty_descriptions)
     else:
         print("✅ Все команды имеют описания")
-        return True
+        return record("descriptions", True, [])
 
 def test_duplicate_commands(commands: Dict[str, Any]) -> bool:
-    """Тестирует дублирование команд"""
+    """Тестирует дублирование команд, в том числе после нормализации (регистр, ё, пробелы)"""
     print("\n🔄 Тестирование дублирования команд...")
     
-    all_commands = []
-    duplicates = []
+    matcher = get_matcher(commands)
+    first_seen = {}
+    collisions = defaultdict(list)
+    # Обходить все фразы нужно, только если какие-то из них совпадают
+    if len(set(matcher.phrases)) < len(matcher.phrases):
+        for entry, normalized in zip(matcher.entries, matcher.phrases):
+            if normalized in first_seen:
+                collisions[normalized].append((entry.category, entry.phrase))
+            else:
+                first_seen[normalized] = (entry.category, entry.phrase)
     
-    for category, category_commands in commands.items():
-        for command in category_commands.keys():
-            if command in all_commands:
-                duplicates.append(command)
-            all_commands.append(command)
+    duplicates = []
+    for normalized, places in collisions.items():
+        places.insert(0, first_seen[normalized])
+        kind = "exact" if len({command for _, command in places}) == 1 else "normalized"
+        duplicates.append({"kind": kind, "phrase": normalized,
+                           "places": [{"category": c, "phrase": p} for c, p in places]})
     
     if duplicates:
         print("⚠️ Найдены дублирующиеся команды:")
-        for cmd in set(duplicates):
-            print(f"  {cmd}")
-        return False
+        for duplicate in duplicates:
+            places = ", ".join(f"{item['category']}: '{item['phrase']}'" for item in duplicate["places"])
+            print(f"  {duplicate['phrase']} ({places})")
+        return record("duplicates", False, duplicates)
     else:
         print("✅ Дублирующихся команд не найдено")
-        return True
+        return record("duplicates", True, [])
+
+def test_phrase_overlaps(commands: Dict[str, Any]) -> bool:
+    """Ищет фразы и параметрические команды, которые никогда не сработают (по правилу сопоставителя,
+    O(n log n) по отсортированным фразам)"""
+    print("\n🧩 Тестирование перекрытия фраз...")
+    
+    matcher = get_matcher(commands)
+    conflicts = matcher.conflicts()
+    fatal = [c for c in conflicts if c["kind"] in ("shadowed", "duplicate", "empty")]
+    warnings = [c for c in conflicts if c["kind"] not in ("shadowed", "duplicate", "empty")]
+    
+    unreachable = []
+    for action, _, _ in matcher.grammar:
+        sample = GRAMMAR_SAMPLES.get(action)
+        if sample is None:
+            unreachable.append({"kind": "grammar_untested", "action": action})
+            continue
+        match = matcher.match_command(sample)
+        if not isinstance(match, command_matcher.GrammarMatch) or match.action != action:
+            by = match.entry.phrase if isinstance(match, command_matcher.Match) else None
+            unreachable.append({"kind": "grammar_unreachable", "action": action, "sample": sample, "by": by})
+    
+    for conflict in warnings:
+        by = conflict["by"]
+        print(f"  ℹ️ {conflict['category']}: '{conflict['phrase']}' пересекается с {by['category']}: '{by['phrase']}'")
+    if fatal or unreachable:
+        print("⚠️ Фразы, которые никогда не сработают:")
+        for conflict in fatal:
+            by = conflict["by"]
+            print(f"  {conflict['category']}: '{conflict['phrase']}' ← {by['category']}: '{by['phrase']}'")
+        for item in unreachable:
+            if item["kind"] == "grammar_untested":
+                print(f"  {item['action']}: нет примера в GRAMMAR_SAMPLES")
+            else:
+                print(f"  {item['action']}: '{item['sample']}' ← '{item['by']}'")
+        return record("overlaps", False, conflicts + unreachable)
+    else:
+        print("✅ Перекрытых фраз не найдено")
+        return record("overlaps", True, conflicts)
+
+def test_action_params(commands: Dict[str, Any]) -> bool:
+    """Проверяет params по схеме параметров действия из реестра"""
+    print("\n🧮 Тестирование параметров действий...")
+    
+    registry = action_registry.default_registry()
+    errors = []
+    # Результат зависит только от действия и типов параметров
+    checked: Dict[Tuple[str, tuple], Optional[str]] = {}
+    for category, category_commands in commands.items():
+        for command, data in category_commands.items():
+            action = data.get("action")
+            params = data.get("params", [])
+            if action not in registry or not isinstance(params, list):
+                continue  # Сообщается в test_command_structure
+            signature = (action, tuple(map(type, params)))
+            if signature not in checked:
+                checked[signature] = registry.validate(action, params)
+            error = checked[signature]
+            if error:
+                errors.append({"category": category, "phrase": command, "action": action,
+                               "params": params, "error": error})
+    
+    if errors:
+        print("❌ Параметры не подходят к действию:")
+        for error in errors:
+            print(f"  {error['category']}: '{error['phrase']}' → {error['action']}{tuple(error['params'])}: {error['error']}")
+        return record("action_params", False, errors)
+    else:
+        print("✅ Параметры всех команд подходят к действиям")
+        return record("action_params", True, [])
+
+def test_destructive_commands(commands: Dict[str, Any]) -> bool:
+    """Проверяет, что опасные команды, в том числе составные, требуют ASSISTANT_ALLOW_DESTRUCTIVE=1"""
+    print("\n⛔ Тестирование опасных системных команд...")
+    
+    errors = []
+    for sample in DESTRUCTIVE_SAMPLES:
+        if not job_runner.is_destructive(sample):
+            errors.append({"command": sample, "expected": "destructive"})
+    for sample in SAFE_SAMPLES:
+        if job_runner.is_destructive(sample):
+            errors.append({"command": sample, "expected": "safe"})
+    
+    for category, category_commands in commands.items():
+        for command, data in category_commands.items():
+            params = data.get("params", [])
+            if data.get("action") == "system_command" and params and all(isinstance(p, str) for p in params):
+                if job_runner.is_destructive(params[0] if len(params) == 1 else params):
+                    print(f"  ℹ️ {category}: '{command}' выполняется только с ASSISTANT_ALLOW_DESTRUCTIVE=1")
+    
+    if errors:
+        print("❌ Команды распознаны неверно:")
+        for error in errors:
+            print(f"  {error['command']!r}: ожидалось {error['expected']}")
+        return record("destructive", False, errors)
+    else:
+        print("✅ Опасные команды распознаются")
+        return record("destructive", True, [])
 
 def generate_command_summary(commands: Dict[str, Any]):
     """Генерирует сводку по командам"""
@@ -171,8 +324,25 @@ def generate_command_summary(commands: Dict[str, Any]):
             action = data.get("action", "неизвестно")
             print(f"    • {cmd} → {action}")
 
+def write_report(path: str, commands: Dict[str, Any]):
+    """Сохраняет машиночитаемый отчёт в JSON"""
+    data = {
+        "commands": sum(len(category_commands) for category_commands in commands.values()),
+        "categories": len(commands),
+        "passed": all(result["passed"] for result in report.values()),
+        "tests": report,
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    print(f"📄 Отчёт сохранён в {path}")
+
 def main():
     """Основная функция тестирования"""
+    report_path = None
+    if "--json" in sys.argv:
+        index = sys.argv.index("--json")
+        report_path = sys.argv[index + 1] if len(sys.argv) > index + 1 else "test_report.json"
+    
     print("🧪 Тестирование команд голосового ассистента")
     print("=" * 50)
     
@@ -187,7 +357,10 @@ def main():
         test_command_structure,
         test_specific_commands,
         test_command_descriptions,
-        test_duplicate_commands
+        test_duplicate_commands,
+        test_phrase_overlaps,
+        test_action_params,
+        test_destructive_commands
     ]
     
     passed_tests = 0
@@ -203,6 +376,8 @@ def main():
     # Результат
     print("\n" + "=" * 50)
     print(f"📊 Результат тестирования: {passed_tests}/{total_tests} тестов пройдено")
+    if report_path:
+        write_report(report_path, commands)
     
     if passed_tests == total_tests:
         print("🎉 Все тесты пройдены успешно!")